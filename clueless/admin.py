@@ -23,4 +23,10 @@ admin.site.register(Game)
 admin.site.register(DetectiveSheet)
 admin.site.register(SheetItem)
 admin.site.register(CardReveal)
-admin.site.register(GameStreamEntry)
\ No newline at end of file
+admin.site.register(GameStreamEntry)
+admin.site.register(OpenGameSummary)
+admin.site.register(GameArchive)
+admin.site.register(GameEvent)
+admin.site.register(GameSnapshot)
+admin.site.register(ActionTiming)
+admin.site.register(ActionFetch)
\ No newline at end of file
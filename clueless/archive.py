@@ -0,0 +1,163 @@
+"""
+Archiving of completed games.  The turn by turn rows of a finished game are only read again if somebody reopens the
+game, so they are moved out of the hot tables into one compressed GameArchive row per game and put back on demand.
+
+The Game row itself, its players and its case file stay where they are, so finished games still show up in results
+and the archive can always be found from the game id.  The archive also keeps a binary snapshot of how the game ended,
+so its final state can be read without putting the rows back.
+"""
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+import datetime
+import json
+import zlib
+
+from clueless.engine_adapter import GameStateAdapter, getEngineTables
+from clueless.models import Accusation, Action, CardReveal, DetectiveSheet, Game, GameArchive, GameStreamEntry, Move, \
+    SheetItem, Suggestion, Turn, WhoWhatWhere, COMPLETE
+from clueless.snapshots import packState, unpackState
+
+ARCHIVE_FORMAT_VERSION = 1
+DEFAULT_BATCH_SIZE = 500
+
+
+def archivedQuerysets(game):
+    """
+    Every set of rows that is archived for a game, in an order where each row only refers to rows before it.
+    Rows are deleted in the reverse order
+    :param game: Game
+    :return: list of QuerySets
+    """
+    #read now, the suggestions and accusations are deleted before their WhoWhatWheres
+    #the case file is also a WhoWhatWhere, but it belongs to the game and is never archived
+    whoWhatWhereIds = list(Suggestion.objects.filter(turn__game = game).values_list('whoWhatWhere_id', flat = True))
+    whoWhatWhereIds += list(Accusation.objects.filter(turn__game = game).values_list('whoWhatWhere_id', flat = True))
+    return [
+        WhoWhatWhere.objects.filter(id__in = whoWhatWhereIds),
+        Turn.objects.filter(game = game),
+        Action.objects.filter(turn__game = game),
+        Move.objects.filter(turn__game = game),
+        Suggestion.objects.filter(turn__game = game),
+        Accusation.objects.filter(turn__game = game),
+        CardReveal.objects.filter(suggestion__turn__game = game),
+        DetectiveSheet.objects.filter(game = game),
+        SheetItem.objects.filter(detectiveSheet__game = game),
+        GameStreamEntry.objects.filter(game = game),
+    ]
+
+
+def archiveRecords(game):
+    """
+    Generates the archived rows of a game, one dictionary per row in the Django "python" serialization format
+    :param game: Game
+    """
+    for queryset in archivedQuerysets(game):
+        for record in serializers.serialize('python', queryset.order_by('pk').iterator()):
+            yield record
+
+
+def packRecords(game, records):
+    """
+    :return: compressed bytes holding the records and the game's current turn id
+    """
+    payload = {
+        'version': ARCHIVE_FORMAT_VERSION,
+        'currentTurn': game.currentTurn_id,
+        'records': list(records),
+    }
+    return zlib.compress(json.dumps(payload, cls = DjangoJSONEncoder, separators = (',', ':')).encode('utf-8'), 9)
+
+
+def unpackRecords(data):
+    """
+    :param data: bytes made by packRecords
+    :return: dictionary with the format version, current turn id and records
+    """
+    payload = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+    if payload.get('version') != ARCHIVE_FORMAT_VERSION:
+        raise RuntimeError("Unsupported game archive version {}".format(payload.get('version')))
+    return payload
+
+
+def deleteInBatches(queryset, batchSize):
+    """
+    Deletes the rows of a queryset a batch of primary keys at a time, so no single statement locks the whole set
+    :return: number of rows deleted
+    """
+    deleted = 0
+    model = queryset.model
+    pks = list(queryset.values_list('pk', flat = True))
+    for start in range(0, len(pks), batchSize):
+        model.objects.filter(pk__in = pks[start:start + batchSize]).delete()
+        deleted += len(pks[start:start + batchSize])
+    return deleted
+
+
+def archivableGames(olderThanDays):
+    """
+    :param olderThanDays: only games not updated for this many days are returned
+    :return: QuerySet of completed, unarchived games
+    """
+    cutoff = timezone.now() - datetime.timedelta(days = olderThanDays)
+    return Game.objects.filter(status = COMPLETE, lastUpdateTime__lt = cutoff, gamearchive__isnull = True).order_by('id')
+
+
+def archiveGame(game, batchSize = DEFAULT_BATCH_SIZE):
+    """
+    Moves the turn by turn rows of a completed game into a GameArchive
+    :param game: Game with status COMPLETE
+    :param batchSize: rows deleted per statement
+    :return: GameArchive
+    """
+    if game.status != COMPLETE:
+        raise RuntimeError("Only completed games can be archived")
+    with transaction.atomic():
+        records = list(archiveRecords(game))
+        archive = GameArchive(game = game, data = packRecords(game, records), rowCount = len(records),
+                              snapshot = packState(GameStateAdapter(game).load()))
+        archive.save()
+
+        #the current turn is about to be deleted, and deleting it would take the game with it
+        Game.objects.filter(id = game.id).update(currentTurn = None)
+        game.currentTurn = None
+        for queryset in reversed(archivedQuerysets(game)):
+            deleteInBatches(queryset, batchSize)
+    return archive
+
+
+def archivedState(game):
+    """
+    :param game: Game
+    :return: engine GameState the game ended in, or None if it is not archived or was archived without a snapshot
+    """
+    snapshot = GameArchive.objects.filter(game = game).values_list('snapshot', flat = True).first()
+    if snapshot is None:
+        return None
+    return unpackState(snapshot, getEngineTables())
+
+
+def rehydrateGame(game):
+    """
+    Puts the archived rows of a game back into their tables and removes the archive
+    :param game: Game
+    :return: True if the game was archived and has been restored, False if it was not archived
+    """
+    if not GameArchive.objects.filter(game = game).exists():
+        return False
+    with transaction.atomic():
+        #polls of several seats can get here at once, only the first to lock the archive restores it
+        try:
+            archive = GameArchive.objects.select_for_update().get(game = game)
+        except GameArchive.DoesNotExist:
+            return False
+        payload = unpackRecords(archive.data)
+        #raw saves keep the original ids
+        for restored in serializers.deserialize('python', payload['records']):
+            restored.save()
+        Game.objects.filter(id = game.id).update(currentTurn = payload['currentTurn'])
+        game.currentTurn_id = payload['currentTurn']
+        archive.delete()
+    return True
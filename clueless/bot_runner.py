@@ -0,0 +1,132 @@
+"""
+Background play for bot seats.  A BotRunner finds the started games that are waiting on a bot, loads each into the
+rules engine, lets its bots act until a user has to, and saves what they did in one go, unless the game changed in
+the meantime.
+
+Games are advanced on a pool of worker threads, and every bot decision runs on a second pool under a fixed latency
+budget.  A decision that misses the budget, or fails, is replaced by a random one, so a slow strategy can never hold
+up the users in its game.
+"""
+from django.db import connection, transaction
+
+import concurrent.futures
+import logging
+import time
+
+from clueless.bots import RandomBot, createBot, playBotStep
+from clueless.engine_adapter import GameStateAdapter
+from clueless.models import ActionTiming, CardReveal, Game, Player, STARTED
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_DECISION_BUDGET = 0.5 #seconds
+MAX_BOT_STEPS = 100 #per game and pass, so a game left to bots can't keep a worker forever
+
+
+class BotRunner(object):
+    """
+    Plays the bot seats of stored games
+    """
+    def __init__(self, workers = DEFAULT_WORKERS, decisionBudget = DEFAULT_DECISION_BUDGET):
+        """
+        :param workers: number of games advanced at the same time
+        :param decisionBudget: seconds a bot gets for each decision
+        """
+        self.decisionBudget = decisionBudget
+        self.games = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+        self.decisions = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+
+    def shutdown(self):
+        self.games.shutdown()
+        self.decisions.shutdown(wait = False)
+
+    def pendingGameIds(self):
+        """
+        :return: sorted list of the ids of started games where it is a bot's turn or a bot has to reveal a card
+        """
+        #botStrategy is empty for user players
+        turnGameIds = Game.objects.filter(status = STARTED, currentTurn__player__botStrategy__gt = "").values_list(
+            'id', flat = True)
+        revealGameIds = CardReveal.objects.filter(
+            status = 1, revealingPlayer__botStrategy__gt = "", suggestion__turn__game__status = STARTED).values_list(
+            'suggestion__turn__game_id', flat = True)
+        return sorted(set(turnGameIds) | set(revealGameIds))
+
+    def runOnce(self):
+        """
+        Advances every game that is waiting on a bot, a game per worker
+        :return: dictionary of game id -> number of bot steps taken
+        """
+        futures = dict((self.games.submit(self.__advanceInWorker, gameId), gameId) for gameId in self.pendingGameIds())
+        steps = dict()
+        for future in concurrent.futures.as_completed(futures):
+            steps[futures[future]] = future.result()
+        return steps
+
+    def advanceGame(self, gameId):
+        """
+        Lets the bots of a game act until it is over, waiting on a user, or MAX_BOT_STEPS have been taken
+        :return: number of bot steps taken
+        """
+        start = time.time()
+        #the bots decide without holding any lock, so users of the game are never kept waiting on them
+        game = Game.objects.get(id = gameId)
+        if game.status != STARTED:
+            return 0
+        adapter = GameStateAdapter(game)
+        state = adapter.load(history = True)
+
+        bots = dict()
+        fallbacks = dict()
+        for playerId, strategyName in Player.objects.filter(currentGame = game).exclude(
+                botStrategy = "").values_list('id', 'botStrategy'):
+            seatIndex = state.seatIndex(playerId)
+            bots[seatIndex] = createBot(strategyName, game.rng("bot:{}:{}".format(playerId, game.currentSequence)))
+            fallbacks[bots[seatIndex]] = RandomBot(game.rng("fallback:{}:{}".format(playerId, game.currentSequence)))
+
+        def decide(bot, decisionName, state, seatIndex, *args):
+            return self.timedDecision(bot, fallbacks[bot], decisionName, state, seatIndex, *args)
+
+        steps = 0
+        while steps < MAX_BOT_STEPS and playBotStep(state, bots, decide):
+            steps += 1
+        #nothing to save while the game waits on a user
+        if not steps:
+            return 0
+
+        with transaction.atomic():
+            #the row lock is only held to save, and keeps two runners from both saving a pass of the same game
+            current = Game.objects.select_for_update().filter(id = gameId).values_list(
+                'currentSequence', 'status').get()
+            if current != (game.currentSequence, STARTED):
+                #the game changed while the bots were deciding, the next pass plays it from the new state
+                return 0
+            previousUpdateTime = game.lastUpdateTime
+            adapter.save()
+            ActionTiming.record(game.id, "bots", None, start, previousUpdateTime)
+        return steps
+
+    def timedDecision(self, bot, fallback, decisionName, state, seatIndex, *args):
+        """
+        Makes a bot decision on the decision pool, on a copy of the state so a late bot can't see it change
+        :return: the bot's decision, or the fallback bot's if the bot fails or is over budget
+        """
+        future = self.decisions.submit(getattr(bot, decisionName), state.copy(), seatIndex, *args)
+        try:
+            return future.result(timeout = self.decisionBudget)
+        except concurrent.futures.TimeoutError:
+            logger.warning("{} bot went over budget for {}, deciding at random".format(bot.name, decisionName))
+        except Exception:
+            logger.exception("{} bot failed in {}, deciding at random".format(bot.name, decisionName))
+        return getattr(fallback, decisionName)(state, seatIndex, *args)
+
+    def __advanceInWorker(self, gameId):
+        try:
+            return self.advanceGame(gameId)
+        except Exception:
+            logger.exception("Bots could not advance game {}".format(gameId))
+            return 0
+        finally:
+            #every worker thread has its own connection
+            connection.close()
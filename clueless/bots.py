@@ -0,0 +1,272 @@
+"""
+Bot players.  A bot plays one seat of an engine GameState through four decisions: where to move, what to suggest,
+which card to reveal and whether to accuse.  Like the engine this is plain Python with no Django imports, so bots can
+play whole games in memory; clueless.bot_runner plays the bot seats of stored games.
+
+Every decision gets a GameState it may read but must not change, and the index of the seat it plays.  Bots only look
+at what their player could know at the table: their own hand, the cards revealed to them and who could disprove
+their own suggestions.
+"""
+import functools
+import random
+
+
+class Bot(object):
+    """
+    Base class of the bot strategies
+    """
+    name = None
+
+    def __init__(self, rng = None):
+        """
+        :param rng: random.Random the bot draws every random choice from
+        """
+        self.rng = rng if rng is not None else random.Random()
+
+    def chooseMove(self, state, seatIndex, moves):
+        """
+        :param moves: sorted list of the spaces the piece can move to
+        :return: space to move to, or None to stay (only allowed in a room)
+        """
+        raise NotImplementedError()
+
+    def chooseSuggestion(self, state, seatIndex):
+        """
+        :return: (character, weapon) to suggest in the current room, or None to make no suggestion
+        """
+        raise NotImplementedError()
+
+    def chooseReveal(self, state, seatIndex, cards):
+        """
+        :param cards: sorted list of the suggested cards the seat holds
+        :return: card to reveal
+        """
+        raise NotImplementedError()
+
+    def chooseAccusation(self, state, seatIndex):
+        """
+        :return: (character, room, weapon) to accuse, or None to make no accusation
+        """
+        raise NotImplementedError()
+
+    def guessAccusation(self, state, seatIndex):
+        """
+        Accusation made when it is the only action left, e.g. when the piece is boxed in at the start of a turn
+        :return: (character, room, weapon) picked from the cards that could be in the case file
+        """
+        characters, rooms, weapons = candidateCards(state, seatIndex)
+        return (self.rng.choice(characters), self.rng.choice(rooms), self.rng.choice(weapons))
+
+
+def unseenCards(state, seatIndex):
+    """
+    :return: (characters, rooms, weapons) lists of the cards that are neither in the seat's hand nor revealed to it,
+    i.e. the cards that could still be in the case file
+    """
+    seat = state.seats[seatIndex]
+    seen = seat.hand | seat.known
+    deck = state.deck
+    return ([c for c in deck.characters if c not in seen], [c for c in deck.rooms if c not in seen],
+            [c for c in deck.weapons if c not in seen])
+
+
+def candidateCards(state, seatIndex):
+    """
+    Narrows the unseen cards down with the seat's suggestions that nobody could disprove: every suggested card
+    outside its own hand must then be in the case file.  Only the suggestions in state.events are used
+    :return: (characters, rooms, weapons) lists of the cards that could still be in the case file
+    """
+    characters, rooms, weapons = unseenCards(state, seatIndex)
+    hand = state.seats[seatIndex].hand
+    for event in state.events:
+        if event[0] == "Suggestion" and event[1] == seatIndex and event[4] is None:
+            character, room, weapon = event[2]
+            if character not in hand:
+                characters = [character]
+            if room not in hand:
+                rooms = [room]
+            if weapon not in hand:
+                weapons = [weapon]
+    return (characters, rooms, weapons)
+
+
+def solvedAccusation(state, seatIndex):
+    """
+    :return: (character, room, weapon) if only one card of each type can be in the case file, otherwise None
+    """
+    characters, rooms, weapons = candidateCards(state, seatIndex)
+    if len(characters) == 1 and len(rooms) == 1 and len(weapons) == 1:
+        return (characters[0], rooms[0], weapons[0])
+    return None
+
+
+@functools.lru_cache(maxsize = 1024)
+def distancesTo(board, targets):
+    """
+    Cached, a board only has so many sets of rooms left to visit
+    :param targets: frozenset of the spaces to measure the distance to
+    :return: dictionary of space -> fewest moves to the nearest target, ignoring other pieces
+    """
+    distances = dict((space, 0) for space in targets)
+    frontier = list(targets)
+    while frontier:
+        nextFrontier = list()
+        for space in frontier:
+            for neighbour in board.neighbours.get(space, ()):
+                if neighbour not in distances:
+                    distances[neighbour] = distances[space] + 1
+                    nextFrontier.append(neighbour)
+        frontier = nextFrontier
+    return distances
+
+
+class RandomBot(Bot):
+    """
+    Moves, suggests and reveals at random, and only accuses once it has worked out the case file
+    """
+    name = "random"
+
+    def chooseMove(self, state, seatIndex, moves):
+        return self.rng.choice(moves) if moves else None
+
+    def chooseSuggestion(self, state, seatIndex):
+        return (self.rng.choice(state.deck.characters), self.rng.choice(state.deck.weapons))
+
+    def chooseReveal(self, state, seatIndex, cards):
+        return self.rng.choice(cards)
+
+    def chooseAccusation(self, state, seatIndex):
+        return solvedAccusation(state, seatIndex)
+
+
+class DetectiveBot(Bot):
+    """
+    Heads for the nearest room it has not ruled out and stays there while it is still a suspect, suggests cards it
+    has not ruled out, and accuses once it has worked out the case file
+    """
+    name = "detective"
+
+    def chooseMove(self, state, seatIndex, moves):
+        characters, rooms, weapons = candidateCards(state, seatIndex)
+        here = state.spaceOf(state.seats[seatIndex])
+        if state.board.roomAt(here) in rooms:
+            return None
+        if not moves:
+            return None
+        distances = distancesTo(state.board, frozenset(state.board.roomSpaces[room] for room in rooms))
+        nearest = min(distances.get(space, len(distances)) for space in moves)
+        return self.rng.choice([space for space in moves if distances.get(space, len(distances)) == nearest])
+
+    def chooseSuggestion(self, state, seatIndex):
+        characters, rooms, weapons = candidateCards(state, seatIndex)
+        return (self.rng.choice(characters or state.deck.characters), self.rng.choice(weapons or state.deck.weapons))
+
+    def chooseReveal(self, state, seatIndex, cards):
+        return self.rng.choice(cards)
+
+    def chooseAccusation(self, state, seatIndex):
+        return solvedAccusation(state, seatIndex)
+
+
+class RecklessBot(DetectiveBot):
+    """
+    Plays like the detective, but takes a guess as soon as no more than RECKLESS_SOLUTIONS case files are left
+    """
+    name = "reckless"
+    RECKLESS_SOLUTIONS = 2
+
+    def chooseAccusation(self, state, seatIndex):
+        characters, rooms, weapons = candidateCards(state, seatIndex)
+        if len(characters) * len(rooms) * len(weapons) <= self.RECKLESS_SOLUTIONS:
+            return self.guessAccusation(state, seatIndex)
+        return None
+
+
+BOT_STRATEGIES = dict((strategy.name, strategy) for strategy in (RandomBot, DetectiveBot, RecklessBot))
+BOT_STRATEGY_CHOICES = (
+    ("", "Nobody"),
+    (RandomBot.name, "Random bots"),
+    (DetectiveBot.name, "Detective bots"),
+    (RecklessBot.name, "Reckless bots"),
+)
+
+
+def createBot(strategyName, rng = None):
+    """
+    :param strategyName: key of BOT_STRATEGIES
+    :param rng: random.Random for the bot's choices
+    :return: Bot
+    """
+    strategy = BOT_STRATEGIES.get(strategyName)
+    if strategy is None:
+        raise RuntimeError("Unknown bot strategy {}".format(strategyName))
+    return strategy(rng)
+
+
+def botName(characterName):
+    """
+    :return: name a bot seat goes by in the game stream and the player list
+    """
+    return "{} (bot)".format(characterName)
+
+
+def callDecision(bot, decisionName, state, seatIndex, *args):
+    """
+    Default way playBotStep makes a decision: call the bot directly
+    """
+    return getattr(bot, decisionName)(state, seatIndex, *args)
+
+
+def playBotStep(state, bots, decide = callDecision):
+    """
+    Lets the bot the game is waiting on act: the revealing seat if a card reveal is pending, otherwise the seat
+    whose turn it is.  A turn is played up to its suggestion, so the reveals can be made before the rest of it, and
+    decisions that break the rules are treated as passing on the action
+    :param bots: dictionary of seat index -> Bot, seats not in it are played by users
+    :param decide: callable(bot, decision name, state, seat index, *args) returning the decision
+    :return: True if a bot acted, False if the game is over or waiting on a user
+    """
+    if state.finished:
+        return False
+
+    if state.revealingSeat is not None:
+        seatIndex = state.revealingSeat
+        if seatIndex not in bots:
+            return False
+        cards = state.revealableCards()
+        card = decide(bots[seatIndex], "chooseReveal", state, seatIndex, cards)
+        state.reveal(card if card in cards else cards[0])
+        return True
+
+    seatIndex = state.turnSeat
+    bot = bots.get(seatIndex)
+    if bot is None:
+        return False
+    deck = state.deck
+
+    if "Move" in state.availableActions():
+        moves = state.validMoves()
+        space = decide(bot, "chooseMove", state, seatIndex, moves)
+        if space in moves:
+            state.move(space)
+
+    if "Suggestion" in state.availableActions():
+        suggestion = decide(bot, "chooseSuggestion", state, seatIndex)
+        if suggestion is not None and suggestion[0] in deck.characters and suggestion[1] in deck.weapons:
+            state.suggest(*suggestion)
+            return True
+
+    actions = state.availableActions()
+    if "Accusation" in actions:
+        accusation = decide(bot, "chooseAccusation", state, seatIndex)
+        if accusation is not None and (accusation[0] not in deck.characters or accusation[1] not in deck.rooms or
+                                       accusation[2] not in deck.weapons):
+            accusation = None
+        if accusation is None and "EndTurn" not in actions:
+            accusation = bot.guessAccusation(state, seatIndex)
+        if accusation is not None:
+            state.accuse(*accusation)
+            return True
+
+    state.endTurn()
+    return True
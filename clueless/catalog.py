@@ -0,0 +1,187 @@
+"""
+Process wide catalog of the game cards.  The 21 cards never change after the default objects are created, so they
+are loaded once per worker and every later lookup is answered from memory without touching the database.
+
+Other processes learn about a change through a version token kept in the Django cache: saving or deleting a card
+replaces the token, and every catalog access compares its own token against the cached one.
+"""
+from collections import namedtuple
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+import logging
+import threading
+import uuid
+
+from clueless.models import Card, Character, Room, Space, Weapon, CHARACTER_CARD, ROOM_CARD, WEAPON_CARD
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'clueless.catalog.version'
+
+"""
+Read only description of a single card.  model is the shared Character, Room or Weapon instance and must not be
+modified
+"""
+CatalogCard = namedtuple('CatalogCard', [
+    'card_id', 'pk', 'name', 'card_type', 'ordinal', 'color', 'defaultSpace_id', 'space_id', 'model'
+])
+
+
+class CardCatalog(object):
+    """
+    Immutable set of lookup tables over every card in the game
+    """
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = tuple(sorted(entries, key=lambda e: (e.ordinal is None, e.ordinal or 0, e.card_id)))
+        self.__byCardId = dict((e.card_id, e) for e in self.entries)
+        self.__roomsByPk = dict((e.pk, e) for e in self.entries if e.card_type == ROOM_CARD)
+        self.__roomsBySpaceId = dict((e.space_id, e) for e in self.entries if e.card_type == ROOM_CARD)
+        self.characters = tuple(e.model for e in self.entries if e.card_type == CHARACTER_CARD)
+        self.rooms = tuple(e.model for e in self.entries if e.card_type == ROOM_CARD)
+        self.weapons = tuple(e.model for e in self.entries if e.card_type == WEAPON_CARD)
+
+    @classmethod
+    def load(cls, version):
+        """
+        Reads every card from the database
+        :param version: version token the loaded catalog will be tagged with
+        :return: CardCatalog
+        """
+        entries = list()
+        for c in Character.objects.select_related('defaultSpace'):
+            entries.append(CatalogCard(c.card_id, c.pk, c.name, CHARACTER_CARD, c.ordinal, c.characterColor,
+                                       c.defaultSpace_id, None, c))
+
+        rooms = list(Room.objects.all())
+        roomSpaceIds = dict(Space.objects.filter(
+            spaceCollector__id__in=[r.pk for r in rooms]).values_list('spaceCollector_id', 'id'))
+        for r in rooms:
+            entries.append(CatalogCard(r.card_id, r.pk, r.name, ROOM_CARD, r.ordinal, None,
+                                       None, roomSpaceIds.get(r.pk), r))
+
+        for w in Weapon.objects.all():
+            entries.append(CatalogCard(w.card_id, w.pk, w.name, WEAPON_CARD, w.ordinal, None, None, None, w))
+
+        return cls(version, entries)
+
+    def card(self, card_id):
+        """
+        :param card_id: id of any card
+        :return: The Character, Room or Weapon for the id, raises Card.DoesNotExist otherwise
+        """
+        return self.entry(card_id).model
+
+    def entry(self, card_id):
+        """
+        :param card_id: id of any card
+        :return: CatalogCard for the id, raises Card.DoesNotExist otherwise
+        """
+        try:
+            return self.__byCardId[int(card_id)]
+        except (KeyError, TypeError, ValueError):
+            raise Card.DoesNotExist("Card {} does not exist".format(card_id))
+
+    def character(self, card_id):
+        return self.__typedCard(card_id, CHARACTER_CARD, Character)
+
+    def room(self, card_id):
+        return self.__typedCard(card_id, ROOM_CARD, Room)
+
+    def weapon(self, card_id):
+        return self.__typedCard(card_id, WEAPON_CARD, Weapon)
+
+    def roomByPk(self, pk):
+        """
+        Rooms are keyed by their space collection id everywhere outside of the Card table
+        :param pk: Room primary key
+        :return: CatalogCard for the room
+        """
+        try:
+            return self.__roomsByPk[pk]
+        except KeyError:
+            raise Room.DoesNotExist("Room {} does not exist".format(pk))
+
+    def roomForSpace(self, space_id):
+        """
+        :param space_id: id of a board space
+        :return: CatalogCard of the room occupying the space, or None if the space is not a room
+        """
+        return self.__roomsBySpaceId.get(space_id)
+
+    def isRoomSpace(self, space_id):
+        return space_id in self.__roomsBySpaceId
+
+    def cardIds(self, excludeIds = ()):
+        """
+        :param excludeIds: card ids to leave out
+        :return: list of card ids in ordinal order
+        """
+        return [e.card_id for e in self.entries if e.card_id not in excludeIds]
+
+    def __typedCard(self, card_id, cardType, cardClass):
+        try:
+            e = self.__byCardId[int(card_id)]
+        except (KeyError, TypeError, ValueError):
+            e = None
+        if e is None or e.card_type != cardType:
+            raise cardClass.DoesNotExist("{} {} does not exist".format(cardClass.__name__, card_id))
+        return e.model
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def _currentVersion():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def getCatalog():
+    """
+    :return: The loaded CardCatalog, reloading it first if the cards changed since it was built
+    """
+    global _catalog
+    version = _currentVersion()
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+    with _lock:
+        if _catalog is None or _catalog.version != version:
+            _catalog = CardCatalog.load(version)
+        return _catalog
+
+
+def preloadCatalog():
+    """
+    Loads the catalog ahead of the first request.  Called once when a worker starts
+    """
+    try:
+        getCatalog()
+    except Exception:
+        #tables may not exist yet, e.g. before the first migrate, the catalog will load on first use instead
+        logger.exception("unable to preload card catalog")
+
+
+def invalidateCatalog():
+    """
+    Forces every process to reload the catalog on its next access
+    """
+    global _catalog
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    _catalog = None
+
+
+def _cardChanged(sender, **kwargs):
+    invalidateCatalog()
+
+
+#room spaces are part of the catalog, and the engine board is built alongside it
+for _cardClass in (Card, Character, Room, Weapon, Space):
+    post_save.connect(_cardChanged, sender=_cardClass, dispatch_uid='clueless.catalog.save.' + _cardClass.__name__)
+    post_delete.connect(_cardChanged, sender=_cardClass, dispatch_uid='clueless.catalog.delete.' + _cardClass.__name__)
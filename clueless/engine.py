@@ -0,0 +1,396 @@
+"""
+Headless Clue-Less rules engine.  Plain Python with no Django imports, so a whole game can be played in memory with
+no database access, e.g. for bots and simulations.  clueless.engine_adapter loads a GameState from the models and
+writes one back.
+
+Cards are numbered by their position in the deck, which follows the card ordinals, and spaces, players and
+characters are whatever hashable keys the caller uses: (x, y) positions on the standard board, database ids when
+loaded by the adapter.  Rule violations raise RuntimeError, like the model methods.
+"""
+import random
+
+"""
+Card type discriminator, stored on every Card so type filtering does not need to join a child table
+"""
+CHARACTER_CARD = 0
+ROOM_CARD = 1
+WEAPON_CARD = 2
+CARD_TYPE_CHOICES = (
+    (CHARACTER_CARD, "Character"),
+    (ROOM_CARD, "Room"),
+    (WEAPON_CARD, "Weapon"),
+)
+
+"""
+Turn phase, a bit set of the actions already taken during a turn
+"""
+TURN_START = 0
+TURN_MOVED = 1
+TURN_SUGGESTED = 2
+TURN_MOVED_SUGGESTED = TURN_MOVED | TURN_SUGGESTED
+TURN_ACCUSED = 4
+TURN_MOVED_ACCUSED = TURN_MOVED | TURN_ACCUSED
+TURN_SUGGESTED_ACCUSED = TURN_SUGGESTED | TURN_ACCUSED
+TURN_MOVED_SUGGESTED_ACCUSED = TURN_MOVED | TURN_SUGGESTED | TURN_ACCUSED
+TURN_PHASE_CHOICES = (
+    (TURN_START, "Start"),
+    (TURN_MOVED, "Moved"),
+    (TURN_SUGGESTED, "Suggested"),
+    (TURN_MOVED_SUGGESTED, "Moved and suggested"),
+    (TURN_ACCUSED, "Accused"),
+    (TURN_MOVED_ACCUSED, "Moved and accused"),
+    (TURN_SUGGESTED_ACCUSED, "Suggested and accused"),
+    (TURN_MOVED_SUGGESTED_ACCUSED, "Moved, suggested and accused"),
+)
+
+"""
+(phase, action) -> next phase.  An action that is not in the table is not allowed in that phase: a move must be the
+first action, a suggestion can't follow another suggestion or an accusation, and only one accusation can be made
+"""
+TURN_PHASE_TRANSITIONS = {
+    (TURN_START, "Move"): TURN_MOVED,
+    (TURN_START, "Suggestion"): TURN_SUGGESTED,
+    (TURN_START, "Accusation"): TURN_ACCUSED,
+    (TURN_MOVED, "Suggestion"): TURN_MOVED_SUGGESTED,
+    (TURN_MOVED, "Accusation"): TURN_MOVED_ACCUSED,
+    (TURN_SUGGESTED, "Accusation"): TURN_SUGGESTED_ACCUSED,
+    (TURN_MOVED_SUGGESTED, "Accusation"): TURN_MOVED_SUGGESTED_ACCUSED,
+}
+
+
+def availableTurnActions(phase, inRoom):
+    """
+    :param phase: current turn phase
+    :param inRoom: whether the turn's player is in a room (otherwise they are in a hallway)
+    :return: list of the actions that can be taken next, including "EndTurn"
+    """
+    validActions = list()
+    for actionName in ("Move", "Suggestion", "Accusation"):
+        if (phase, actionName) in TURN_PHASE_TRANSITIONS and (actionName != "Suggestion" or inRoom):
+            validActions.append(actionName)
+
+    #a player can't start and end a turn in a hallway
+    if phase & TURN_MOVED or inRoom:
+        validActions.append("EndTurn")
+
+    return validActions
+
+
+"""
+The standard game, as built by the create_default_objects command.  Spaces are (x, y) positions on the 5x5 grid
+"""
+STANDARD_WEAPONS = ("Rope", "Lead Pipe", "Knife", "Wrench", "Candlestick", "Revolver")
+STANDARD_ROOMS = (
+    ("Study", (1, 1)), ("Hall", (3, 1)), ("Lounge", (5, 1)),
+    ("Library", (1, 3)), ("Billiard Room", (3, 3)), ("Dining Room", (5, 3)),
+    ("Conservatory", (1, 5)), ("Ballroom", (3, 5)), ("Kitchen", (5, 5)),
+)
+STANDARD_HALLWAYS = (
+    (2, 1), (4, 1), (1, 2), (3, 2), (5, 2), (2, 3), (4, 3), (1, 4), (3, 4), (5, 4), (2, 5), (4, 5),
+)
+STANDARD_SECRET_PASSAGES = (((1, 1), (5, 5)), ((5, 1), (1, 5)))
+STANDARD_CHARACTERS = (
+    ("Miss Scarlet", (4, 1)), ("Col. Mustard", (5, 2)), ("Mrs. White", (4, 5)),
+    ("Mr. Green", (2, 5)), ("Mrs. Peacock", (1, 4)), ("Prof. Plum", (1, 2)),
+)
+
+
+class Deck(object):
+    """
+    Every card of the game.  A card is its index in the deck
+    """
+    __slots__ = ('names', 'cardTypes', 'characters', 'rooms', 'weapons')
+
+    def __init__(self, names, cardTypes):
+        self.names = tuple(names)
+        self.cardTypes = tuple(cardTypes)
+        self.characters = tuple(c for c, t in enumerate(self.cardTypes) if t == CHARACTER_CARD)
+        self.rooms = tuple(c for c, t in enumerate(self.cardTypes) if t == ROOM_CARD)
+        self.weapons = tuple(c for c, t in enumerate(self.cardTypes) if t == WEAPON_CARD)
+
+    @classmethod
+    def standard(cls):
+        """
+        :return: Deck in the order create_default_objects creates the cards: weapons, rooms, characters
+        """
+        names = list(STANDARD_WEAPONS) + [name for name, space in STANDARD_ROOMS] + \
+            [name for name, space in STANDARD_CHARACTERS]
+        cardTypes = [WEAPON_CARD] * len(STANDARD_WEAPONS) + [ROOM_CARD] * len(STANDARD_ROOMS) + \
+            [CHARACTER_CARD] * len(STANDARD_CHARACTERS)
+        return cls(names, cardTypes)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Board(object):
+    """
+    Spaces and how they connect.  Every space that is not a room is a hallway
+    """
+    __slots__ = ('neighbours', 'roomSpaces', 'spaceRooms', 'startSpaces')
+
+    def __init__(self, links, roomSpaces, startSpaces):
+        """
+        :param links: iterable of (space, space) pairs a piece can move between, in either direction
+        :param roomSpaces: dictionary of room card -> space
+        :param startSpaces: dictionary of character card -> space the character starts on
+        """
+        neighbours = dict()
+        for a, b in links:
+            neighbours.setdefault(a, set()).add(b)
+            neighbours.setdefault(b, set()).add(a)
+        self.neighbours = dict((space, frozenset(adjacent)) for space, adjacent in neighbours.items())
+        self.roomSpaces = dict(roomSpaces)
+        self.spaceRooms = dict((space, room) for room, space in self.roomSpaces.items())
+        self.startSpaces = dict(startSpaces)
+
+    @classmethod
+    def standard(cls, deck):
+        """
+        :param deck: Deck.standard()
+        :return: the standard 5x5 board, with the two secret passages
+        """
+        positions = set(space for name, space in STANDARD_ROOMS) | set(STANDARD_HALLWAYS)
+        links = list(STANDARD_SECRET_PASSAGES)
+        for x, y in positions:
+            if (x + 1, y) in positions:
+                links.append(((x, y), (x + 1, y)))
+            if (x, y + 1) in positions:
+                links.append(((x, y), (x, y + 1)))
+        roomSpaces = dict(zip(deck.rooms, [space for name, space in STANDARD_ROOMS]))
+        startSpaces = dict(zip(deck.characters, [space for name, space in STANDARD_CHARACTERS]))
+        return cls(links, roomSpaces, startSpaces)
+
+    def isRoom(self, space):
+        return space in self.spaceRooms
+
+    def roomAt(self, space):
+        """
+        :return: room card occupying the space, or None for a hallway
+        """
+        return self.spaceRooms.get(space)
+
+    def areNeighbours(self, fromSpace, toSpace):
+        return toSpace in self.neighbours.get(fromSpace, ())
+
+    def reachableSpaces(self, fromSpace, occupiedSpaces):
+        """
+        :param occupiedSpaces: spaces holding a user player's piece, only one piece fits in a hallway
+        :return: sorted list of the spaces a piece on fromSpace can move to
+        """
+        return sorted(space for space in self.neighbours.get(fromSpace, ())
+                      if space in self.spaceRooms or space not in occupiedSpaces)
+
+
+class Seat(object):
+    """
+    A user player, in turn order
+    """
+    __slots__ = ('playerId', 'character', 'hand', 'known', 'eliminated')
+
+    def __init__(self, playerId, character, hand = (), known = (), eliminated = False):
+        self.playerId = playerId
+        self.character = character
+        self.hand = frozenset(hand)
+        self.known = set(known) #cards revealed to this player
+        self.eliminated = eliminated
+
+
+class GameState(object):
+    """
+    Everything the rules need about one game.  pieces holds the space of every character, played or not.
+
+    Every rule applied is appended to events, so the caller can persist or describe what happened:
+        ("Move", seat, fromSpace, toSpace)
+        ("Suggestion", seat, (character, room, weapon), skipped seats, revealing seat or None)
+        ("Reveal", revealing seat, card, skipped seats, next revealing seat or None, suggesting seat)
+        ("Accusation", seat, (character, room, weapon), correct)
+        ("Turn", seat) when a new turn starts
+    """
+    __slots__ = ('board', 'deck', 'seats', 'pieces', 'caseFile', 'turnSeat', 'phase', 'suggestion',
+                 'revealingSeat', 'winnerSeat', 'events')
+
+    def __init__(self, board, deck, seats, pieces, caseFile, turnSeat = 0, phase = TURN_START, suggestion = None,
+                 revealingSeat = None, winnerSeat = None):
+        self.board = board
+        self.deck = deck
+        self.seats = list(seats)
+        self.pieces = dict(pieces)
+        self.caseFile = tuple(caseFile) #(character, room, weapon)
+        self.turnSeat = turnSeat
+        self.phase = phase
+        self.suggestion = suggestion #(character, room, weapon) still being disproved
+        self.revealingSeat = revealingSeat #seat asked to reveal a card for the suggestion
+        self.winnerSeat = winnerSeat
+        self.events = list()
+
+    @classmethod
+    def newGame(cls, board, deck, players, seed):
+        """
+        Draws the case file and deals the cards the same way Game.initializeGame and Game.startGame do, so the same
+        seed gives the same game as long as the deck is in card ordinal order
+        :param players: list of (playerId, character card) in seat order
+        :param seed: game seed
+        :return: GameState at the start of the first turn
+        """
+        caseRng = random.Random("{}:{}".format(seed, "casefile"))
+        caseFile = (caseRng.choice(deck.characters), caseRng.choice(deck.rooms), caseRng.choice(deck.weapons))
+
+        cards = [c for c in range(0, len(deck)) if c not in caseFile]
+        random.Random("{}:{}".format(seed, "deal")).shuffle(cards)
+        seats = [Seat(playerId, character, cards[i::len(players)]) for i, (playerId, character) in enumerate(players)]
+        return cls(board, deck, seats, board.startSpaces, caseFile)
+
+    def copy(self):
+        """
+        :return: independent GameState sharing the immutable board and deck
+        """
+        seats = [Seat(s.playerId, s.character, s.hand, s.known, s.eliminated) for s in self.seats]
+        state = GameState(self.board, self.deck, seats, self.pieces, self.caseFile, self.turnSeat, self.phase,
+                          self.suggestion, self.revealingSeat, self.winnerSeat)
+        state.events = list(self.events)
+        return state
+
+    @property
+    def finished(self):
+        return self.winnerSeat is not None
+
+    @property
+    def currentSeat(self):
+        return self.seats[self.turnSeat]
+
+    def seatIndex(self, playerId):
+        for i, seat in enumerate(self.seats):
+            if seat.playerId == playerId:
+                return i
+        raise RuntimeError("Player {} has no seat in this game".format(playerId))
+
+    def spaceOf(self, seat):
+        return self.pieces[seat.character]
+
+    def inRoom(self, seat):
+        return self.board.isRoom(self.spaceOf(seat))
+
+    def nextSeat(self, seatIndex, removeLosingPlayers = True):
+        """
+        :return: index of the seat after seatIndex in turn order, or None if nobody is left
+        """
+        for step in range(1, len(self.seats) + 1):
+            nextIndex = (seatIndex + step) % len(self.seats)
+            if not removeLosingPlayers or not self.seats[nextIndex].eliminated:
+                return nextIndex
+        return None
+
+    def activeSeats(self):
+        return [i for i, seat in enumerate(self.seats) if not seat.eliminated]
+
+    def availableActions(self):
+        if self.finished:
+            return []
+        return availableTurnActions(self.phase, self.inRoom(self.currentSeat))
+
+    def validMoves(self):
+        """
+        :return: sorted list of the spaces the current player can move to
+        """
+        occupied = set(self.spaceOf(seat) for seat in self.seats)
+        return self.board.reachableSpaces(self.spaceOf(self.currentSeat), occupied)
+
+    def __advance(self, actionName):
+        if self.finished:
+            raise RuntimeError("Game is over")
+        nextPhase = TURN_PHASE_TRANSITIONS.get((self.phase, actionName))
+        if nextPhase is None:
+            raise RuntimeError("{} not allowed in turn phase {}".format(actionName, self.phase))
+        self.phase = nextPhase
+
+    def move(self, toSpace):
+        """
+        Moves the current player to a neighbouring space
+        """
+        if toSpace not in self.validMoves():
+            raise RuntimeError("Invalid move to {}".format(toSpace))
+        self.__advance("Move")
+        self.events.append(("Move", self.turnSeat, self.spaceOf(self.currentSeat), toSpace))
+        self.pieces[self.currentSeat.character] = toSpace
+
+    def suggest(self, character, weapon):
+        """
+        Suggests the character did it with the weapon in the room the current player is in.  The suggested
+        character is moved into the room and the first player holding a suggested card is asked to reveal one
+        :return: list of seat indexes passed over because they hold none of the cards
+        """
+        room = self.board.roomAt(self.spaceOf(self.currentSeat))
+        if room is None:
+            raise RuntimeError("Player must be in a room to make a suggestion")
+        self.__advance("Suggestion")
+        self.pieces[character] = self.board.roomSpaces[room]
+        self.suggestion = (character, room, weapon)
+        skipped = self.__askNextHolder(self.turnSeat)
+        self.events.append(("Suggestion", self.turnSeat, (character, room, weapon), skipped, self.revealingSeat))
+        return skipped
+
+    def revealableCards(self):
+        """
+        :return: sorted list of the suggested cards the revealing player holds
+        """
+        if self.revealingSeat is None:
+            return []
+        return sorted(self.seats[self.revealingSeat].hand.intersection(self.suggestion))
+
+    def reveal(self, card):
+        """
+        The revealing player shows one of their suggested cards to the suggesting player, then the next holder round
+        the table is asked
+        :return: list of seat indexes passed over because they hold none of the cards
+        """
+        if card not in self.revealableCards():
+            raise RuntimeError("Card {} can't be revealed".format(card))
+        self.currentSeat.known.add(card)
+        revealingSeat = self.revealingSeat
+        skipped = self.__askNextHolder(revealingSeat)
+        self.events.append(("Reveal", revealingSeat, card, skipped, self.revealingSeat, self.turnSeat))
+        return skipped
+
+    def __askNextHolder(self, afterSeat):
+        skipped = list()
+        self.revealingSeat = None
+        seatIndex = self.nextSeat(afterSeat, False)
+        while seatIndex is not None and seatIndex != self.turnSeat:
+            if self.seats[seatIndex].hand.intersection(self.suggestion):
+                self.revealingSeat = seatIndex
+                return skipped
+            skipped.append(seatIndex)
+            seatIndex = self.nextSeat(seatIndex, False)
+        self.suggestion = None
+        return skipped
+
+    def accuse(self, character, room, weapon):
+        """
+        A correct accusation wins the game.  A wrong one eliminates the player, which ends the game if only one
+        player is left and ends the turn otherwise
+        :return: True if the accusation was correct
+        """
+        self.__advance("Accusation")
+        correct = (character, room, weapon) == self.caseFile
+        self.events.append(("Accusation", self.turnSeat, (character, room, weapon), correct))
+        if correct:
+            self.winnerSeat = self.turnSeat
+            return True
+        self.currentSeat.eliminated = True
+        active = self.activeSeats()
+        if len(active) == 1:
+            self.winnerSeat = active[0]
+        else:
+            self.__nextTurn()
+        return False
+
+    def endTurn(self):
+        if "EndTurn" not in self.availableActions():
+            raise RuntimeError("Turn can't be ended yet")
+        self.__nextTurn()
+
+    def __nextTurn(self):
+        self.turnSeat = self.nextSeat(self.turnSeat)
+        self.phase = TURN_START
+        self.events.append(("Turn", self.turnSeat))
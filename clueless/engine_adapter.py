@@ -0,0 +1,336 @@
+"""
+Bridge between the headless rules engine and the models.  GameStateAdapter loads a started game into an engine
+GameState from its event log in three queries, or from the tables in a fixed handful for a game without a log, and
+writes the rules applied to it back in bulk: the events, the actions and turns that were taken, where the pieces
+ended up, the cards revealed, eliminations and the result, and one batch of stream entries.
+
+Engine cards are positions in the card catalog, engine spaces are Space ids, engine players are Player ids.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+import threading
+
+from clueless.bots import botName
+from clueless.catalog import getCatalog
+from clueless.engine import Board, Deck, GameState, Seat
+from clueless.models import Accusation, CardReveal, CaseFile, Game, Hallway, Move, OpenGameSummary, Player, SheetItem, \
+    Space, Suggestion, Turn, WhoWhatWhere, COMPLETE, LOST, NOT_STARTED, WON
+
+
+class EngineTables(object):
+    """
+    Board, deck and the id translations for the cards and spaces in the database.  Built once per catalog version
+    """
+    __slots__ = ('version', 'board', 'deck', 'cardIds', 'cardIndex', 'spaceNames')
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.cardIds = tuple(e.card_id for e in catalog.entries)
+        self.cardIndex = dict((cardId, i) for i, cardId in enumerate(self.cardIds))
+        self.deck = Deck([e.name for e in catalog.entries], [e.card_type for e in catalog.entries])
+
+        links = list()
+        collectorIds = dict()
+        for spaceId, northId, westId, collectorId in Space.objects.values_list(
+                'id', 'spaceNorth_id', 'spaceWest_id', 'spaceCollector_id'):
+            collectorIds[spaceId] = collectorId
+            if northId is not None:
+                links.append((spaceId, northId))
+            if westId is not None:
+                links.append((spaceId, westId))
+        roomSpaces = dict((self.cardIndex[e.card_id], e.space_id) for e in catalog.entries if e.space_id is not None)
+        startSpaces = dict((self.cardIndex[e.card_id], e.defaultSpace_id) for e in catalog.entries
+                           if e.defaultSpace_id is not None)
+        self.board = Board(links, roomSpaces, startSpaces)
+
+        hallwayNames = dict(Hallway.objects.values_list('id', 'name'))
+        self.spaceNames = dict()
+        for spaceId, collectorId in collectorIds.items():
+            room = catalog.roomForSpace(spaceId)
+            self.spaceNames[spaceId] = room.name if room is not None else hallwayNames.get(collectorId, "No Name")
+
+    def card(self, cardId):
+        return self.cardIndex[cardId]
+
+
+_tables = None
+_lock = threading.Lock()
+
+
+def getEngineTables():
+    """
+    :return: EngineTables for the current card catalog
+    """
+    global _tables
+    catalog = getCatalog()
+    tables = _tables
+    if tables is not None and tables.version == catalog.version:
+        return tables
+    with _lock:
+        if _tables is None or _tables.version != catalog.version:
+            _tables = EngineTables(catalog)
+        return _tables
+
+
+def getBoard():
+    """
+    :return: engine Board keyed by Space id
+    """
+    return getEngineTables().board
+
+
+class GameStateAdapter(object):
+    """
+    Loads and saves the engine state of one started game
+    """
+    def __init__(self, game):
+        self.game = game
+        self.tables = getEngineTables()
+        self.state = None
+        self.__loaded = None
+        self.__usernames = dict()
+        self.__savedEvents = 0
+
+    def load(self, history = False, fromTables = False):
+        """
+        Reads the game from its event log, see clueless.event_log, which the positions, sheets and turn phase in the
+        tables are projections of.  Games started before the log existed are read from the tables
+        :param history: also put the suggestions nobody could disprove in the state's events, for bots that learn
+        from them.  Restored events are never saved again
+        :param fromTables: read the tables even if the game has a log, e.g. to compare them with it
+        :return: GameState of the game
+        :raise RuntimeError: if the game's log does not replay
+        """
+        game = self.game
+        if game.status == NOT_STARTED:
+            raise RuntimeError("Game has not been started")
+
+        state = None
+        if not fromTables:
+            from clueless.event_log import loggedState
+            state = loggedState(game)
+        if state is not None:
+            for playerId, characterId, username in Player.objects.filter(currentGame = game).values_list(
+                    'id', 'character_id', 'user__username'):
+                self.__usernames[playerId] = self.__username(characterId, username)
+        else:
+            state = self.__loadTables()
+        self.state = state
+        if history:
+            state.events = self.__undisprovedSuggestions(dict((seat.playerId, i) for i, seat in enumerate(state.seats)))
+        self.__loaded = state.copy()
+        self.__savedEvents = len(state.events)
+        return state
+
+    def __username(self, characterId, username):
+        return username if username is not None else botName(self.tables.deck.names[self.tables.card(characterId)])
+
+    def __loadTables(self):
+        """
+        :return: GameState from the positions, sheets, turn and card reveals stored in the tables
+        """
+        game = self.game
+        tables = self.tables
+        catalog = getCatalog()
+
+        pieces = dict(tables.board.startSpaces)
+        characters = dict()
+        results = dict()
+        for playerId, characterId, spaceId, gameResult, username in Player.objects.filter(
+                currentGame = game).values_list('id', 'character_id', 'currentSpace_id', 'gameResult', 'user__username'):
+            pieces[tables.card(characterId)] = spaceId
+            characters[playerId] = tables.card(characterId)
+            results[playerId] = gameResult
+            self.__usernames[playerId] = self.__username(characterId, username)
+
+        hands = dict()
+        known = dict()
+        for playerId, cardId, initiallyDealt in SheetItem.objects.filter(
+                Q(initiallyDealt = True) | Q(checked = True), detectiveSheet__game = game).values_list(
+                'detectiveSheet__player_id', 'card_id', 'initiallyDealt'):
+            if initiallyDealt:
+                hands.setdefault(playerId, set()).add(tables.card(cardId))
+            else:
+                known.setdefault(playerId, set()).add(tables.card(cardId))
+
+        seats = list()
+        for seatIndex, playerId in enumerate(game.seatOrder()):
+            seats.append(Seat(playerId, characters[playerId], hands.get(playerId, ()), known.get(playerId, ()),
+                              game.isSeatEliminated(seatIndex)))
+        seatIndexes = dict((seat.playerId, i) for i, seat in enumerate(seats))
+
+        characterId, roomPk, weaponId = CaseFile.objects.values_list(
+            'character_id', 'room_id', 'weapon_id').get(id = game.caseFile_id)
+        caseFile = (tables.card(characterId), tables.card(catalog.roomByPk(roomPk).card_id), tables.card(weaponId))
+
+        turnPlayerId, phase = Turn.objects.values_list('player_id', 'phase').get(id = game.currentTurn_id)
+
+        suggestion = None
+        revealingSeat = None
+        openReveal = CardReveal.objects.filter(suggestion__turn__game = game, status = 1).values_list(
+            'revealingPlayer_id', 'suggestion__whoWhatWhere__character_id', 'suggestion__whoWhatWhere__room_id',
+            'suggestion__whoWhatWhere__weapon_id').order_by('-id').first()
+        if openReveal is not None:
+            revealingPlayerId, characterId, roomPk, weaponId = openReveal
+            revealingSeat = seatIndexes[revealingPlayerId]
+            suggestion = (tables.card(characterId), tables.card(catalog.roomByPk(roomPk).card_id),
+                          tables.card(weaponId))
+
+        winnerSeat = None
+        if game.status == COMPLETE:
+            winners = [seatIndexes[playerId] for playerId, result in results.items()
+                       if result == WON and playerId in seatIndexes]
+            winnerSeat = winners[0] if winners else None
+
+        return GameState(tables.board, tables.deck, seats, pieces, caseFile, seatIndexes[turnPlayerId], phase,
+                         suggestion, revealingSeat, winnerSeat)
+
+    def __undisprovedSuggestions(self, seatIndexes):
+        """
+        A reveal is only started for a player holding a suggested card, so a suggestion without any was disproved
+        by nobody.  The players passed over are not stored, so the events have none
+        :return: list of engine Suggestion events, oldest first
+        """
+        tables = self.tables
+        catalog = getCatalog()
+        events = list()
+        for playerId, characterId, roomPk, weaponId in Suggestion.objects.filter(
+                turn__game = self.game, cardreveal__isnull = True).values_list(
+                'turn__player_id', 'whoWhatWhere__character_id', 'whoWhatWhere__room_id',
+                'whoWhatWhere__weapon_id').order_by('id'):
+            if playerId in seatIndexes:
+                events.append(("Suggestion", seatIndexes[playerId], (tables.card(characterId),
+                               tables.card(catalog.roomByPk(roomPk).card_id), tables.card(weaponId)), (), None))
+        return events
+
+    def save(self):
+        """
+        Writes everything that happened to the state since it was loaded or last saved
+        """
+        game = self.game
+        state = self.state
+        loaded = self.__loaded
+        events = state.events[self.__savedEvents:]
+        with transaction.atomic():
+            from clueless.event_log import appendEvents, engineEvents
+            appendEvents(game, engineEvents(events, loaded.turnSeat))
+            entries = self.__saveEvents(events)
+
+            #pieces, grouped so every destination space is a single update
+            moved = dict()
+            for character, spaceId in state.pieces.items():
+                if loaded.pieces.get(character) != spaceId:
+                    moved.setdefault(spaceId, list()).append(self.tables.cardIds[character])
+            for spaceId, characterIds in moved.items():
+                Player.objects.filter(currentGame = game, character_id__in = characterIds).update(
+                    currentSpace_id = spaceId)
+
+            for seat, before in zip(state.seats, loaded.seats):
+                newlyKnown = seat.known - before.known
+                if newlyKnown:
+                    SheetItem.objects.filter(detectiveSheet__game = game, detectiveSheet__player_id = seat.playerId,
+                                             card_id__in = [self.tables.cardIds[c] for c in newlyKnown]).update(
+                        checked = True)
+                if seat.eliminated and not before.eliminated:
+                    Player.objects.filter(id = seat.playerId).update(gameResult = LOST)
+                    game.eliminatedMask |= 1 << state.seats.index(seat)
+
+            if state.finished and not loaded.finished:
+                winnerId = state.seats[state.winnerSeat].playerId
+                Player.objects.filter(currentGame = game).exclude(id = winnerId).update(gameResult = LOST)
+                Player.objects.filter(id = winnerId).update(gameResult = WON)
+                game.status = COMPLETE
+                entries.append(("<b>{}</b> won!".format(self.__usernames[winnerId]), None))
+                OpenGameSummary.objects.filter(game_id = game.id).delete()
+
+            Turn.objects.filter(id = game.currentTurn_id).update(phase = state.phase)
+            Game.objects.filter(id = game.id).update(
+                currentTurn = game.currentTurn_id, eliminatedMask = game.eliminatedMask, status = game.status)
+            game.registerGameUpdates([description for description, playerId in entries],
+                                     [playerId for description, playerId in entries])
+
+        if game.status == COMPLETE and not loaded.finished:
+            game.lobbyChanged()
+        self.__loaded = state.copy()
+        self.__savedEvents = len(state.events)
+
+    def __saveEvents(self, events):
+        """
+        Inserts the Action, Turn and CardReveal rows for the engine events
+        :return: list of (stream entry description, player id the entry is for or None)
+        """
+        game = self.game
+        state = self.state
+        catalog = getCatalog()
+        tables = self.tables
+        names = tables.deck.names
+        entries = list()
+        turn = Turn.objects.get(id = game.currentTurn_id)
+
+        def username(seatIndex):
+            return self.__usernames[state.seats[seatIndex].playerId]
+
+        def whoWhatWhere(cards):
+            www = WhoWhatWhere(character_id = tables.cardIds[cards[0]],
+                               room_id = catalog.entry(tables.cardIds[cards[1]]).pk,
+                               weapon_id = tables.cardIds[cards[2]])
+            www.save()
+            return www
+
+        def startReveal(suggestionId, revealingSeat):
+            if revealingSeat is not None:
+                CardReveal(suggestion_id = suggestionId, revealingPlayer_id = state.seats[revealingSeat].playerId,
+                           status = 1).save()
+
+        def skippedEntries(skipped):
+            for seatIndex in skipped:
+                entries.append(("<b>{}</b> did not reveal a card".format(username(seatIndex)), None))
+
+        previousKind = None
+        for event in events:
+            kind = event[0]
+            if kind == "Move":
+                seatIndex, fromSpace, toSpace = event[1:]
+                Move(turn = turn, fromSpace_id = fromSpace, toSpace_id = toSpace).save()
+                entries.append(("<b>{}</b> moved to <b>{}</b>".format(
+                    username(seatIndex), tables.spaceNames.get(toSpace)), None))
+            elif kind == "Suggestion":
+                seatIndex, cards, skipped, revealingSeat = event[1:]
+                sugg = Suggestion(turn = turn, whoWhatWhere = whoWhatWhere(cards))
+                sugg.save()
+                entries.append(("<b>{}</b> suggested it was <b>{}</b> in the <b>{}</b> with the <b>{}</b>".format(
+                    username(seatIndex), names[cards[0]], names[cards[1]], names[cards[2]]), None))
+                skippedEntries(skipped)
+                startReveal(sugg.id, revealingSeat)
+            elif kind == "Reveal":
+                revealingSeat, card, skipped, nextRevealingSeat, suggestingSeat = event[1:]
+                reveal = CardReveal.objects.filter(
+                    suggestion__turn__game = game, status = 1,
+                    revealingPlayer_id = state.seats[revealingSeat].playerId).order_by('-id').first()
+                CardReveal.objects.filter(id = reveal.id).update(revealedCard_id = tables.cardIds[card], status = 2)
+                entries.append(("<b>{}</b> revealed a card to <b>{}</b>".format(
+                    username(revealingSeat), username(suggestingSeat)), None))
+                private = "<b>{}</b> revealed the card <b>{}</b> to <b>{}</b>".format(
+                    username(revealingSeat), names[card], username(suggestingSeat))
+                entries.append((private, state.seats[revealingSeat].playerId))
+                entries.append((private, state.seats[suggestingSeat].playerId))
+                skippedEntries(skipped)
+                startReveal(reveal.suggestion_id, nextRevealingSeat)
+            elif kind == "Accusation":
+                seatIndex, cards, correct = event[1:]
+                Accusation(turn = turn, whoWhatWhere = whoWhatWhere(cards)).save()
+                entries.append((
+                    "<b>{}</b> made the accusation that it was <b>{}</b> in the <b>{}</b> with the <b>{}</b>".format(
+                        username(seatIndex), names[cards[0]], names[cards[1]], names[cards[2]]), None))
+                if not correct:
+                    entries.append(("<b>{}</b> lost!".format(username(seatIndex)), None))
+            elif kind == "Turn":
+                #a wrong accusation ends the turn by itself
+                if previousKind != "Accusation":
+                    entries.append(("<b>{}</b> ended turn".format(self.__usernames[turn.player_id]), None))
+                turn = Turn(player_id = state.seats[event[1]].playerId, game = game)
+                turn.save()
+                game.currentTurn = turn
+            previousKind = kind
+        return entries
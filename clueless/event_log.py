@@ -0,0 +1,279 @@
+"""
+Append-only event log of every started game, and the game state rebuilt from it.
+
+Each rule applied to a game is appended to its log as a GameEvent, numbered in the order the rules were applied.  An
+event only holds what the player chose, everything else follows from the rules:
+    G                                   the game started, always number 0
+    M seat,space                        move
+    S seat,character,room,weapon        suggestion
+    R seat,card                         card reveal, by the revealing seat
+    A seat,character,room,weapon        accusation
+    E seat                              end of turn
+Seats are positions in the game's turn order, cards are engine card indexes and spaces are Space ids, as in
+clueless.engine.  Rows are only ever inserted, so the log can be replayed exactly.
+
+The whole state is snapshotted, see clueless.snapshots, when the game starts and after every SNAPSHOT_INTERVAL
+events, and rebuildState applies the events after the latest snapshot to it with the rules engine.  That is the state
+the engine plays from, as GameStateAdapter loads it.
+
+The positions, turn phase and detective sheets stored in the other tables are projections of it, which the views
+read.  They are still written by every action, in the same transaction as its event, so the log is a second write
+rather than a replacement: each action costs the statements of appendEvents on top of its table writes.
+writeProjections puts the tables right from the log.
+
+Games started before the log existed have no start event, and nothing is logged for them.
+"""
+from django.db import IntegrityError, transaction
+
+import logging
+
+from clueless.catalog import getCatalog
+from clueless.engine_adapter import GameStateAdapter, getEngineTables
+from clueless.models import Game, GameEvent, GameSnapshot, Player, SheetItem, Turn
+from clueless.snapshots import packState, unpackState
+
+logger = logging.getLogger(__name__)
+
+START = "G"
+MOVE = "M"
+SUGGESTION = "S"
+REVEAL = "R"
+ACCUSATION = "A"
+END_TURN = "E"
+
+SNAPSHOT_INTERVAL = 25 #events between snapshots
+APPEND_ATTEMPTS = 5 #times an append is numbered before a clash with other appends is given up on
+
+
+def saveSnapshot(gameId, state, eventNumber):
+    GameSnapshot(game_id = gameId, eventNumber = eventNumber, data = packState(state)).save()
+
+
+def startLog(game):
+    """
+    Starts the log of a game that has just been started, with the dealt game as its first snapshot
+    :param game: started Game
+    """
+    state = GameStateAdapter(game).load(fromTables = True)
+    with transaction.atomic():
+        GameEvent(game = game, number = 0, kind = START).save()
+        saveSnapshot(game.id, state, 0)
+
+
+def appendEvents(game, events, playerId = None):
+    """
+    Appends events to the log of a game, and snapshots the game when they take it past a multiple of
+    SNAPSHOT_INTERVAL.  Call it in the transaction of the writes the events describe, so the log and the tables
+    can't disagree.  No lock is taken: the events are numbered after the last one, and numbered again if another
+    request took those numbers first.  Two statements when no snapshot is due, the last number and the insert, and
+    the savepoint around the insert
+    :param game: Game, whose turn order gives the seats
+    :param events: list of (kind, tuple of integers)
+    :param playerId: player acting in every event, whose seat is put first in their integers, or None if the integers
+    already start with the seat
+    :return: number of the last event appended, or None if the game has no log
+    """
+    if not events:
+        return None
+    if playerId is not None:
+        seat = game.seatOrder().index(playerId)
+        events = [(kind, (seat,) + tuple(args)) for kind, args in events]
+    for attempt in range(0, APPEND_ATTEMPTS):
+        last = GameEvent.objects.filter(game_id = game.id).order_by('-number').values_list('number', flat = True).first()
+        if last is None:
+            return None
+        try:
+            #the savepoint lets a clash on the (game, number) key be retried without losing the caller's writes
+            with transaction.atomic():
+                GameEvent.objects.bulk_create([
+                    GameEvent(game_id = game.id, number = last + 1 + i, kind = kind,
+                              args = ",".join(str(a) for a in args))
+                    for i, (kind, args) in enumerate(events)
+                ])
+            break
+        except IntegrityError:
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+    number = last + len(events)
+    if number // SNAPSHOT_INTERVAL > last // SNAPSHOT_INTERVAL:
+        try:
+            saveSnapshot(game.id, _latestState(game.id), number)
+        except RuntimeError as e:
+            #the game goes on, it is rebuilt from the previous snapshot
+            logger.error("Game {} could not be snapshotted at event {}: {}".format(game.id, number, e))
+    return number
+
+
+def _cards(whoWhatWhere):
+    tables = getEngineTables()
+    return (tables.card(whoWhatWhere.character_id),
+            tables.card(getCatalog().roomByPk(whoWhatWhere.room_id).card_id),
+            tables.card(whoWhatWhere.weapon_id))
+
+
+def logMove(move):
+    appendEvents(move.turn.game, [(MOVE, (move.toSpace_id,))], move.turn.player_id)
+
+
+def logSuggestion(suggestion):
+    appendEvents(suggestion.turn.game, [(SUGGESTION, _cards(suggestion.whoWhatWhere))], suggestion.turn.player_id)
+
+
+def logReveal(cardReveal):
+    appendEvents(cardReveal.suggestion.turn.game, [(REVEAL, (getEngineTables().card(cardReveal.revealedCard_id),))],
+                 cardReveal.revealingPlayer_id)
+
+
+def logAccusation(accusation):
+    appendEvents(accusation.turn.game, [(ACCUSATION, _cards(accusation.whoWhatWhere))], accusation.turn.player_id)
+
+
+def logEndTurn(turn):
+    appendEvents(turn.game, [(END_TURN, ())], turn.player_id)
+
+
+def engineEvents(events, turnSeat):
+    """
+    :param events: events of an engine GameState, see clueless.engine
+    :param turnSeat: seat whose turn it was before the first of them
+    :return: list of (kind, tuple of integers) to append to the log
+    """
+    logged = list()
+    previousKind = None
+    for event in events:
+        kind = event[0]
+        if kind == "Move":
+            logged.append((MOVE, (event[1], event[3])))
+        elif kind == "Suggestion":
+            logged.append((SUGGESTION, (event[1],) + tuple(event[2])))
+        elif kind == "Reveal":
+            logged.append((REVEAL, (event[1], event[2])))
+        elif kind == "Accusation":
+            logged.append((ACCUSATION, (event[1],) + tuple(event[2])))
+        elif kind == "Turn":
+            #a wrong accusation ends the turn by itself
+            if previousKind != "Accusation":
+                logged.append((END_TURN, (turnSeat,)))
+            turnSeat = event[1]
+        previousKind = kind
+    return logged
+
+
+def applyEvent(state, kind, args):
+    """
+    Applies a logged event to a state with the rules engine
+    :raise RuntimeError: if the event does not follow from the state
+    """
+    seat = args[0] if args else None
+    actingSeat = state.revealingSeat if kind == REVEAL else state.turnSeat
+    if kind != START and seat != actingSeat:
+        raise RuntimeError("Event {} {} is not for seat {}".format(kind, args, actingSeat))
+    if kind == MOVE:
+        state.move(args[1])
+    elif kind == SUGGESTION:
+        if state.board.roomAt(state.spaceOf(state.currentSeat)) != args[2]:
+            raise RuntimeError("Suggestion {} is not for the room the seat is in".format(args))
+        state.suggest(args[1], args[3])
+    elif kind == REVEAL:
+        state.reveal(args[1])
+    elif kind == ACCUSATION:
+        state.accuse(args[1], args[2], args[3])
+    elif kind == END_TURN:
+        state.endTurn()
+    elif kind != START:
+        raise RuntimeError("Unknown event kind {}".format(kind))
+
+
+def _loggedEvents(gameId, afterNumber):
+    return [(number, kind, tuple(int(a) for a in args.split(",") if a)) for number, kind, args in
+            GameEvent.objects.filter(game_id = gameId, number__gt = afterNumber).order_by('number').values_list(
+                'number', 'kind', 'args')]
+
+
+def loggedEvents(game, afterNumber = -1):
+    """
+    :return: list of (number, kind, tuple of integers) of the events of a game after afterNumber, in order
+    """
+    return _loggedEvents(game.id, afterNumber)
+
+
+def _latestState(gameId):
+    """
+    Two queries: the latest snapshot, and the events after it
+    :return: GameState, or None if the game has no log
+    :raise RuntimeError: if the events do not replay
+    """
+    snapshot = GameSnapshot.objects.filter(game_id = gameId).order_by('-eventNumber').values_list(
+        'eventNumber', 'data').first()
+    if snapshot is None:
+        return None
+    eventNumber, data = snapshot
+    state = unpackState(data, getEngineTables())
+    for eventNumber, kind, args in _loggedEvents(gameId, eventNumber):
+        applyEvent(state, kind, args)
+    state.events = list()
+    return state
+
+
+def rebuildState(game):
+    """
+    :return: GameState of a game, from its latest snapshot and the events logged after it
+    :raise RuntimeError: if the game has no log, or its events do not replay
+    """
+    state = _latestState(game.id)
+    if state is None:
+        raise RuntimeError("Game {} has no event log".format(game.id))
+    return state
+
+
+def loggedState(game):
+    """
+    State of a game as its log has it, which is what the engine plays from
+    :return: GameState, or None if the game has no log, when the tables are all there is
+    :raise RuntimeError: if the events do not replay
+    """
+    return _latestState(game.id)
+
+
+def stateDifferences(rebuilt, stored):
+    """
+    :return: list of descriptions of where a stored GameState differs from the one rebuilt from the log
+    """
+    names = rebuilt.deck.names
+    differences = list()
+    for character in sorted(set(rebuilt.pieces) | set(stored.pieces)):
+        if rebuilt.pieces.get(character) != stored.pieces.get(character):
+            differences.append("{} is on space {}, the log has {}".format(
+                names[character], stored.pieces.get(character), rebuilt.pieces.get(character)))
+    for rebuiltSeat, storedSeat in zip(rebuilt.seats, stored.seats):
+        if rebuiltSeat.known != storedSeat.known:
+            differences.append("player {} knows {}, the log has {}".format(
+                storedSeat.playerId, sorted(names[c] for c in storedSeat.known),
+                sorted(names[c] for c in rebuiltSeat.known)))
+        if rebuiltSeat.eliminated != storedSeat.eliminated:
+            differences.append("player {} eliminated {}, the log has {}".format(
+                storedSeat.playerId, storedSeat.eliminated, rebuiltSeat.eliminated))
+    for attribute in ('turnSeat', 'phase', 'revealingSeat', 'winnerSeat'):
+        if getattr(rebuilt, attribute) != getattr(stored, attribute):
+            differences.append("{} is {}, the log has {}".format(
+                attribute, getattr(stored, attribute), getattr(rebuilt, attribute)))
+    return differences
+
+
+def writeProjections(game, state):
+    """
+    Puts the piece positions, detective sheet checks and turn phase stored for a game right from a rebuilt state.
+    Turns, reveals and results are history rather than projections, and are left as they are
+    """
+    tables = getEngineTables()
+    with transaction.atomic():
+        for character, spaceId in state.pieces.items():
+            Player.objects.filter(currentGame = game, character_id = tables.cardIds[character]).exclude(
+                currentSpace_id = spaceId).update(currentSpace_id = spaceId)
+        for seat in state.seats:
+            SheetItem.objects.filter(detectiveSheet__game = game, detectiveSheet__player_id = seat.playerId,
+                                     initiallyDealt = False, checked = False,
+                                     card_id__in = [tables.cardIds[c] for c in seat.known]).update(checked = True)
+        Turn.objects.filter(id = game.currentTurn_id, player_id = state.seats[state.turnSeat].playerId).update(
+            phase = state.phase)
+    game.registerGameUpdate()
@@ -0,0 +1,243 @@
+"""
+Streaming export and import of games as JSON Lines, to move games between databases, build benchmark corpora or
+analyse games offline.
+
+Every game is written as a run of records, one JSON object per line:
+    {"type": "game", "id", "name", "seed", "status", "botStrategy", "startTime", "lastUpdateTime", "currentSequence",
+     "turnOrder", "eliminatedMask", "host", "currentTurn", "caseFile": [character, room, weapon]}
+    {"type": "player", "id", "user", "character", "currentSpace", "gameResult", "nonUserPlayer", "botStrategy"}
+    {"type": "row", "model", "pk", "fields"}
+The rows are the archive records of clueless.archive, in an order where every row only refers to rows before it:
+the cards named by suggestions and accusations, the turns and their actions, the card reveals, the detective sheets
+with the deal, the stream entries, then the event log.  Users are written as their username, cards and spaces as their ids, which
+are the same in every database made by create_default_objects.
+
+Both directions stream: the export reads a game at a time with iterators, and the import holds one game's records
+at a time, inserting them in chunks of CHUNK_SIZE with every id mapped to a new one.
+"""
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+import json
+
+from clueless.archive import archiveRecords, unpackRecords
+from clueless.engine_adapter import getEngineTables
+from clueless.models import Board, CaseFile, Game, GameArchive, GameEvent, GameSnapshot, Player
+from clueless.snapshots import packState, unpackState
+
+EXPORT_FORMAT_VERSION = 1
+CHUNK_SIZE = 500
+
+#model of a row -> (id map its own ids go into, or None, {foreign key attribute: id map})
+ROW_MAPPINGS = {
+    'clueless.whowhatwhere': ('whoWhatWhere', {}),
+    'clueless.turn': ('turn', {'player_id': 'player', 'game_id': 'game'}),
+    'clueless.action': ('action', {'turn_id': 'turn'}),
+    'clueless.move': ('action', {}),
+    'clueless.suggestion': ('action', {'whoWhatWhere_id': 'whoWhatWhere'}),
+    'clueless.accusation': ('action', {'whoWhatWhere_id': 'whoWhatWhere'}),
+    'clueless.cardreveal': (None, {'suggestion_id': 'action', 'revealingPlayer_id': 'player'}),
+    'clueless.detectivesheet': ('detectiveSheet', {'game_id': 'game', 'player_id': 'player'}),
+    'clueless.sheetitem': (None, {'detectiveSheet_id': 'detectiveSheet'}),
+    'clueless.gamestreamentry': (None, {'game_id': 'game', 'playerSpecific_id': 'player'}),
+    'clueless.gameevent': (None, {'game_id': 'game'}),
+    'clueless.gamesnapshot': (None, {'game_id': 'game'}),
+}
+#subclasses of Action, whose rows take the id their Action row was given
+ACTION_MODELS = ('clueless.move', 'clueless.suggestion', 'clueless.accusation')
+
+
+def exportRecords(game):
+    """
+    Generates the records of one game, see the module documentation
+    :param game: Game
+    """
+    payload = None
+    try:
+        payload = unpackRecords(GameArchive.objects.get(game = game).data)
+    except GameArchive.DoesNotExist:
+        pass
+    caseFile = game.caseFile
+    yield {
+        'type': 'game', 'version': EXPORT_FORMAT_VERSION, 'id': game.id, 'name': game.name, 'seed': game.seed,
+        'status': game.status, 'botStrategy': game.botStrategy, 'startTime': game.startTime,
+        'lastUpdateTime': game.lastUpdateTime, 'currentSequence': game.currentSequence, 'turnOrder': game.turnOrder,
+        'eliminatedMask': game.eliminatedMask, 'host': game.hostPlayer_id,
+        'currentTurn': payload['currentTurn'] if payload is not None else game.currentTurn_id,
+        'caseFile': [caseFile.character_id, caseFile.room_id, caseFile.weapon_id],
+    }
+    for player in Player.objects.filter(currentGame = game).select_related('user').order_by('id').iterator():
+        yield {
+            'type': 'player', 'id': player.id, 'user': player.user.username if player.user is not None else None,
+            'character': player.character_id, 'currentSpace': player.currentSpace_id,
+            'gameResult': player.gameResult, 'nonUserPlayer': player.nonUserPlayer, 'botStrategy': player.botStrategy,
+        }
+    #an archived game's rows are in its archive
+    records = payload['records'] if payload is not None else archiveRecords(game)
+    for record in records:
+        yield dict(record, type = 'row')
+    for queryset in (GameEvent.objects.filter(game = game), GameSnapshot.objects.filter(game = game)):
+        for record in serializers.serialize('python', queryset.order_by('pk').iterator()):
+            yield dict(record, type = 'row')
+
+
+def exportLines(games):
+    """
+    Generates the JSON lines of games
+    :param games: QuerySet of Game
+    """
+    for game in games.order_by('id').select_related('caseFile').iterator():
+        for record in exportRecords(game):
+            yield json.dumps(record, cls = DjangoJSONEncoder, separators = (',', ':')) + "\n"
+
+
+def readGames(lines):
+    """
+    Groups the records read from JSON lines by game
+    :return: generator of lists of records, one list per game
+    """
+    records = None
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record['type'] == 'game':
+            if records is not None:
+                yield records
+            if record.get('version') != EXPORT_FORMAT_VERSION:
+                raise RuntimeError("Unsupported game export version {}".format(record.get('version')))
+            records = [record]
+        elif records is None:
+            raise RuntimeError("Game export does not start with a game record")
+        else:
+            records.append(record)
+    if records is not None:
+        yield records
+
+
+def importGames(lines, chunkSize = CHUNK_SIZE):
+    """
+    Imports every game of an export, each in a transaction of its own
+    :param lines: iterable of JSON lines, e.g. an open file
+    :return: generator of (exported game id, new Game), as each game is imported
+    """
+    for records in readGames(lines):
+        with transaction.atomic():
+            game = GameImport(records, chunkSize).run()
+        yield (records[0]['id'], game)
+
+
+class GameImport(object):
+    """
+    Inserts the records of one exported game under new ids
+    """
+    def __init__(self, records, chunkSize = CHUNK_SIZE):
+        self.header = records[0]
+        self.players = [r for r in records if r['type'] == 'player']
+        self.rows = [r for r in records if r['type'] == 'row']
+        self.chunkSize = chunkSize
+        self.ids = dict((name, dict()) for name in ('game', 'player', 'turn', 'action', 'whoWhatWhere',
+                                                     'detectiveSheet'))
+        self.users = dict()
+
+    def run(self):
+        """
+        :return: the new Game
+        """
+        header = self.header
+        character, room, weapon = header['caseFile']
+        caseFile = CaseFile(character_id = character, room_id = room, weapon_id = weapon)
+        caseFile.save()
+
+        players = [Player(user = self.__user(p['user']), character_id = p['character'],
+                          currentSpace_id = p['currentSpace'], gameResult = p['gameResult'],
+                          nonUserPlayer = p['nonUserPlayer'], botStrategy = p['botStrategy']) for p in self.players]
+        self.__insert(Player, players)
+        self.ids['player'] = dict((p['id'], player.id) for p, player in zip(self.players, players))
+
+        game = Game(name = header['name'], seed = header['seed'], status = header['status'],
+                    botStrategy = header['botStrategy'], currentSequence = header['currentSequence'],
+                    eliminatedMask = header['eliminatedMask'], hostPlayer_id = self.ids['player'][header['host']],
+                    caseFile = caseFile, board = Board.objects.all()[0],
+                    turnOrder = ",".join(str(self.ids['player'][int(p)]) for p in header['turnOrder'].split(",") if p))
+        game.save()
+        #set afterwards, they would be overwritten by the field defaults
+        Game.objects.filter(id = game.id).update(startTime = header['startTime'],
+                                                 lastUpdateTime = header['lastUpdateTime'])
+        self.ids['game'][header['id']] = game.id
+        Player.objects.filter(id__in = self.ids['player'].values()).update(currentGame = game)
+
+        #rows of a model come together, and only refer to rows of models before them
+        pending = list()
+        for record in self.rows:
+            if pending and pending[0]['model'] != record['model']:
+                self.__insertRows(pending)
+                pending = list()
+            pending.append(record)
+        if pending:
+            self.__insertRows(pending)
+
+        if header['currentTurn'] is not None:
+            game.currentTurn_id = self.ids['turn'][header['currentTurn']]
+            Game.objects.filter(id = game.id).update(currentTurn_id = game.currentTurn_id)
+        game.refresh_from_db()
+        return game
+
+    def __user(self, username):
+        if username is None:
+            return None
+        if username not in self.users:
+            user = User.objects.filter(username = username).first()
+            if user is None:
+                user = User(username = username)
+                user.set_unusable_password()
+                user.save()
+            self.users[username] = user
+        return self.users[username]
+
+    def __insert(self, model, objs):
+        """
+        Inserts new rows a chunk at a time.  Where the database can't return the ids of a bulk insert they are
+        inserted a row at a time instead, so their new ids are known
+        """
+        if connection.features.can_return_ids_from_bulk_insert:
+            model.objects.bulk_create(objs, batch_size = self.chunkSize)
+        else:
+            for obj in objs:
+                obj.save_base(raw = True)
+
+    def __insertRows(self, records):
+        model = records[0]['model']
+        ownIds, foreignKeys = ROW_MAPPINGS[model]
+        objs = list()
+        for record in records:
+            obj = next(serializers.deserialize('python', [record], ignorenonexistent = True)).object
+            for attribute, idMap in foreignKeys.items():
+                if getattr(obj, attribute) is not None:
+                    setattr(obj, attribute, self.ids[idMap][getattr(obj, attribute)])
+            if model == 'clueless.gamesnapshot':
+                obj.data = self.__remapSnapshot(obj.data)
+            objs.append(obj)
+
+        if model in ACTION_MODELS:
+            #the Action rows are in already, only the subclass's own table is written
+            for obj in objs:
+                obj.pk = self.ids['action'][obj.pk]
+                obj.save_base(raw = True, force_insert = True)
+            return
+        oldIds = [obj.pk for obj in objs]
+        for obj in objs:
+            obj.pk = None
+        if ownIds is None:
+            type(objs[0]).objects.bulk_create(objs, batch_size = self.chunkSize)
+        else:
+            self.__insert(type(objs[0]), objs)
+            self.ids[ownIds].update(zip(oldIds, [obj.pk for obj in objs]))
+
+    def __remapSnapshot(self, data):
+        state = unpackState(data, getEngineTables())
+        for seat in state.seats:
+            seat.playerId = self.ids['player'][seat.playerId]
+        return packState(state)
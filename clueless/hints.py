@@ -0,0 +1,154 @@
+"""
+Suggestion hints.  Ranks every suggestion a player could make by how much it is expected to narrow down the case
+file, from what the player knows: their own hand, the cards revealed to them, and the players that were passed over
+in every card reveal, who hold none of the suggested cards.
+
+What is known is a boolean matrix with a row per seat plus a last row for the case file, and a column per card in
+deck order; True where the card could be held there.  All the suggestions are scored at once with NumPy, which is in
+requirements.txt.  An install without it still runs, only without hints.
+"""
+from django.core.cache import cache
+
+from clueless.catalog import getCatalog
+from clueless.engine_adapter import getEngineTables
+from clueless.models import CardReveal, SheetItem, Suggestion, STARTED
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HINT_CACHE_SECONDS = 300
+
+
+def knowledgeMatrix(game, playerId):
+    """
+    :param game: started Game
+    :param playerId: id of the player whose knowledge is wanted
+    :return: (possible owners matrix, the player's seat index)
+    """
+    tables = getEngineTables()
+    catalog = getCatalog()
+    seats = game.seatOrder()
+    seatIndex = seats.index(playerId)
+    possible = numpy.ones((len(seats) + 1, len(tables.deck)), dtype = bool)
+
+    #the player knows their whole hand
+    hand = [tables.card(cardId) for cardId in SheetItem.objects.filter(
+        detectiveSheet__game = game, detectiveSheet__player_id = playerId, initiallyDealt = True).values_list(
+        'card_id', flat = True)]
+    possible[seatIndex, :] = False
+    possible[:, hand] = False
+    possible[seatIndex, hand] = True
+
+    suggestions = dict()
+    for suggestionId, suggesterId, characterId, roomPk, weaponId in Suggestion.objects.filter(
+            turn__game = game).values_list('id', 'turn__player_id', 'whoWhatWhere__character_id',
+                                           'whoWhatWhere__room_id', 'whoWhatWhere__weapon_id'):
+        cards = [tables.card(characterId), tables.card(catalog.roomByPk(roomPk).card_id), tables.card(weaponId)]
+        suggestions[suggestionId] = (suggesterId, cards, dict())
+
+    for suggestionId, revealingPlayerId, revealedCardId, status in CardReveal.objects.filter(
+            suggestion__turn__game = game).values_list(
+            'suggestion_id', 'revealingPlayer_id', 'revealedCard_id', 'status').order_by('id'):
+        suggesterId, cards, revealers = suggestions[suggestionId]
+        revealers[revealingPlayerId] = status
+        if suggesterId == playerId and revealedCardId is not None:
+            card = tables.card(revealedCardId)
+            possible[:, card] = False
+            possible[seats.index(revealingPlayerId), card] = True
+
+    #every holder round the table is asked in turn, so the players passed over before the open reveal, or all the
+    #way round once the reveals are done, hold none of the suggested cards
+    for suggesterId, cards, revealers in suggestions.values():
+        if suggesterId not in seats:
+            continue
+        first = seats.index(suggesterId)
+        for step in range(1, len(seats)):
+            other = seats[(first + step) % len(seats)]
+            if other not in revealers:
+                possible[(first + step) % len(seats), cards] = False
+            elif revealers[other] == STARTED:
+                break
+    return (possible, seatIndex)
+
+
+def _typeEntropy(q):
+    """
+    :param q: case file probabilities of the cards of one type, summing to 1
+    :return: (entropy in bits, array of the entropy drop if each card were ruled out)
+    """
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        logs = numpy.where(q > 0, numpy.log2(numpy.where(q > 0, q, 1.0)), 0.0)
+        entropy = -(q * logs).sum()
+        rest = 1.0 - q
+        after = numpy.where(rest > 0, (entropy + q * logs) / numpy.where(rest > 0, rest, 1.0) +
+                            numpy.log2(numpy.where(rest > 0, rest, 1.0)), 0.0)
+    return (entropy, entropy - after)
+
+
+def scoreSuggestions(possible, seatIndex, deck, room = None):
+    """
+    Expected drop in case file entropy, in bits, for every (character, room, weapon) suggestion.  Each card is
+    assumed to be held by any of its possible owners with equal odds, each suggested card another player holds is
+    shown to the suggesting player, and a suggestion nobody can disprove puts every suggested card outside the
+    player's hand in the case file
+    :param possible: matrix made by knowledgeMatrix
+    :param deck: engine Deck the matrix columns follow
+    :param room: room card to score the suggestions for, or None for every room
+    :return: array indexed [character, room, weapon] in deck order, with a single room if one is given
+    """
+    owners = possible.sum(axis = 0).astype(float)
+    share = possible / numpy.where(owners > 0, owners, 1.0)
+    caseFile = share[-1]
+    #odds that another player holds the card, and shows it
+    shown = numpy.clip(1.0 - caseFile - share[seatIndex], 0.0, 1.0)
+    notMine = ~possible[seatIndex]
+
+    rooms = [room] if room is not None else list(deck.rooms)
+    score = numpy.zeros((len(deck.characters), len(rooms), len(deck.weapons)))
+    nobodyShows = numpy.ones_like(score)
+    solvedIfNobodyShows = numpy.zeros_like(score)
+    #each card type is broadcast along its own axis
+    for cards, allOfType, axisShape in ((deck.characters, deck.characters, (-1, 1, 1)),
+                                        (rooms, deck.rooms, (1, -1, 1)),
+                                        (deck.weapons, deck.weapons, (1, 1, -1))):
+        allOfType = list(allOfType)
+        total = caseFile[allOfType].sum()
+        entropy, drops = _typeEntropy(caseFile[allOfType] / total if total > 0 else caseFile[allOfType])
+        typeDrop = drops[[allOfType.index(c) for c in cards]].reshape(axisShape)
+        typeShown = shown[list(cards)].reshape(axisShape)
+        score = score + typeShown * typeDrop
+        nobodyShows = nobodyShows * (1.0 - typeShown)
+        solvedIfNobodyShows = solvedIfNobodyShows + entropy * notMine[list(cards)].reshape(axisShape)
+    return score + nobodyShows * solvedIfNobodyShows
+
+
+def suggestionRanking(game, player, room):
+    """
+    :param room: catalog entry of the room the player is in
+    :return: list of {'character_id', 'characterName', 'weapon_id', 'weaponName', 'score'} dictionaries, best
+    first, or None if NumPy is not installed.  Cached until the game changes
+    """
+    if numpy is None:
+        return None
+    cacheKey = "clueless.hints.{}.{}.{}.{}".format(game.id, game.currentSequence, player.id, room.card_id)
+    ranking = cache.get(cacheKey)
+    if ranking is not None:
+        return ranking
+
+    tables = getEngineTables()
+    deck = tables.deck
+    possible, seatIndex = knowledgeMatrix(game, player.id)
+    scores = scoreSuggestions(possible, seatIndex, deck, tables.card(room.card_id))[:, 0, :]
+    ranking = list()
+    for i, character in enumerate(deck.characters):
+        for j, weapon in enumerate(deck.weapons):
+            ranking.append({
+                'character_id': tables.cardIds[character], 'characterName': deck.names[character],
+                'weapon_id': tables.cardIds[weapon], 'weaponName': deck.names[weapon],
+                'score': round(float(scores[i, j]), 3),
+            })
+    ranking.sort(key = lambda s: (-s['score'], s['characterName'], s['weaponName']))
+    cache.set(cacheKey, ranking, HINT_CACHE_SECONDS)
+    return ranking
@@ -0,0 +1,123 @@
+"""
+Timing of the hot model methods.  A method decorated with @instrumented has every call timed, with the SQL statements
+it ran, into a ring buffer of the most recent calls of the process.  Every process writes its ring buffer to the
+CLUELESS_INSTRUMENT_DIR directory at most every FLUSH_INTERVAL seconds, and the instrument_report command adds the
+calls up per method.
+
+Without CLUELESS_INSTRUMENT_DIR a decorated method costs one flag check on top of the call.
+"""
+from django.conf import settings
+
+import collections
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from clueless import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RING_SIZE = 5000 #calls kept per process
+FLUSH_INTERVAL = 10.0 #seconds between the ring buffer writes of a process
+
+_directory = None
+_calls = collections.deque(maxlen = DEFAULT_RING_SIZE) #(method, start time, seconds, statements)
+_lastFlush = 0.0
+_flushLock = threading.Lock()
+
+
+def enable(directory, ringSize = DEFAULT_RING_SIZE):
+    """
+    Starts timing the instrumented methods
+    :param directory: where the ring buffer is written
+    """
+    global _directory, _calls
+    metrics.installQueryTiming()
+    _calls = collections.deque(maxlen = ringSize)
+    _directory = directory
+
+
+def disable():
+    global _directory
+    _directory = None
+
+
+def instrumented(method):
+    """
+    Decorator timing every call of a method, see the module documentation
+    """
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _directory is None:
+            return method(*args, **kwargs)
+        queries = metrics.queryCount()
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            end = time.time()
+            _calls.append((name, start, end - start, metrics.queryCount() - queries))
+            if end - _lastFlush >= FLUSH_INTERVAL:
+                #timing must never break the call it times
+                try:
+                    flush()
+                except Exception:
+                    logger.exception("Could not write the instrumented calls to {}".format(_directory))
+    return wrapper
+
+
+def flush():
+    """
+    Writes this process's ring buffer to the instrumentation directory
+    """
+    global _lastFlush
+    directory = _directory
+    if directory is None:
+        return
+    #one writer per process, the others carry on
+    if not _flushLock.acquire(blocking = False):
+        return
+    try:
+        _lastFlush = time.time()
+        os.makedirs(directory, exist_ok = True)
+        path = os.path.join(directory, "calls-{}.json".format(os.getpid()))
+        partPath = path + ".part"
+        with open(partPath, 'w') as f:
+            json.dump([list(call) for call in list(_calls)], f)
+        os.replace(partPath, path)
+    finally:
+        _flushLock.release()
+
+
+def summarize(directory, method = None):
+    """
+    Adds up the ring buffers written by every process
+    :param method: only the calls of this method, e.g. Game.startGame
+    :return: dictionary of method -> {'calls', 'total', 'max', 'queries'}, times in seconds
+    """
+    summary = dict()
+    for path in glob.glob(os.path.join(directory, "calls-*.json")):
+        try:
+            with open(path) as f:
+                calls = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, start, seconds, queries in calls:
+            if method is not None and name != method:
+                continue
+            entry = summary.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0, 'queries': 0})
+            entry['calls'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['queries'] += queries
+    return summary
+
+
+if getattr(settings, 'CLUELESS_INSTRUMENT_DIR', None):
+    enable(settings.CLUELESS_INSTRUMENT_DIR, getattr(settings, 'CLUELESS_INSTRUMENT_RING_SIZE', DEFAULT_RING_SIZE))
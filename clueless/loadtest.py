@@ -0,0 +1,308 @@
+"""
+Synthetic load for capacity planning.  A LoadTest creates a batch of games of users, then plays them through the real
+controller URLs with the Django test client while every seat polls the game state the way play.html does: once a
+second, fetching the player list and detective sheet when the game changed, and the action bar when the turn or a
+card reveal changes hands.
+
+Each game is driven by one thread, which plays every seat of the game with a bot strategy, a request at a time, and
+each seat polls from a thread of its own.  Every request is timed, and the timings are summed up per endpoint.
+"""
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+import math
+import random
+import threading
+import time
+import uuid
+
+from clueless.bots import createBot
+from clueless.engine_adapter import GameStateAdapter, getEngineTables
+from clueless.models import Character, Game, Player, Space
+
+POLL_INTERVAL = 1.0 #seconds, as play.html polls
+DEFAULT_THINK_TIME = 0.5 #seconds a seat waits before each action
+DEFAULT_STRATEGY = "detective"
+MAX_GAME_REQUESTS = 2000 #per game, so a stalled game can't drive forever
+
+
+def percentile(sortedValues, fraction):
+    """
+    :param sortedValues: non-empty sorted list
+    :param fraction: 0 to 1
+    :return: nearest rank percentile
+    """
+    rank = max(int(math.ceil(fraction * len(sortedValues))) - 1, 0)
+    return sortedValues[min(rank, len(sortedValues) - 1)]
+
+
+class LatencyRecorder(object):
+    """
+    Request timings per endpoint, shared by every thread of a load test
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__timings = dict()
+        self.__errors = dict()
+
+    def record(self, endpoint, seconds, statusCode):
+        with self.__lock:
+            self.__timings.setdefault(endpoint, []).append(seconds)
+            if statusCode >= 400:
+                self.__errors[endpoint] = self.__errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        """
+        :param elapsed: seconds the load ran for
+        :return: dictionary of endpoint -> {'requests', 'errors', 'perSecond', 'mean', 'p50', 'p95', 'p99', 'max'},
+        latencies in milliseconds
+        """
+        with self.__lock:
+            timings = dict((endpoint, sorted(values)) for endpoint, values in self.__timings.items())
+            errors = dict(self.__errors)
+        summary = dict()
+        for endpoint, values in timings.items():
+            summary[endpoint] = {
+                'requests': len(values),
+                'errors': errors.get(endpoint, 0),
+                'perSecond': round(len(values) / elapsed, 2) if elapsed else 0.0,
+                'mean': round(sum(values) * 1000 / len(values), 2),
+                'p50': round(percentile(values, 0.50) * 1000, 2),
+                'p95': round(percentile(values, 0.95) * 1000, 2),
+                'p99': round(percentile(values, 0.99) * 1000, 2),
+                'max': round(values[-1] * 1000, 2),
+            }
+        return summary
+
+
+class LoadTest(object):
+    """
+    One run of synthetic load: set up, run, then tear down
+    """
+    def __init__(self, games, players, pollInterval = POLL_INTERVAL, thinkTime = DEFAULT_THINK_TIME,
+                 strategy = DEFAULT_STRATEGY, seed = 0):
+        """
+        :param games: number of games played at the same time
+        :param players: users in each game, 2 to 6
+        :param pollInterval: seconds between the game state polls of a seat
+        :param thinkTime: seconds a seat waits before each action
+        :param strategy: bot strategy that picks the actions of every seat
+        :param seed: the games and their bots follow from it
+        """
+        if not 2 <= players <= Character.objects.count():
+            raise RuntimeError("A game needs 2 to {} players".format(Character.objects.count()))
+        self.gameCount = games
+        self.playerCount = players
+        self.pollInterval = pollInterval
+        self.thinkTime = thinkTime
+        self.strategy = strategy
+        self.seed = seed
+        self.recorder = LatencyRecorder()
+        self.runId = uuid.uuid4().hex[0:8]
+        self.games = list()
+        self.users = list()
+        self.__collectorIds = dict(Space.objects.values_list('id', 'spaceCollector_id'))
+
+    def setUp(self):
+        """
+        Creates the users and starts their games
+        """
+        characters = list(Character.objects.order_by('card_id')[0:self.playerCount])
+        for g in range(0, self.gameCount):
+            players = list()
+            for p, character in enumerate(characters):
+                user = User(username = "loadtest-{}-{}-{}".format(self.runId, g, p))
+                user.set_unusable_password()
+                user.save()
+                self.users.append(user)
+                player = Player(user = user, character = character, currentSpace = character.defaultSpace)
+                player.save()
+                players.append(player)
+            game = Game(name = "load test {} {}".format(self.runId, g), seed = self.seed * 100000 + g)
+            game.initializeGame(players[0])
+            for player in players:
+                game.addPlayer(player)
+            game.startGame(players[0].user)
+            self.games.append(game)
+
+    def tearDown(self):
+        """
+        Deletes the games, their players and the users
+        """
+        for game in self.games:
+            game.refresh_from_db()
+            caseFile = game.caseFile
+            Game.objects.filter(id = game.id).update(currentTurn = None)
+            Player.objects.filter(currentGame = game).delete()
+            caseFile.delete()
+        User.objects.filter(id__in = [user.id for user in self.users]).delete()
+        self.games = list()
+        self.users = list()
+
+    def run(self, duration):
+        """
+        Plays the games until they are all over or duration seconds have gone by
+        :return: (seconds the load ran for, summary from LatencyRecorder.summary)
+        """
+        stop = threading.Event()
+        pollers = list()
+        drivers = list()
+        for game in self.games:
+            drivers.append(threading.Thread(target = self.__inThread, args = (self.driveGame, game, stop)))
+            for player in Player.objects.filter(currentGame = game, user__isnull = False).select_related('user'):
+                pollers.append(threading.Thread(target = self.__inThread, args = (self.pollSeat, game, player, stop)))
+
+        start = time.time()
+        for thread in drivers + pollers:
+            thread.start()
+        deadline = start + duration
+        for thread in drivers:
+            thread.join(max(deadline - time.time(), 0))
+        stop.set()
+        for thread in drivers + pollers:
+            thread.join()
+        elapsed = time.time() - start
+        return (elapsed, self.recorder.summary(elapsed))
+
+    def request(self, client, endpoint, url, data = None):
+        """
+        Sends a GET, or a POST if there is data, and times it
+        :return: the response
+        """
+        start = time.time()
+        response = client.post(url, data) if data is not None else client.get(url)
+        self.recorder.record(endpoint, time.time() - start, response.status_code)
+        return response
+
+    def driveGame(self, game, stop):
+        """
+        Plays every seat of a game until it is over, stop is set or MAX_GAME_REQUESTS have been sent
+        """
+        clients = dict()
+        for player in Player.objects.filter(currentGame = game, user__isnull = False).select_related('user'):
+            clients[player.id] = Client()
+            clients[player.id].force_login(player.user)
+        bots = dict()
+        decided = set()
+        requests = 0
+        while not stop.is_set() and requests < MAX_GAME_REQUESTS:
+            if stop.wait(self.thinkTime):
+                break
+            if not self.playStep(Game.objects.get(id = game.id), clients, bots, decided):
+                break
+            requests += 1
+        for client in clients.values():
+            client.logout()
+
+    def playStep(self, game, clients, bots, decided):
+        """
+        Sends the next request of a game: the revealing seat's card if a reveal is pending, otherwise the next action
+        of the seat whose turn it is, as chosen by its bot
+        :param clients: dictionary of player id -> logged in Client
+        :param bots: dictionary of seat index -> Bot, filled in as seats first act
+        :param decided: set of (turn id, action) already decided, so a seat that chose to stay or not to suggest
+        goes on to its next action
+        :return: False if the game is over
+        """
+        tables = getEngineTables()
+        state = GameStateAdapter(game).load(history = True)
+        if state.finished:
+            return False
+
+        seatIndex = state.revealingSeat if state.revealingSeat is not None else state.turnSeat
+        if seatIndex not in bots:
+            bots[seatIndex] = createBot(self.strategy, random.Random("{}:bot:{}".format(game.seed, seatIndex)))
+        bot = bots[seatIndex]
+        playerId = state.seats[seatIndex].playerId
+        client = clients[playerId]
+        playerUrlArgs = {'game_id': game.id, 'player_id': playerId}
+
+        if state.revealingSeat is not None:
+            cards = state.revealableCards()
+            card = bot.chooseReveal(state, seatIndex, cards)
+            self.request(client, 'card_reveal_controller', reverse('card_reveal_controller', kwargs = playerUrlArgs),
+                         {'card_id': tables.cardIds[card if card in cards else cards[0]]})
+            return True
+
+        turnUrl = reverse('playerturn', kwargs = {'game_id': game.id})
+        actions = state.availableActions()
+        if "Move" in actions and (game.currentTurn_id, "Move") not in decided:
+            decided.add((game.currentTurn_id, "Move"))
+            moves = state.validMoves()
+            space = bot.chooseMove(state, seatIndex, moves)
+            if space in moves:
+                self.request(client, 'playerturn.moveSpace', turnUrl, {
+                    'player_move': 'moveSpace', 'new_position': self.__collectorIds[space]})
+                return True
+
+        if "Suggestion" in actions and (game.currentTurn_id, "Suggestion") not in decided:
+            decided.add((game.currentTurn_id, "Suggestion"))
+            suggestion = bot.chooseSuggestion(state, seatIndex)
+            if suggestion is not None:
+                room = state.board.roomAt(state.spaceOf(state.seats[seatIndex]))
+                self.request(client, 'make_suggestion_controller',
+                             reverse('make_suggestion_controller', kwargs = playerUrlArgs), {
+                                 'suspect_id': tables.cardIds[suggestion[0]], 'room_id': tables.cardIds[room],
+                                 'weapon_id': tables.cardIds[suggestion[1]]})
+                return True
+
+        if "Accusation" in actions:
+            accusation = bot.chooseAccusation(state, seatIndex)
+            if accusation is None and "EndTurn" not in actions:
+                accusation = bot.guessAccusation(state, seatIndex)
+            if accusation is not None:
+                self.request(client, 'make_accusation_controller',
+                             reverse('make_accusation_controller', kwargs = playerUrlArgs), {
+                                 'suspect_id': tables.cardIds[accusation[0]],
+                                 'room_id': tables.cardIds[accusation[1]],
+                                 'weapon_id': tables.cardIds[accusation[2]]})
+                return True
+
+        self.request(client, 'playerturn.endTurn', turnUrl, {'player_move': 'endTurn'})
+        return True
+
+    def pollSeat(self, game, player, stop):
+        """
+        Polls the game state for one seat, and fetches what play.html would fetch on a change, until stop is set
+        """
+        client = Client()
+        client.force_login(player.user)
+        playerUrlArgs = {'game_id': game.id, 'player_id': player.id}
+        cachedSequence = -1
+        flags = None
+        #spread the seats over the poll interval, as browsers opened at different times would be
+        if not stop.wait(random.Random("{}:poll:{}".format(game.seed, player.id)).random() * self.pollInterval):
+            while True:
+                start = time.time()
+                response = self.request(client, 'gamestate', reverse('gamestate'), {
+                    'game_id': game.id, 'player_id': player.id, 'cached_game_seq': cachedSequence})
+                if response.status_code == 200:
+                    data = response.json()
+                    if data['changed']:
+                        gamestate = data['gamestate']
+                        cachedSequence = gamestate['game_sequence']
+                        self.request(client, 'playerlist', reverse('playerlist', kwargs = playerUrlArgs))
+                        self.request(client, 'detectivesheet', reverse('detectivesheet', kwargs = playerUrlArgs))
+                        newFlags = (gamestate['isPlayerTurn'], gamestate['isCardReveal'],
+                                    gamestate['isWaitingForCardReveal'])
+                        if newFlags != flags:
+                            flags = newFlags
+                            if gamestate['isCardReveal']:
+                                #the reveal can be made before this gets there, as it can for a browser
+                                self.request(client, 'card_reveal_controller.form',
+                                             reverse('card_reveal_controller', kwargs = playerUrlArgs))
+                            else:
+                                self.request(client, 'playerturn',
+                                             reverse('playerturn', kwargs = {'game_id': game.id}))
+                if stop.wait(max(self.pollInterval - (time.time() - start), 0)):
+                    break
+        client.logout()
+
+    def __inThread(self, target, *args):
+        try:
+            target(*args)
+        finally:
+            #every thread has its own connection
+            connection.close()
@@ -0,0 +1,110 @@
+"""
+Lobby listings.  Each listing is a single query over the narrow OpenGameSummary table returning plain dictionaries,
+paged with a keyset on (lastUpdateTime, game id) so the cost of a page does not grow with the number of games in the
+table.  Pages are kept in the Django cache for a few seconds, and every cached page is dropped as soon as a game is
+created, joined, started or finished.
+"""
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+import calendar
+import datetime
+import uuid
+
+from clueless.models import OpenGameSummary, Player, STATUS_CHOICES
+
+LOBBY_PAGE_SIZE = 25
+LOBBY_CACHE_SECONDS = 5
+VERSION_CACHE_KEY = 'clueless.lobby.version'
+
+STATUS_NAMES = dict(STATUS_CHOICES)
+
+
+def invalidateLobby():
+    """
+    Drops every cached lobby page
+    """
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def encodeCursor(game):
+    """
+    :param game: dictionary of the last game on a page
+    :return: string token for the page after it
+    """
+    updated = game['lastUpdateTime']
+    micros = calendar.timegm(updated.utctimetuple()) * 1000000 + updated.microsecond
+    return "{}_{}".format(micros, game['id'])
+
+
+def decodeCursor(cursor):
+    """
+    :param cursor: token made by encodeCursor
+    :return: (lastUpdateTime, id) tuple, or None if the token is missing or malformed
+    """
+    try:
+        micros, gameId = (int(part) for part in cursor.split("_"))
+    except (AttributeError, ValueError):
+        return None
+    updated = datetime.datetime.fromtimestamp(micros // 1000000, timezone.utc).replace(microsecond=micros % 1000000)
+    return (updated, gameId)
+
+
+def _summaries(queryset, cursor, limit, updateTimeField = 'lastUpdateTime'):
+    """
+    :param updateTimeField: field the last update time is read from, game__lastUpdateTime for the time of the last
+    move rather than of the last change to the lobby facts
+    :return: list of game dictionaries, newest first, with the host's username, the number of user players and the
+    number of open seats
+    """
+    position = decodeCursor(cursor)
+    if position is not None:
+        updated, gameId = position
+        queryset = queryset.filter(Q(lastUpdateTime__lt=updated) | Q(lastUpdateTime=updated, game_id__lt=gameId))
+
+    rows = queryset.order_by('-' + updateTimeField, '-game_id').values(
+        'game_id', 'name', 'status', updateTimeField, 'hostUsername', 'playerCount', 'freeCharacters')
+    if limit is not None:
+        rows = rows[:limit]
+
+    games = list()
+    for row in rows:
+        row['id'] = row.pop('game_id')
+        row['lastUpdateTime'] = row.pop(updateTimeField)
+        row['openSeats'] = bin(row.pop('freeCharacters')).count("1")
+        row['statusDisplay'] = STATUS_NAMES[row['status']]
+        games.append(row)
+    return games
+
+
+def lobbyGames(user, cursor = None):
+    """
+    :param user: User viewing the lobby
+    :param cursor: token of the page of other games to show, None for the first page
+    :return: (user's unfinished games, page of other unfinished games, token of the next page or None)
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    cacheKey = "clueless.lobby.{}.{}.{}".format(version, user.id, cursor or "")
+    page = cache.get(cacheKey)
+    if page is not None:
+        return page
+
+    #summaries only exist for unfinished games
+    userGameIds = Player.objects.filter(user=user, currentGame__isnull=False).values('currentGame_id')
+    #the summary only changes with the lobby facts, the user's own games show when they were last played
+    currentGames = _summaries(OpenGameSummary.objects.filter(game_id__in=userGameIds), None, None,
+                              'game__lastUpdateTime')
+    #fetch one extra game to find out whether there is another page
+    openGames = _summaries(OpenGameSummary.objects.exclude(game_id__in=userGameIds), cursor, LOBBY_PAGE_SIZE + 1)
+    nextCursor = None
+    if len(openGames) > LOBBY_PAGE_SIZE:
+        openGames = openGames[:LOBBY_PAGE_SIZE]
+        nextCursor = encodeCursor(openGames[-1])
+
+    page = (currentGames, openGames, nextCursor)
+    cache.set(cacheKey, page, LOBBY_CACHE_SECONDS)
+    return page
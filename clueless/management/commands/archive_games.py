@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from clueless.archive import archivableGames, archiveGame, rehydrateGame, DEFAULT_BATCH_SIZE
+from clueless.models import Game
+
+class Command(BaseCommand):
+    help = 'Moves the rows of completed games into compressed archives, or restores an archived game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='archive games finished more than this many days ago')
+        parser.add_argument('--limit', type=int, default=100, help='maximum number of games archived in one run')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows deleted per statement')
+        parser.add_argument('--rehydrate', type=int, metavar='GAME_ID', help='restore the archived rows of a game')
+
+    def handle(self, *args, **options):
+        if options['rehydrate'] is not None:
+            try:
+                game = Game.objects.get(id=options['rehydrate'])
+            except Game.DoesNotExist:
+                raise CommandError("Game {} does not exist".format(options['rehydrate']))
+            if not rehydrateGame(game):
+                raise CommandError("Game {} is not archived".format(game.id))
+            print("Restored game {}".format(game.id))
+            print("Finished!")
+            return
+
+        print("Archiving games completed more than {} days ago".format(options['days']))
+        archivedCount = 0
+        for game in archivableGames(options['days'])[:options['limit']]:
+            archive = archiveGame(game, options['batch_size'])
+            archivedCount += 1
+            print("Archived game {}: {} rows in {} bytes".format(game.id, archive.rowCount, len(archive.data)))
+        print("Archived {} games".format(archivedCount))
+        print("Finished!")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from clueless.models import Card, Character, Room, Weapon
+
+class Command(BaseCommand):
+    help = 'Fills in the card_type and ordinal columns for cards created before they existed'
+
+    def handle(self, *args, **options):
+        print("Starting backfill of card types")
+        with transaction.atomic():
+            #the child tables are still the authority on what type a card is
+            for cardClass in (Character, Room, Weapon):
+                cardIds = cardClass.objects.values_list('card_id', flat=True)
+                Card.objects.filter(card_id__in=list(cardIds)).update(card_type=cardClass.cardType)
+
+            #number any unnumbered cards after the ones that already have an ordinal, in creation order
+            maxOrdinal = Card.objects.aggregate(Max('ordinal'))['ordinal__max']
+            nextOrdinal = 0 if maxOrdinal is None else maxOrdinal + 1
+            for card in Card.objects.filter(ordinal=None).order_by('card_id'):
+                Card.objects.filter(card_id=card.card_id).update(ordinal=nextOrdinal)
+                nextOrdinal += 1
+
+        print("Finished!")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from clueless.game_export import exportLines
+from clueless.models import Game
+
+class Command(BaseCommand):
+    help = 'Streams games out to a JSON Lines file: header, players, deal, actions, stream entries and event log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file the games are written to')
+        parser.add_argument('--game', type=int, action='append', default=[], help='only this game, can be repeated')
+        parser.add_argument('--status', type=int, default=None, help='only games with this status, e.g. 2 for complete')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['game']:
+            games = games.filter(id__in=options['game'])
+        if options['status'] is not None:
+            games = games.filter(status=options['status'])
+
+        print("Exporting {} games to {}".format(games.count(), options['output']))
+        lineCount = 0
+        with open(options['output'], 'w') as f:
+            for line in exportLines(games):
+                f.write(line)
+                lineCount += 1
+        print("Wrote {} records".format(lineCount))
+        print("Finished!")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.models import ActionTiming, Game, Player
+
+class Command(BaseCommand):
+    help = 'Prints the action latency timeline of a game: server time, wait since the previous action and how long ' \
+           'each seat took to fetch it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int)
+        parser.add_argument('--kind', default=None, help='only this kind of action, e.g. suggestion')
+
+    def handle(self, *args, **options):
+        try:
+            game = Game.objects.get(id=options['game_id'])
+        except Game.DoesNotExist:
+            raise CommandError("No game {}".format(options['game_id']))
+
+        names = dict((p.id, p.displayName()) for p in Player.objects.filter(currentGame=game).select_related(
+            'user', 'character'))
+        #fetches noted by this process that are still waiting to be written
+        ActionTiming.flushFetches()
+        timings = ActionTiming.objects.filter(game=game).prefetch_related('actionfetch_set').order_by('sequence', 'id')
+        if options['kind']:
+            timings = timings.filter(kind=options['kind'])
+
+        print("Timeline of game {} ({})".format(game.id, game.name))
+        print("{:>5} {:<15} {:<10} {:<20} {:>8} {:>10} {:>11}  {}".format(
+            "seq", "time", "kind", "player", "server", "since prev", "last fetch", "fetch per seat (ms)"))
+        for timing in timings:
+            delays = timing.fetchDelayMap()
+            print("{:>5} {:<15} {:<10} {:<20} {:>8} {:>10} {:>11}  {}".format(
+                timing.sequence, timing.doneAt.strftime("%H:%M:%S.%f")[0:12], timing.kind,
+                names.get(timing.player_id, "bots")[0:20], timing.processingMs, timing.sincePreviousMs,
+                max(delays.values()) if delays else "-",
+                " ".join("{}={}".format(names.get(playerId, playerId), ms) for playerId, ms in sorted(delays.items()))))
+        print("Finished!")
@@ -0,0 +1,29 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.game_export import importGames, CHUNK_SIZE
+from clueless.models import COMPLETE
+
+class Command(BaseCommand):
+    help = 'Imports the games of a JSON Lines export under new ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='file written by export_games')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows inserted per statement')
+
+    def handle(self, *args, **options):
+        importedCount = 0
+        unfinished = False
+        try:
+            with open(options['input']) as f:
+                for exportedId, game in importGames(f, options['chunk_size']):
+                    importedCount += 1
+                    unfinished = unfinished or game.status != COMPLETE
+                    print("Imported game {} as game {}".format(exportedId, game.id))
+        except (OSError, RuntimeError, ValueError) as e:
+            raise CommandError("Import stopped after {} games: {}".format(importedCount, e))
+        #unfinished games show up in the lobby
+        if unfinished:
+            call_command('rebuild_open_game_summaries')
+        print("Imported {} games".format(importedCount))
+        print("Finished!")
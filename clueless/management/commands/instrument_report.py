@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.instrumentation import summarize
+
+import glob
+import os
+
+class Command(BaseCommand):
+    help = 'Adds up the timed calls of the instrumented model methods written by every process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='instrumentation directory, CLUELESS_INSTRUMENT_DIR by default')
+        parser.add_argument('--method', default=None, help='only this method, e.g. Game.gameStateJSON')
+        parser.add_argument('--sort', default='total', choices=['total', 'max', 'calls', 'queries'])
+        parser.add_argument('--clear', action='store_true', help='delete the recorded calls after reporting')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or getattr(settings, 'CLUELESS_INSTRUMENT_DIR', None)
+        if not directory or not os.path.isdir(directory):
+            raise CommandError("No instrumentation directory, set CLUELESS_INSTRUMENT_DIR or use --dir")
+
+        summary = summarize(directory, options['method'])
+        print("{:<28} {:>8} {:>11} {:>9} {:>9} {:>9} {:>8}".format(
+            "method", "calls", "total ms", "mean ms", "max ms", "queries", "q/call"))
+        for name, s in sorted(summary.items(), key=lambda item: -item[1][options['sort']]):
+            print("{:<28} {:>8} {:>11.2f} {:>9.3f} {:>9.2f} {:>9} {:>8.1f}".format(
+                name, s['calls'], s['total'] * 1000, s['total'] * 1000 / s['calls'], s['max'] * 1000, s['queries'],
+                float(s['queries']) / s['calls']))
+
+        if options['clear']:
+            for path in glob.glob(os.path.join(directory, "calls-*.json")):
+                os.remove(path)
+        print("Finished!")
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.bots import BOT_STRATEGIES
+from clueless.loadtest import DEFAULT_STRATEGY, DEFAULT_THINK_TIME, POLL_INTERVAL, LoadTest
+
+import json
+
+class Command(BaseCommand):
+    help = 'Plays concurrent games through the real views while every seat polls the game state, and reports ' \
+           'throughput and latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=10, help='games played at the same time')
+        parser.add_argument('--players', type=int, default=4, help='users in each game')
+        parser.add_argument('--duration', type=float, default=60.0, help='seconds to run for at most')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help='seconds between polls')
+        parser.add_argument('--think-time', type=float, default=DEFAULT_THINK_TIME,
+                            help='seconds a seat waits before each action')
+        parser.add_argument('--strategy', default=DEFAULT_STRATEGY, help='bot strategy choosing the actions')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='where to write the results as JSON')
+        parser.add_argument('--keep', action='store_true', help='keep the games and users instead of deleting them')
+
+    def handle(self, *args, **options):
+        if options['strategy'] not in BOT_STRATEGIES:
+            raise CommandError("Unknown bot strategy {}, expected one of {}".format(
+                options['strategy'], ", ".join(sorted(BOT_STRATEGIES))))
+        try:
+            loadTest = LoadTest(options['games'], options['players'], options['poll_interval'], options['think_time'],
+                                options['strategy'], options['seed'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        print("Setting up {} games of {} players".format(options['games'], options['players']))
+        loadTest.setUp()
+        try:
+            print("Running for up to {:.0f} seconds".format(options['duration']))
+            elapsed, summary = loadTest.run(options['duration'])
+        finally:
+            if not options['keep']:
+                loadTest.tearDown()
+
+        print("{:<28} {:>8} {:>6} {:>8} {:>9} {:>9} {:>9}".format(
+            "endpoint", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+        for endpoint in sorted(summary):
+            s = summary[endpoint]
+            print("{:<28} {:>8} {:>6} {:>8.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                endpoint, s['requests'], s['errors'], s['perSecond'], s['p50'], s['p95'], s['p99']))
+        total = sum(s['requests'] for s in summary.values())
+        print("{} requests in {:.1f} seconds, {:.1f} requests/s".format(total, elapsed, total / elapsed if elapsed else 0))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'games': options['games'], 'players': options['players'], 'seconds': round(elapsed, 3),
+                           'endpoints': summary}, f, indent=2, sort_keys=True)
+        print("Finished!")
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.middleware import profileHeaderValue
+
+import os
+import pstats
+
+class Command(BaseCommand):
+    help = 'Adds up the request profiles dumped by ProfilingMiddleware and lists the top functions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='profile directory, CLUELESS_PROFILE_DIR by default')
+        parser.add_argument('--view', default=None, help='only the profiles of this view, e.g. playerturn.endTurn')
+        parser.add_argument('--game', type=int, default=None, help='only the profiles of this game')
+        parser.add_argument('--top', type=int, default=30, help='number of functions to list')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key, cumulative by default')
+        parser.add_argument('--header', action='store_true',
+                            help='print a signed X-Clueless-Profile header value instead, to profile a request')
+
+    def handle(self, *args, **options):
+        if options['header']:
+            print("X-Clueless-Profile: {}".format(profileHeaderValue()))
+            return
+
+        directory = options['dir'] or getattr(settings, 'CLUELESS_PROFILE_DIR', None)
+        if not directory or not os.path.isdir(directory):
+            raise CommandError("No profile directory, set CLUELESS_PROFILE_DIR or use --dir")
+
+        dumps = list()
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".pstats"):
+                continue
+            #time-view-game-pid.pstats
+            parts = name[:-len(".pstats")].split("-")
+            if len(parts) != 4:
+                continue
+            if options['view'] is not None and parts[1] != options['view']:
+                continue
+            if options['game'] is not None and parts[2] != "game{}".format(options['game']):
+                continue
+            dumps.append(os.path.join(directory, name))
+        if not dumps:
+            raise CommandError("No profiles found in {}".format(directory))
+
+        print("{} profiles".format(len(dumps)))
+        stats = pstats.Stats(*dumps)
+        stats.sort_stats(options['sort']).print_stats(options['top'])
+        print("Finished!")
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.engine_adapter import GameStateAdapter
+from clueless.event_log import loggedEvents, rebuildState, stateDifferences, writeProjections
+from clueless.models import Game
+
+class Command(BaseCommand):
+    help = 'Rebuilds the state of a game from its event log and compares it with the stored positions, turn and ' \
+           'detective sheets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int)
+        parser.add_argument('--write', action='store_true',
+                            help='put the stored positions, sheets and turn phase right from the log')
+
+    def handle(self, *args, **options):
+        try:
+            game = Game.objects.get(id=options['game_id'])
+        except Game.DoesNotExist:
+            raise CommandError("No game {}".format(options['game_id']))
+
+        try:
+            rebuilt = rebuildState(game)
+        except RuntimeError as e:
+            raise CommandError("Game {} can't be rebuilt: {}".format(game.id, e))
+        print("Game {}: {} events logged".format(game.id, len(loggedEvents(game))))
+
+        differences = stateDifferences(rebuilt, GameStateAdapter(game).load(fromTables = True))
+        for difference in differences:
+            print("  " + difference)
+        if not differences:
+            print("Stored state matches the log")
+        elif options['write']:
+            writeProjections(game, rebuilt)
+            print("Stored state rewritten from the log")
+        print("Finished!")
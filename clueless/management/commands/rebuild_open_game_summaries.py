@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from clueless.lobby import invalidateLobby
+from clueless.models import Game, OpenGameSummary, Player, COMPLETE, NOT_STARTED, allCharactersMask, characterBit
+
+class Command(BaseCommand):
+    help = 'Rebuilds the open game summaries from the game and player tables'
+
+    def handle(self, *args, **options):
+        print("Starting rebuild of open game summaries")
+        with transaction.atomic():
+            OpenGameSummary.objects.all().delete()
+            for game in Game.objects.filter(status__lt=COMPLETE).select_related('hostPlayer__user').iterator():
+                summary = OpenGameSummary.createFor(game)
+                players = Player.objects.filter(currentGame=game, nonUserPlayer=False, botStrategy="")
+                summary.playerCount = players.count()
+                if game.status == NOT_STARTED:
+                    for characterId in players.values_list('character_id', flat=True):
+                        summary.freeCharacters &= allCharactersMask() ^ characterBit(characterId)
+                else:
+                    summary.freeCharacters = 0
+                summary.save()
+        invalidateLobby()
+        print("Finished!")
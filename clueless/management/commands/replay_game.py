@@ -0,0 +1,137 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from clueless.catalog import getCatalog
+from clueless.models import Accusation, CardReveal, DetectiveSheet, Game, Move, Player, SheetItem, Suggestion, Turn
+
+import time
+
+class Command(BaseCommand):
+    help = 'Replays the logged actions of a game from its seed, through the real views, as fast as possible'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int)
+        parser.add_argument('--repeat', type=int, default=1, help='number of times to replay the game')
+        parser.add_argument('--keep', action='store_true', help='keep the replayed games instead of deleting them')
+
+    def handle(self, *args, **options):
+        try:
+            source = Game.objects.get(id=options['game_id'])
+        except Game.DoesNotExist:
+            raise CommandError("Game {} does not exist".format(options['game_id']))
+        if source.status == 0:
+            raise CommandError("Game {} has not been started".format(source.id))
+
+        steps = self.__loggedSteps(source)
+        print("Replaying game {} (seed {}), {} steps".format(source.id, source.seed, len(steps)))
+
+        timings = {}
+        for i in range(0, options['repeat']):
+            replay = self.__setUpReplay(source)
+            try:
+                self.__checkDeal(source, replay)
+                self.__runSteps(source, replay, steps, timings)
+            finally:
+                if not options['keep']:
+                    self.__deleteGame(replay)
+
+        for stepName in sorted(timings):
+            count, total = timings[stepName]
+            print("{:<12} {:>6} calls {:>10.2f} ms total {:>8.2f} ms avg".format(
+                stepName, count, total * 1000, total * 1000 / count))
+        print("Finished!")
+
+    def __loggedSteps(self, source):
+        """
+        Turns the stored turns and actions of a game back into an ordered list of requests
+        :return: list of (step name, Player, url name, POST dict)
+        """
+        catalog = getCatalog()
+        steps = list()
+        turns = list(Turn.objects.filter(game=source).select_related('player').order_by('id'))
+        for turnIndex, turn in enumerate(turns):
+            turnEnded = turnIndex < len(turns) - 1
+            for action in Move.objects.filter(turn=turn).select_related('toSpace').order_by('id'):
+                steps.append(('move', turn.player, 'playerturn', {
+                    'player_move': 'moveSpace', 'new_position': action.toSpace.spaceCollector_id}))
+            for sugg in Suggestion.objects.filter(turn=turn).select_related('whoWhatWhere').order_by('id'):
+                www = sugg.whoWhatWhere
+                steps.append(('suggestion', turn.player, 'make_suggestion_controller', {
+                    'suspect_id': www.character_id, 'room_id': catalog.roomByPk(www.room_id).card_id,
+                    'weapon_id': www.weapon_id}))
+                for cr in CardReveal.objects.filter(suggestion=sugg).exclude(revealedCard=None).select_related(
+                        'revealingPlayer').order_by('id'):
+                    steps.append(('reveal', cr.revealingPlayer, 'card_reveal_controller', {
+                        'card_id': cr.revealedCard_id}))
+            for acc in Accusation.objects.filter(turn=turn).select_related('whoWhatWhere').order_by('id'):
+                www = acc.whoWhatWhere
+                steps.append(('accusation', turn.player, 'make_accusation_controller', {
+                    'suspect_id': www.character_id, 'room_id': catalog.roomByPk(www.room_id).card_id,
+                    'weapon_id': www.weapon_id}))
+                #a wrong accusation ends the turn by itself
+                turnEnded = False
+            if turnEnded:
+                steps.append(('endturn', turn.player, 'playerturn', {'player_move': 'endTurn'}))
+        return steps
+
+    def __setUpReplay(self, source):
+        """
+        Creates a new game with the same seed, host and players (in the same joining order) as the source game
+        """
+        sheets = DetectiveSheet.objects.filter(game=source).select_related('player').order_by('id')
+        sourcePlayers = [ds.player for ds in sheets]
+        newPlayers = dict()
+        for sp in sourcePlayers:
+            newPlayers[sp.id] = Player(user_id=sp.user_id, character_id=sp.character_id,
+                                       currentSpace_id=getCatalog().entry(sp.character_id).defaultSpace_id)
+            newPlayers[sp.id].save()
+
+        replay = Game(name="replay of {}".format(source.id), seed=source.seed)
+        replay.initializeGame(newPlayers[source.hostPlayer_id])
+        for sp in sourcePlayers:
+            replay.addPlayer(newPlayers[sp.id])
+        replay.startGame(source.hostPlayer.user)
+        replay.refresh_from_db()
+        replay.playerMap = newPlayers
+        return replay
+
+    def __checkDeal(self, source, replay):
+        if not source.caseFile.compare(replay.caseFile):
+            raise CommandError("Replay case file does not match, the seed does not reproduce game {}".format(source.id))
+        for sourcePlayerId, newPlayer in replay.playerMap.items():
+            sourceHand = set(SheetItem.objects.filter(
+                detectiveSheet__player_id=sourcePlayerId, initiallyDealt=True).values_list('card_id', flat=True))
+            newHand = set(SheetItem.objects.filter(
+                detectiveSheet__player=newPlayer, initiallyDealt=True).values_list('card_id', flat=True))
+            if sourceHand != newHand:
+                raise CommandError("Replay deal does not match for player {}".format(sourcePlayerId))
+
+    def __runSteps(self, source, replay, steps, timings):
+        clients = dict()
+        for stepName, sourcePlayer, urlName, data in steps:
+            player = replay.playerMap[sourcePlayer.id]
+            client = clients.get(player.id)
+            if client is None:
+                client = clients[player.id] = Client()
+                client.force_login(player.user)
+
+            if urlName == 'playerturn':
+                url = reverse(urlName, kwargs={'game_id': replay.id})
+            else:
+                url = reverse(urlName, kwargs={'game_id': replay.id, 'player_id': player.id})
+
+            start = time.time()
+            response = client.post(url, data)
+            elapsed = time.time() - start
+
+            if response.status_code >= 400:
+                raise CommandError("Replay diverged at {} by player {}: {} {}".format(
+                    stepName, sourcePlayer.id, response.status_code, response.content[:200]))
+            count, total = timings.get(stepName, (0, 0.0))
+            timings[stepName] = (count + 1, total + elapsed)
+
+    def __deleteGame(self, game):
+        caseFile = game.caseFile
+        Game.objects.filter(id=game.id).update(currentTurn=None)
+        Player.objects.filter(currentGame=game).delete()
+        caseFile.delete()
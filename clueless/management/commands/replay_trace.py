@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.traces import TraceReplay
+
+import json
+import os
+
+class Command(BaseCommand):
+    help = 'Rebuilds the games of a request trace and replays its requests, reporting latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help='trace file recorded with CLUELESS_TRACE_FILE')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='multiple of the traced pace, 10 for ten times as fast, 0 for as fast as possible')
+        parser.add_argument('--output', default=None, help='where to write the results as JSON')
+        parser.add_argument('--baseline', default=None,
+                            help='results of another build, written with --output, to compare against')
+        parser.add_argument('--keep', action='store_true', help='keep the games and users instead of deleting them')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['trace']):
+            raise CommandError("Trace {} does not exist".format(options['trace']))
+        if options['speed'] < 0:
+            raise CommandError("Speed can't be negative")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['endpoints']
+
+        replay = TraceReplay(options['trace'])
+        print("Replaying {} requests of {} games".format(len(replay.requests), len(replay.games)))
+        replay.setUp()
+        try:
+            elapsed, summary, traced = replay.run(options['speed'])
+        finally:
+            if not options['keep']:
+                replay.tearDown()
+
+        #compare against the other build if there is one, otherwise against the traced timings
+        against = baseline if baseline is not None else traced
+        print("{:<28} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+            "endpoint", "requests", "errors", "p50 ms", "was", "p95 ms", "was", "p50 diff"))
+        for endpoint in sorted(summary):
+            s = summary[endpoint]
+            was = against.get(endpoint)
+            if was is None:
+                print("{:<28} {:>8} {:>6} {:>9.2f} {:>9} {:>9.2f} {:>9}".format(
+                    endpoint, s['requests'], s['errors'], s['p50'], "-", s['p95'], "-"))
+                continue
+            diff = (s['p50'] - was['p50']) / was['p50'] if was['p50'] else 0.0
+            print("{:<28} {:>8} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>+8.1%}".format(
+                endpoint, s['requests'], s['errors'], s['p50'], was['p50'], s['p95'], was['p95'], diff))
+        print("{} requests replayed in {:.1f} seconds, {} skipped".format(
+            sum(s['requests'] for s in summary.values()), elapsed, replay.skipped))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'trace': options['trace'], 'speed': options['speed'], 'seconds': round(elapsed, 3),
+                           'skipped': replay.skipped, 'endpoints': summary}, f, indent=2, sort_keys=True)
+        print("Finished!")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from clueless.bot_runner import BotRunner, DEFAULT_DECISION_BUDGET, DEFAULT_WORKERS
+
+import time
+
+class Command(BaseCommand):
+    help = 'Plays the bot seats of started games from a pool of workers, polling for games waiting on a bot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='games advanced at the same time')
+        parser.add_argument('--budget-ms', type=int, default=int(DEFAULT_DECISION_BUDGET * 1000),
+                            help='milliseconds a bot gets per decision before a random one is made instead')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls')
+        parser.add_argument('--once', action='store_true', help='advance the waiting games once and exit')
+
+    def handle(self, *args, **options):
+        runner = BotRunner(options['workers'], options['budget_ms'] / 1000.0)
+        print("Running bots with {} workers, {} ms per decision".format(options['workers'], options['budget_ms']))
+        try:
+            while True:
+                steps = runner.runOnce()
+                for gameId in sorted(steps):
+                    print("Game {}: {} bot steps".format(gameId, steps[gameId]))
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            runner.shutdown()
+        print("Finished!")
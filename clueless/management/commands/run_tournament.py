@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.bots import BOT_STRATEGIES
+from clueless.simulation import MAX_GAME_STEPS
+from clueless.tournament import DEFAULT_BATCH_SIZE, DEFAULT_SHARD_SIZE, runTournament
+
+import json
+
+class Command(BaseCommand):
+    help = 'Plays a resumable round-robin tournament between bot strategies across a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('strategies', nargs='+', help='bot strategies taking part')
+        parser.add_argument('--seats', type=int, nargs='+', default=[3], help='table sizes to play, 2 to 6')
+        parser.add_argument('--games', type=int, default=200, help='games per table')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--processes', type=int, default=None, help='worker processes, one per core by default')
+        parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='games per worker task')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='shards between checkpoints')
+        parser.add_argument('--max-steps', type=int, default=MAX_GAME_STEPS, help='bot steps before a game stalls')
+        parser.add_argument('--results', default='tournament.jsonl', help='game results, one JSON object per line')
+        parser.add_argument('--checkpoint', default=None, help='checkpoint file, the results file + .checkpoint by '
+                                                               'default.  Run again with the same one to resume')
+        parser.add_argument('--ranking', default=None, help='where to write the final ranking as JSON')
+
+    def handle(self, *args, **options):
+        for name in options['strategies']:
+            if name not in BOT_STRATEGIES:
+                raise CommandError("Unknown bot strategy {}, expected one of {}".format(
+                    name, ", ".join(sorted(BOT_STRATEGIES))))
+        for seats in options['seats']:
+            if not 2 <= seats <= 6:
+                raise CommandError("A table needs 2 to 6 seats")
+        checkpointPath = options['checkpoint'] or options['results'] + ".checkpoint"
+
+        def progress(done, total):
+            print("{}/{} shards played".format(done, total))
+
+        print("Tournament of {} at tables of {}".format(", ".join(options['strategies']),
+                                                        ", ".join(str(s) for s in options['seats'])))
+        try:
+            ranking = runTournament(options['strategies'], options['seats'], options['games'], options['results'],
+                                    checkpointPath, options['seed'], options['processes'], options['shard_size'],
+                                    options['batch_size'], options['max_steps'], progress)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        print("{:<12} {:>8} {:>8} {:>8}".format("strategy", "elo", "games", "wins"))
+        for name, rating, games, wins in ranking:
+            print("{:<12} {:>8.1f} {:>8} {:>8}".format(name, rating, games, wins))
+        if options['ranking']:
+            with open(options['ranking'], 'w') as f:
+                json.dump([{'strategy': name, 'elo': rating, 'games': games, 'wins': wins}
+                           for name, rating, games, wins in ranking], f)
+        print("Finished!")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.bots import BOT_STRATEGIES
+from clueless.simulation import DEFAULT_CHUNK_SIZE, MAX_GAME_STEPS, runSimulation
+
+import json
+import time
+
+class Command(BaseCommand):
+    help = 'Plays bot games on the in-memory rules engine across a pool of processes and writes the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('strategies', nargs='+', help='bot strategy of each seat, in turn order')
+        parser.add_argument('--games', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='run seed, the same seed replays the same games')
+        parser.add_argument('--processes', type=int, default=None, help='worker processes, one per core by default')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='games per worker task')
+        parser.add_argument('--max-steps', type=int, default=MAX_GAME_STEPS, help='bot steps before a game stalls')
+        parser.add_argument('--output', default='simulation.json', help='result file')
+
+    def handle(self, *args, **options):
+        strategies = options['strategies']
+        for name in strategies:
+            if name not in BOT_STRATEGIES:
+                raise CommandError("Unknown bot strategy {}, expected one of {}".format(
+                    name, ", ".join(sorted(BOT_STRATEGIES))))
+        if not 2 <= len(strategies) <= 6:
+            raise CommandError("A game needs 2 to 6 seats")
+
+        print("Simulating {} games of {}".format(options['games'], " vs ".join(strategies)))
+        start = time.time()
+        result = runSimulation(strategies, options['games'], options['seed'], options['processes'],
+                               options['chunk_size'], options['max_steps'])
+        elapsed = time.time() - start
+        result['seconds'] = round(elapsed, 3)
+
+        with open(options['output'], 'w') as f:
+            json.dump(result, f, separators=(',', ':'))
+
+        for name, rate in result['strategyWinRates'].items():
+            print("{:<12} {:>6.1%} wins per seat".format(name, rate))
+        print("{} games, {} stalled, {:.2f} turns on average, {:.0f} games/s".format(
+            result['games'], result['stalled'], result['averageTurns'], result['games'] / elapsed if elapsed else 0))
+        print("Results written to {}".format(options['output']))
+        print("Finished!")
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from clueless.slow_queries import rankOffenders, readLog
+
+import os
+
+class Command(BaseCommand):
+    help = 'Ranks the code behind the slow and repeated statements in the slow query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, help='slow query log, CLUELESS_SLOW_QUERY_LOG by default')
+        parser.add_argument('--kind', default=None, choices=['slow', 'duplicate'])
+        parser.add_argument('--top', type=int, default=20)
+
+    def handle(self, *args, **options):
+        logPath = options['log'] or getattr(settings, 'CLUELESS_SLOW_QUERY_LOG', None)
+        if not logPath or not os.path.exists(logPath):
+            raise CommandError("No slow query log, set CLUELESS_SLOW_QUERY_LOG or use --log")
+
+        entries = [e for e in readLog(logPath) if options['kind'] is None or e['kind'] == options['kind']]
+        print("{} entries".format(len(entries)))
+        print("{:<10} {:<44} {:>7} {:>9} {:>11} {:>9}  {}".format(
+            "kind", "frame", "entries", "stmts", "total ms", "max ms", "views"))
+        for offender in rankOffenders(entries)[0:options['top']]:
+            print("{:<10} {:<44} {:>7} {:>9} {:>11.2f} {:>9.2f}  {}".format(
+                offender['kind'], offender['frame'] or "-", offender['entries'], offender['count'], offender['ms'],
+                offender['maxMs'], ", ".join(offender['views'])))
+            print("           {}".format(offender['sql'][0:160]))
+        print("Finished!")
@@ -0,0 +1,331 @@
+"""
+In-process metrics, exposed in the Prometheus text format.
+
+Every thread counts into a shard of its own, so counting takes no lock.  Each worker process adds its shards up into
+a snapshot and writes it to a spool directory, a file per process, at most every SPOOL_INTERVAL seconds, and the
+metrics endpoint adds up the spool files of every process.
+
+What is counted:
+    clueless_requests_total{view, status}             requests by view and status code
+    clueless_request_duration_seconds{view}           histogram of the request latency
+    clueless_request_queries{view}                    histogram of the SQL statements per request
+    clueless_request_query_duration_seconds_total{view}  time spent in SQL
+    clueless_gamestate_polls_total{changed}           game state polls, and whether the game had changed
+and, when the endpoint is read, the seats that polled in the last POLLER_WINDOW seconds and their games.
+
+SQL statements are timed by wrapping the cursors of every database connection, see installQueryTiming.
+"""
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import CursorWrapper
+
+import bisect
+import collections
+import glob
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #seconds
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200) #statements
+POLLER_WINDOW = 10.0 #seconds since its last poll a seat still counts as polling
+SPOOL_INTERVAL = 5.0 #seconds between the spool writes of a process
+
+HELP = collections.OrderedDict([
+    ('clueless_requests_total', ('counter', 'Requests by view and status code')),
+    ('clueless_request_duration_seconds', ('histogram', 'Request latency by view')),
+    ('clueless_request_queries', ('histogram', 'SQL statements per request by view')),
+    ('clueless_request_query_duration_seconds_total', ('counter', 'Seconds spent in SQL by view')),
+    ('clueless_gamestate_polls_total', ('counter', 'Game state polls, by whether the game had changed')),
+    ('clueless_gamestate_unchanged_ratio', ('gauge', 'Share of the game state polls that found no change')),
+    ('clueless_active_pollers', ('gauge', 'Seats that polled the game state in the last {:.0f} seconds'.format(
+        POLLER_WINDOW))),
+    ('clueless_active_games', ('gauge', 'Games with a seat polling the game state')),
+])
+
+enabled = False
+
+_local = threading.local()
+_shards = list() #(thread, shard) of every thread that has counted
+_shardsLock = threading.Lock() #only taken the first time a thread counts
+_retired = None #totals of the shards of finished threads
+_pollers = dict() #(game id, player id) -> time of the last poll
+_lastFlush = 0.0
+queryListeners = list() #callables(sql, seconds) told of every statement run
+
+
+class _Shard(object):
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = dict() #(name, labels) -> value
+        self.histograms = dict() #(name, labels) -> [count per bucket..., count over the last bucket, sum]
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shardsLock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def increment(name, labels = (), value = 1):
+    """
+    :param labels: tuple of (label, value) pairs
+    """
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value, buckets):
+    """
+    Adds a value to a histogram
+    :param buckets: sorted upper bounds, the same every time for a name
+    """
+    histograms = _shard().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(buckets) + 2)
+    histogram[bisect.bisect_left(buckets, value)] += 1
+    histogram[-1] += value
+
+
+def startRequest():
+    """
+    Starts counting the SQL statements of the current thread's request
+    """
+    _local.request = [0, 0.0]
+
+
+def finishRequest():
+    """
+    :return: (SQL statements, seconds spent in SQL) since startRequest
+    """
+    request = getattr(_local, 'request', None)
+    _local.request = None
+    return (request[0], request[1]) if request is not None else (0, 0.0)
+
+
+def observeRequest(view, statusCode, seconds, queries, querySeconds):
+    labels = (('view', view),)
+    increment('clueless_requests_total', labels + (('status', str(statusCode)),))
+    observe('clueless_request_duration_seconds', labels, seconds, LATENCY_BUCKETS)
+    observe('clueless_request_queries', labels, queries, QUERY_BUCKETS)
+    increment('clueless_request_query_duration_seconds_total', labels, querySeconds)
+
+
+def observePoll(gameId, playerId, changed):
+    """
+    Counts a game state poll.  Does nothing unless metrics are enabled
+    """
+    if not enabled:
+        return
+    increment('clueless_gamestate_polls_total', (('changed', 'true' if changed else 'false'),))
+    _pollers[(int(gameId), int(playerId))] = time.time()
+
+
+class QueryTimingCursor(CursorWrapper):
+    """
+    Adds the statements it runs, and their time, to the request being counted on this thread
+    """
+    def execute(self, sql, params = None):
+        start = time.time()
+        try:
+            return super(QueryTimingCursor, self).execute(sql, params)
+        finally:
+            _countQuery(sql, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(QueryTimingCursor, self).executemany(sql, param_list)
+        finally:
+            _countQuery(sql, time.time() - start)
+
+
+def _countQuery(sql, seconds):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    for listener in queryListeners:
+        listener(sql, seconds)
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        request[0] += 1
+        request[1] += seconds
+
+
+def _timeQueries(sender, connection, **kwargs):
+    if getattr(connection, 'cluelessQueryTiming', False):
+        return
+    connection.cluelessQueryTiming = True
+    makeCursor = connection.make_cursor
+    makeDebugCursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: QueryTimingCursor(makeCursor(cursor), connection)
+    connection.make_debug_cursor = lambda cursor: QueryTimingCursor(makeDebugCursor(cursor), connection)
+
+
+def queryCount():
+    """
+    :return: SQL statements this thread has run since installQueryTiming
+    """
+    return getattr(_local, 'queries', 0)
+
+
+def installQueryTiming():
+    """
+    Times the statements of every database connection, those open now and those opened later
+    """
+    connection_created.connect(_timeQueries, dispatch_uid = 'clueless.metrics')
+    for connection in connections.all():
+        _timeQueries(None, connection)
+
+
+def _addShards(shards):
+    total = _Shard()
+    for shard in shards:
+        #a dict copy is a single step for the interpreter, so the owning thread can keep counting
+        for key, value in dict(shard.counters).items():
+            total.counters[key] = total.counters.get(key, 0) + value
+        for key, histogram in dict(shard.histograms).items():
+            summed = total.histograms.get(key)
+            total.histograms[key] = list(histogram) if summed is None else [a + b for a, b in zip(summed, histogram)]
+    return total
+
+
+def snapshot():
+    """
+    :return: JSON friendly totals of this process: counters, histograms and the recent pollers
+    """
+    global _retired
+    with _shardsLock:
+        #fold the shards of finished threads into one, so a server starting a thread per request doesn't pile them up
+        finished = [shard for thread, shard in _shards if not thread.is_alive()]
+        if finished:
+            _shards[:] = [(thread, shard) for thread, shard in _shards if thread.is_alive()]
+            _retired = _addShards(([_retired] if _retired is not None else []) + finished)
+        shards = [shard for thread, shard in _shards] + ([_retired] if _retired is not None else [])
+    totals = _addShards(shards)
+    counters = totals.counters
+    histograms = totals.histograms
+
+    cutoff = time.time() - POLLER_WINDOW
+    pollers = list()
+    for key, seen in dict(_pollers).items():
+        if seen < cutoff:
+            _pollers.pop(key, None)
+        else:
+            pollers.append([key[0], key[1], seen])
+    return {
+        'pid': os.getpid(),
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), histogram] for (name, labels), histogram in histograms.items()],
+        'pollers': pollers,
+    }
+
+
+def flush(directory):
+    """
+    Writes this process's snapshot to the spool directory
+    """
+    global _lastFlush
+    _lastFlush = time.time()
+    os.makedirs(directory, exist_ok = True)
+    path = os.path.join(directory, "metrics-{}.json".format(os.getpid()))
+    #written aside and renamed, so a reader never sees half a file
+    partPath = path + ".part"
+    with open(partPath, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(partPath, path)
+
+
+def maybeFlush(directory):
+    """
+    Flushes if this process last did more than SPOOL_INTERVAL seconds ago
+    """
+    if time.time() - _lastFlush >= SPOOL_INTERVAL:
+        flush(directory)
+
+
+def collect(directory):
+    """
+    Adds up the spool files of every process, this one flushed first
+    :return: (counters, histograms, pollers): dictionaries of (name, labels) -> value, (name, labels) -> histogram
+    and (game id, player id) -> time of the last poll
+    """
+    flush(directory)
+    counters = dict()
+    histograms = dict()
+    pollers = dict()
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                spooled = json.load(f)
+        except (OSError, ValueError):
+            #the process is rewriting it, its counts show up on the next read
+            continue
+        for name, labels, value in spooled['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in spooled['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.get(key)
+            histograms[key] = histogram if total is None else [a + b for a, b in zip(total, histogram)]
+        for gameId, playerId, seen in spooled['pollers']:
+            pollers[(gameId, playerId)] = max(seen, pollers.get((gameId, playerId), 0))
+    return (counters, histograms, pollers)
+
+
+def _labelText(labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def renderPrometheus(directory):
+    """
+    :return: the metrics of every process, in the Prometheus text format
+    """
+    counters, histograms, pollers = collect(directory)
+    cutoff = time.time() - POLLER_WINDOW
+    active = [key for key, seen in pollers.items() if seen >= cutoff]
+    polls = dict((dict(labels).get('changed'), value) for (name, labels), value in counters.items()
+                 if name == 'clueless_gamestate_polls_total')
+    totalPolls = sum(polls.values())
+    gauges = {
+        'clueless_gamestate_unchanged_ratio': float(polls.get('false', 0)) / totalPolls if totalPolls else 0.0,
+        'clueless_active_pollers': len(active),
+        'clueless_active_games': len(set(gameId for gameId, playerId in active)),
+    }
+
+    bucketsByName = {'clueless_request_duration_seconds': LATENCY_BUCKETS, 'clueless_request_queries': QUERY_BUCKETS}
+    lines = list()
+    for name, (metricType, helpText) in HELP.items():
+        lines.append("# HELP {} {}".format(name, helpText))
+        lines.append("# TYPE {} {}".format(name, metricType))
+        if metricType == 'gauge':
+            lines.append("{} {}".format(name, _number(gauges[name])))
+        elif metricType == 'counter':
+            for (counterName, labels), value in sorted(counters.items()):
+                if counterName == name:
+                    lines.append("{}{} {}".format(name, _labelText(labels), _number(value)))
+        else:
+            buckets = bucketsByName[name]
+            for (histogramName, labels), histogram in sorted(histograms.items()):
+                if histogramName != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], histogram[:-1]):
+                    cumulative += count
+                    lines.append("{}_bucket{} {}".format(name, _labelText(labels, (('le', bound),)), cumulative))
+                lines.append("{}_sum{} {}".format(name, _labelText(labels), _number(histogram[-1])))
+                lines.append("{}_count{} {}".format(name, _labelText(labels), cumulative))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,196 @@
+"""
+Optional middleware.  MetricsMiddleware is only switched on when the CLUELESS_METRICS_DIR setting names a directory,
+SlowQueryMiddleware when CLUELESS_SLOW_QUERY_LOG names a file, RequestTraceMiddleware when CLUELESS_TRACE_FILE names a
+file, and ProfilingMiddleware when CLUELESS_PROFILE_DIR names a directory.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+import cProfile
+import logging
+import os
+import random
+import time
+
+from clueless import metrics, slow_queries
+from clueless.models import Game, NOT_STARTED
+from clueless.traces import TRACED_PARAMS, appendRecord, endpointName, gameRecord, userAlias
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware(object):
+    """
+    Counts every request, its latency and its SQL statements by view, see clueless.metrics
+    """
+    def __init__(self, get_response):
+        self.directory = getattr(settings, 'CLUELESS_METRICS_DIR', None)
+        if not self.directory:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        metrics.enabled = True
+        metrics.installQueryTiming()
+
+    def __call__(self, request):
+        start = time.time()
+        metrics.startRequest()
+        try:
+            response = self.get_response(request)
+        finally:
+            queries, querySeconds = metrics.finishRequest()
+        seconds = time.time() - start
+
+        try:
+            match = request.resolver_match
+            params = dict((name, request.POST[name]) for name in ('player_move',) if name in request.POST)
+            view = endpointName(match.url_name, request.method, params) if match is not None else "unresolved"
+            metrics.observeRequest(view or "unnamed", response.status_code, seconds, queries, querySeconds)
+            metrics.maybeFlush(self.directory)
+        except Exception:
+            #metrics must never break a request
+            logger.exception("Could not count request to {}".format(request.path))
+        return response
+
+
+class SlowQueryMiddleware(object):
+    """
+    Logs the slow statements of every request, and the statements it repeats, see clueless.slow_queries
+    """
+    def __init__(self, get_response):
+        logPath = getattr(settings, 'CLUELESS_SLOW_QUERY_LOG', None)
+        if not logPath:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        slow_queries.enable(logPath, getattr(settings, 'CLUELESS_SLOW_QUERY_MS', slow_queries.DEFAULT_THRESHOLD_MS))
+
+    def __call__(self, request):
+        slow_queries.startRequest()
+        try:
+            return self.get_response(request)
+        finally:
+            try:
+                slow_queries.finishRequest()
+            except Exception:
+                logger.exception("Could not log the statements of {}".format(request.path))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        params = dict((name, request.POST[name]) for name in ('player_move',) if name in request.POST)
+        slow_queries.setView(endpointName(request.resolver_match.url_name, request.method, params))
+
+class RequestTraceMiddleware(object):
+    """
+    Appends an anonymised record of every request to the trace file, see clueless.traces, and a record of each
+    started game the first time this process sees a request for it
+    """
+    def __init__(self, get_response):
+        self.path = getattr(settings, 'CLUELESS_TRACE_FILE', None)
+        if not self.path:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.tracedGameIds = set()
+
+    def __call__(self, request):
+        t = time.time()
+        response = self.get_response(request)
+        ms = (time.time() - t) * 1000
+
+        try:
+            match = request.resolver_match
+            params = dict((name, request.POST[name]) for name in TRACED_PARAMS if name in request.POST)
+            kwargs = dict(match.kwargs) if match is not None else {}
+            self.__traceGame(kwargs.get('game_id', params.get('game_id')))
+            userId = request.user.id if hasattr(request, 'user') and request.user.is_authenticated else None
+            appendRecord(self.path, {
+                'type': 'request', 't': round(t, 4), 'urlName': match.url_name if match is not None else None,
+                'method': request.method, 'kwargs': kwargs, 'params': params, 'user': userAlias(userId),
+                'status': response.status_code, 'ms': round(ms, 2),
+            })
+        except Exception:
+            #tracing must never break a request
+            logger.exception("Could not trace request to {}".format(request.path))
+        return response
+
+    def __traceGame(self, gameId):
+        if gameId is None or not str(gameId).isdigit() or int(gameId) in self.tracedGameIds:
+            return
+        game = Game.objects.filter(id = int(gameId)).first()
+        if game is None or game.status == NOT_STARTED:
+            return
+        self.tracedGameIds.add(game.id)
+        appendRecord(self.path, gameRecord(game))
+
+
+PROFILE_HEADER = 'HTTP_X_CLUELESS_PROFILE'
+PROFILE_SALT = 'clueless.profile'
+PROFILE_HEADER_MAX_AGE = 3600 #seconds a signed profile header stays valid
+
+
+def profileHeaderValue():
+    """
+    :return: signed value for the X-Clueless-Profile header, which has the request profiled
+    """
+    return signing.dumps("profile", salt = PROFILE_SALT)
+
+
+def isProfileHeaderValid(value):
+    try:
+        return signing.loads(value, salt = PROFILE_SALT, max_age = PROFILE_HEADER_MAX_AGE) == "profile"
+    except signing.BadSignature:
+        return False
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a sampled fraction of requests, and every request carrying a valid signed X-Clueless-Profile header,
+    with cProfile.  Each profile is dumped as a .pstats file named after the view and game, and only the newest
+    CLUELESS_PROFILE_MAX_DUMPS files are kept
+    """
+    def __init__(self, get_response):
+        self.directory = getattr(settings, 'CLUELESS_PROFILE_DIR', None)
+        if not self.directory:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sampleRate = getattr(settings, 'CLUELESS_PROFILE_SAMPLE_RATE', 0.0)
+        self.maxDumps = getattr(settings, 'CLUELESS_PROFILE_MAX_DUMPS', 200)
+        os.makedirs(self.directory, exist_ok = True)
+
+    def __call__(self, request):
+        header = request.META.get(PROFILE_HEADER)
+        if random.random() >= self.sampleRate and not (header and isProfileHeaderValid(header)):
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+
+        try:
+            self.__dump(request, profile)
+        except Exception:
+            #profiling must never break a request
+            logger.exception("Could not dump the profile of {}".format(request.path))
+        return response
+
+    def __dump(self, request, profile):
+        match = request.resolver_match
+        params = dict((name, request.POST[name]) for name in ('game_id', 'player_move') if name in request.POST)
+        view = endpointName(match.url_name, request.method, params) if match is not None else "unresolved"
+        gameId = str(match.kwargs.get('game_id', params.get('game_id', ""))) if match is not None else ""
+        #the POST values come from the client, only short names profile_report can split go in the file name
+        if view and (len(view) > 64 or not view.replace(".", "").replace("_", "").isalnum()):
+            view = match.url_name
+        gameName = "game{}".format(gameId) if gameId.isdigit() and len(gameId) <= 10 else "nogame"
+        #named from the time first, so the oldest dumps sort first
+        name = "{:017.6f}-{}-{}-{}.pstats".format(time.time(), view or "unnamed", gameName, os.getpid())
+        profile.dump_stats(os.path.join(self.directory, name))
+
+        dumps = sorted(f for f in os.listdir(self.directory) if f.endswith(".pstats"))
+        for oldest in dumps[0:max(len(dumps) - self.maxDumps, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, oldest))
+            except OSError:
+                #another worker got there first
+                pass
@@ -1,13 +1,28 @@
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 import logging
 import random
+import threading
+import time
+
+#card types, turn phases and the turn phase transition table are shared with the headless rules engine
+from clueless.engine import CHARACTER_CARD, ROOM_CARD, WEAPON_CARD, CARD_TYPE_CHOICES, TURN_START, TURN_MOVED, \
+    TURN_SUGGESTED, TURN_MOVED_SUGGESTED, TURN_ACCUSED, TURN_MOVED_ACCUSED, TURN_SUGGESTED_ACCUSED, \
+    TURN_MOVED_SUGGESTED_ACCUSED, TURN_PHASE_CHOICES, TURN_PHASE_TRANSITIONS, availableTurnActions
+from clueless.bots import BOT_STRATEGIES, BOT_STRATEGY_CHOICES, botName
+from clueless.instrumentation import instrumented
 
 logger = logging.getLogger(__name__)
 
+FETCH_FLUSH_INTERVAL = 5.0 #seconds a fetch of the game state waits in the process before it is written
+FETCH_FLUSH_SIZE = 500 #fetches waiting that are written at once
+
+_pendingFetches = list() #(game id, player id, cached sequence, fetched sequence, time of the fetch)
+_pendingFetchesLock = threading.Lock()
+
 """
 Implementation of status enum as a Django IntergerField of choices
 """
@@ -29,6 +44,13 @@ GAME_RESULT_CHOICES = (
     (WON, "Won")
 )
 
+def newGameSeed():
+    """
+    :return: A fresh random seed for a game, small enough to fit a signed 64 bit column
+    """
+    return random.SystemRandom().getrandbits(62)
+
+
 class Board(models.Model):
     """
     Board object for the entire game.  Should be referenced by multiple games and space collections
@@ -84,6 +106,7 @@ class Player(models.Model):
     currentGame = models.ForeignKey('Game', blank=True, null=True) # game not defined yet, using string as lazy lookup
     character = models.ForeignKey('Character', blank=True)
     gameResult = models.IntegerField(choices=GAME_RESULT_CHOICES, default=0)
+    botStrategy = models.CharField(max_length=30, blank=True, default="") #set for a seat played by a bot, no user
 
     def __str__(self):
         if self.user is None:
@@ -98,6 +121,16 @@ class Player(models.Model):
     def compare(self, otherPlayer):
         return self.user == otherPlayer.user
 
+    def displayName(self):
+        """
+        :return: the player's username, or a name for a bot or nonUser player, which have no user
+        """
+        if self.user is not None:
+            return self.user.username
+        elif self.botStrategy:
+            return botName(self.character.name)
+        return self.character.name
+
     def getDetectiveSheet(self):
         """
 
@@ -105,87 +138,40 @@ class Player(models.Model):
         """
         return DetectiveSheet.objects.get(game = self.currentGame, player = self)
 
-    def getNextPlayer(self, removeLosingPlayers = True):
-        players = Player.objects.filter(currentGame=self.currentGame).exclude(nonUserPlayer=True).order_by("id")
-
-        next_player = None
-        if removeLosingPlayers and players.exclude(gameResult=-1).count() == 1:
-            next_player = players.exclude(gameResult=-1)[0]
-        elif players.count() == 1:
-            next_player = players[0]
-            if removeLosingPlayers and next_player.gameResult < 0:
-                return None
-        else:
-            next_player = None
-            for i, player in enumerate(players):
-                if player.compare(self):
-                    next_player = players[(i + 1) % len(players)]
-                    break
-        if not removeLosingPlayers or next_player.gameResult >= 0:
-            return next_player
-        else:
-            return next_player.getNextPlayer(removeLosingPlayers)
+    @instrumented
+    def getNextPlayer(self, removeLosingPlayers = True, game = None):
+        """
+        :param removeLosingPlayers: skip players that lost by making a wrong accusation
+        :param game: the player's current game, if the caller already has it loaded
+        :return: The player seated after this one in the game's turn order, or None if there is nobody left
+        """
+        if game is None:
+            game = self.currentGame
+        nextPlayerId = game.nextPlayerId(self.id, removeLosingPlayers)
+        if nextPlayerId is None:
+            return None
+        return Player.objects.get(id = nextPlayerId)
 
     def isInRoom(self):
-        return Room.objects.filter(id = self.currentSpace.spaceCollector.id).count() > 0
+        from clueless.catalog import getCatalog
+        return getCatalog().isRoomSpace(self.currentSpace_id)
 
+    @instrumented
     def validMoves(self):
-        #currentSpace = self.currentSpace
-        validMoves = []
-
-        roomObjects = Room.objects.all()
-        hallwayObjects = Hallway.objects.all()
-
-        for room in roomObjects:
-            if Move.validateSpace(self.currentGame, self.currentSpace, room.space):
-                validMoves.append(room)
-
-        for hallway in hallwayObjects:
-            if Move.validateSpace(self.currentGame, self.currentSpace, hallway.space):
-                validMoves.append(hallway)
-
-        """
-        for room in roomObjects:
-            roomSpace = Space.objects.get(spaceCollector__id = room.id)
-            if self.currentSpace == roomSpace:
-                if hasattr(self.currentSpace, 'spaceNorth'):
-                    if(self.currentSpace.spaceNorth is not None):
-                        hw = Hallway.objects.filter(space=self.currentSpace.spaceNorth)
-                        if(hw.count() > 0):
-                            validMoves.append(hw[0])
-                if hasattr(self.currentSpace, 'spaceEast'):
-                    if(self.currentSpace.spaceEast is not None):
-                        hw = Hallway.objects.filter(space=self.currentSpace.spaceEast)
-                        if (hw.count() > 0):
-                            validMoves.append(hw[0])
-                if hasattr(self.currentSpace, 'spaceSouth'):
-                    if(self.currentSpace.spaceSouth is not None):
-                        hw = Hallway.objects.filter(space=self.currentSpace.spaceSouth)
-                        if (hw.count() > 0):
-                            validMoves.append(hw[0])
-                if hasattr(self.currentSpace, 'spaceWest'):
-                    if(self.currentSpace.spaceWest is not None):
-                        hw = Hallway.objects.filter(space=self.currentSpace.spaceWest)
-                        if (hw.count() > 0):
-                            validMoves.append(hw[0])
-
-        for hall in hallwayObjects:
-            hallSpace = Space.objects.get(spaceCollector__id = hall.id)
-            if self.currentSpace == hallSpace:
-                if hasattr(self.currentSpace, 'spaceNorth'):
-                    if self.currentSpace.spaceNorth is not None:
-                        validMoves.append(Room.objects.get(space=self.currentSpace.spaceNorth))
-                if hasattr(self.currentSpace, 'spaceEast'):
-                    if self.currentSpace.spaceEast is not None:
-                        validMoves.append(Room.objects.get(space=self.currentSpace.spaceEast))
-                if hasattr(self.currentSpace, 'spaceSouth'):
-                    if self.currentSpace.spaceSouth is not None:
-                        validMoves.append(Room.objects.get(space=self.currentSpace.spaceSouth))
-                if hasattr(self.currentSpace, 'spaceWest'):
-                    if self.currentSpace.spaceWest is not None:
-                        validMoves.append(Room.objects.get(space=self.currentSpace.spaceWest))
-        """
-        return validMoves
+        """
+        :return: list of the Room and Hallway objects the player can move to, rooms first
+        """
+        from clueless.catalog import getCatalog
+        from clueless.engine_adapter import getBoard
+        occupiedSpaceIds = set(Player.objects.filter(
+            currentGame = self.currentGame, nonUserPlayer = False).values_list('currentSpace_id', flat = True))
+        spaceIds = getBoard().reachableSpaces(self.currentSpace_id, occupiedSpaceIds)
+
+        catalog = getCatalog()
+        rooms = sorted((catalog.roomForSpace(s).model for s in spaceIds if catalog.isRoomSpace(s)), key = lambda r: r.pk)
+        hallwaySpaceIds = [s for s in spaceIds if not catalog.isRoomSpace(s)]
+        hallways = list(Hallway.objects.filter(space__id__in = hallwaySpaceIds).order_by('id')) if hallwaySpaceIds else []
+        return rooms + hallways
 
 
 class Hallway(SpaceCollection):
@@ -209,6 +195,22 @@ class Card(models.Model):
     """
     card_id = models.AutoField(primary_key=True) #had to override, due to multiple inheritence conflicts later
     name = models.CharField(max_length=30)
+    card_type = models.IntegerField(choices=CARD_TYPE_CHOICES, db_index=True, blank=True, null=True)
+    ordinal = models.IntegerField(unique=True, blank=True, null=True) #stable 0 based position of the card in the deck
+
+    #overridden by the Room, Character and Weapon subclasses
+    cardType = None
+
+    def save(self, *args, **kwargs):
+        """
+        Fills in the card type and the next free ordinal before the card is first saved
+        """
+        if self.card_type is None:
+            self.card_type = self.cardType
+        if self.ordinal is None:
+            maxOrdinal = Card.objects.aggregate(models.Max('ordinal'))['ordinal__max']
+            self.ordinal = 0 if maxOrdinal is None else maxOrdinal + 1
+        super(Card, self).save(*args, **kwargs)
 
     def compare(self, otherCard):
         """
@@ -226,13 +228,14 @@ class Room(SpaceCollection, Card):
     """
     Represents each room.
 	"""
-    pass
+    cardType = ROOM_CARD
 
 
 class Character(Card):
     """
     Represents each character in the game clue (the actual character, like Mr. Green)
 	"""
+    cardType = CHARACTER_CARD
     defaultSpace = models.ForeignKey(Space)
     characterColor = models.CharField(max_length=30)
 
@@ -241,7 +244,7 @@ class Weapon(Card):
     """
     Represents each weapon
 	"""
-    pass
+    cardType = WEAPON_CARD
 
 
 class WhoWhatWhere(models.Model):
@@ -259,14 +262,17 @@ class WhoWhatWhere(models.Model):
         :param otherWhoWhatWhere: object of class WhoWhatWhere
         :return: true if room, character and weapon are all equal
         """
-        roomEqual = self.room.compare(otherWhoWhatWhere.room)
-        charEqual = self.character.compare(otherWhoWhatWhere.character)
-        weaponEqual = self.weapon.compare(otherWhoWhatWhere.weapon)
+        #compare the foreign keys directly, so no card has to be loaded
+        roomEqual = self.room_id == otherWhoWhatWhere.room_id
+        charEqual = self.character_id == otherWhoWhatWhere.character_id
+        weaponEqual = self.weapon_id == otherWhoWhatWhere.weapon_id
         return(roomEqual and charEqual and weaponEqual)
 
     def __str__(self):
+        from clueless.catalog import getCatalog
+        catalog = getCatalog()
         return("character: {}, room: {}, weapon: {}".format(
-            self.character.__str__(), self.room.__str__(), self.weapon.__str__()
+            catalog.entry(self.character_id).name, catalog.roomByPk(self.room_id).name, catalog.entry(self.weapon_id).name
         ))
 
 
@@ -276,49 +282,32 @@ class Turn(models.Model):
     """
     player = models.ForeignKey(Player)
     game = models.ForeignKey('Game') #Game class not defined yet, referencing by string
+    phase = models.IntegerField(choices = TURN_PHASE_CHOICES, default = TURN_START)
 
-    def __validate_action(self, action):
-        if action.__class__ == Accusation:
-            if Accusation.objects.filter(turn = self).count() > 1:
-                logger.error("accusation already made")
-                return False
-            return True
-        elif action.__class__ == Suggestion:
-            if Suggestion.objects.filter(turn = self).count() > 1:
-                logger.error("suggestion already made")
-                return False
-            elif Accusation.objects.filter(turn = self).count() > 0:
-                logger.error("accusation already made")
-                return False
-            return True
-        elif action.__class__ == Move:
-            if Action.objects.filter(turn = self).count() > 1:
-                logger.error("move must be first action")
+    def recordAction(self, actionName):
+        """
+        Moves the turn to its next phase when an action is recorded against it
+        :param actionName: "Move", "Suggestion" or "Accusation"
+        :return: True if the action is allowed in the current phase, False otherwise
+        """
+        while True:
+            nextPhase = TURN_PHASE_TRANSITIONS.get((self.phase, actionName))
+            #only update if nobody changed the phase since it was read
+            if nextPhase is not None and Turn.objects.filter(id = self.id, phase = self.phase).update(phase = nextPhase) == 1:
+                self.phase = nextPhase
+                return True
+            #the phase read earlier may be out of date, check it before deciding
+            storedPhase = Turn.objects.filter(id = self.id).values_list('phase', flat = True).get()
+            if storedPhase == self.phase:
+                logger.error("{} not allowed in turn phase {}".format(actionName, self.get_phase_display()))
                 return False
-            return True
-        return False
+            self.phase = storedPhase
 
     def getAvailableActions(self):
         """
         :return: Set of Action subclass class objects that can be taken at this point
         """
-        validActions = list()
-        moveCount = Move.objects.filter(turn = self).count()
-        suggestionCount = Suggestion.objects.filter(turn=self).count()
-        accusationCount = Accusation.objects.filter(turn=self).count()
-        if moveCount == 0 and suggestionCount == 0 and accusationCount == 0:
-            validActions.append("Move")
-
-        if suggestionCount == 0 and accusationCount == 0 and self.player.isInRoom():
-            validActions.append("Suggestion")
-
-        if accusationCount == 0:
-            validActions.append("Accusation")
-
-        if moveCount > 0 or not self.player.currentSpace.isHallway():
-            validActions.append("EndTurn")
-
-        return(validActions)
+        return availableTurnActions(self.phase, self.player.isInRoom())
 
     def takeAction(self, action):
         """
@@ -326,32 +315,39 @@ class Turn(models.Model):
         :param action: Subclass of Action, which will have its performAction function called
         :return:
         """
-        if not self.__validate_action(action):
-            return ("Unable to perform action")
-        if action.validate():
-            action.performAction()
-            return(None)
-        else:
-            return("Unable to perform action")
+        #the action's writes and its event in the log are one transaction
+        with transaction.atomic(savepoint = False):
+            if not self.recordAction(action.actionName):
+                return ("Unable to perform action")
+            if action.validate():
+                action.performAction()
+                return(None)
+            else:
+                return("Unable to perform action")
 
     def endTurn(self):
         """
         Ends this turn
         """
-        next_player = self.game.currentTurn.player.getNextPlayer()
-        """players = Player.objects.filter(currentGame = self.game).exclude(nonUserPlayer = True).exclude(gameResult = -1)
-        next_player = None
-        for i, player in enumerate(players):
-            if player.character.compare(currentPlayer.character):
-                next_player = players[(i+1) % len(players)]
-                break"""
+        with transaction.atomic(savepoint = False):
+            #a wrong accusation ends the turn by itself, which the event log already has
+            if not self.phase & TURN_ACCUSED:
+                from clueless.event_log import logEndTurn
+                logEndTurn(self)
+            next_player_id = self.game.nextPlayerId(self.game.currentTurn.player_id)
+            """players = Player.objects.filter(currentGame = self.game).exclude(nonUserPlayer = True).exclude(gameResult = -1)
+            next_player = None
+            for i, player in enumerate(players):
+                if player.character.compare(currentPlayer.character):
+                    next_player = players[(i+1) % len(players)]
+                    break"""
 
-        #creates a turn for next player
-        turn = Turn(player=next_player, game=self.game)
-        turn.save()
-        self.game.refresh_from_db()
-        self.game.currentTurn = turn
-        self.game.save()
+            #creates a turn for next player
+            turn = Turn(player_id=next_player_id, game=self.game)
+            turn.save()
+            self.game.refresh_from_db()
+            self.game.currentTurn = turn
+            self.game.save()
 
 
 class Action(models.Model):
@@ -361,6 +357,9 @@ class Action(models.Model):
     turn = models.ForeignKey(Turn, blank=True)
     description = models.CharField(max_length=255, blank=True)
 
+    #name used in the turn phase transition table, overridden by the subclasses
+    actionName = None
+
     def validate(self):
         """
         :return: boolean Can the action be validly taken
@@ -384,6 +383,7 @@ class Suggestion(Action):
     """
     A suggestion action taken by the player
     """
+    actionName = "Suggestion"
     whoWhatWhere = models.ForeignKey(WhoWhatWhere)
 
     @classmethod
@@ -402,6 +402,7 @@ class Suggestion(Action):
             return False
         return True
 
+    @instrumented
     def performAction(self):
         #move player being suggested
         accusedCharacter = self.whoWhatWhere.character
@@ -410,16 +411,13 @@ class Suggestion(Action):
         #move player
         accusedPlayer.currentSpace = accusedSpace
         accusedPlayer.save()
-        cr = CardReveal.createCardReveal(self)
-        while cr.potentialCards().count() == 0:
-            cr.endReveal()
-            if not cr.hasNext():
-                break
-            cr = cr.createNext()
+        from clueless.event_log import logSuggestion
+        logSuggestion(self)
+        CardReveal.startNextReveal(self, self.turn.player_id)
 
     def actionDescription(self):
         return ("<b>{}</b> suggested it was <b>{}</b> in the <b>{}</b> with the <b>{}</b>".format(
-            self.turn.player.user.username, self.whoWhatWhere.character.name, self.whoWhatWhere.room.name,
+            self.turn.player.displayName(), self.whoWhatWhere.character.name, self.whoWhatWhere.room.name,
             self.whoWhatWhere.weapon.name
         ))
 
@@ -428,6 +426,7 @@ class Accusation(Action):
     """
     An accusation action taken by the player.  Either the player wins the game or they lose!
     """
+    actionName = "Accusation"
     whoWhatWhere = models.ForeignKey(WhoWhatWhere)
 
     @classmethod
@@ -444,12 +443,15 @@ class Accusation(Action):
         return True
 
     def performAction(self):
+        from clueless.event_log import logAccusation
+        logAccusation(self)
         if self.turn.game.isAccusationCorrect(self):
             self.turn.game.endGame(self.turn.player)
         else:
             self.turn.game.loseGame(self.turn.player)
-            if Player.objects.filter(currentGame = self.turn.game, gameResult = 0, nonUserPlayer = False).count() == 1:
-                winningPlayer = Player.objects.get(currentGame = self.turn.game, gameResult = 0, nonUserPlayer = False)
+            activePlayerIds = self.turn.game.activePlayerIds()
+            if len(activePlayerIds) == 1:
+                winningPlayer = Player.objects.get(id = activePlayerIds[0])
                 self.turn.game.endGame(winningPlayer)
             else:
                 self.turn.endTurn()
@@ -460,34 +462,21 @@ class Move(Action):
     """
     Any move a player makes
     """
+    actionName = "Move"
     fromSpace = models.ForeignKey(Space, related_name='fromSpace')
     toSpace = models.ForeignKey(Space, related_name='toSpace')
 
     @classmethod
     def validateSpace(cls, game, fromSpace, toSpace):
-        if toSpace.isHallway() and not cls.checkHallwayEmpty(game, toSpace):
+        from clueless.engine_adapter import getBoard
+        board = getBoard()
+        if not board.isRoom(toSpace.id) and not cls.checkHallwayEmpty(game, toSpace):
             return False
-        if hasattr(fromSpace, 'spaceNorth'):
-            if toSpace == fromSpace.spaceNorth:
-                return True
-        if hasattr(fromSpace, 'spaceEast'):
-            if toSpace == fromSpace.spaceEast:
-                return True
-        if hasattr(fromSpace, 'spaceSouth'):
-            if toSpace == fromSpace.spaceSouth:
-                return True
-        if hasattr(fromSpace, 'spaceWest'):
-            if toSpace == fromSpace.spaceWest:
-                return True
-        return False
+        return board.areNeighbours(fromSpace.id, toSpace.id)
 
     @classmethod
     def checkHallwayEmpty(self, game, hallwaySpace):
-        players = Player.objects.filter(currentGame =game, nonUserPlayer = False)
-        for player in players:
-            if hallwaySpace == player.currentSpace:
-                return False
-        return True
+        return not Player.objects.filter(currentGame = game, nonUserPlayer = False, currentSpace = hallwaySpace).exists()
 
     def validate(self):
         return self.validateSpace(self.turn.game, self.fromSpace, self.toSpace)
@@ -512,6 +501,8 @@ class Move(Action):
     def performAction(self):
         self.turn.player.currentSpace = self.toSpace
         self.turn.player.save()
+        from clueless.event_log import logMove
+        logMove(self)
 
 
 class CaseFile(WhoWhatWhere):
@@ -519,21 +510,18 @@ class CaseFile(WhoWhatWhere):
     Class to be used for the secret CaseFile for a Game
     """
     @classmethod
-    def createRandom(cls):
+    def createRandom(cls, rng = random):
         """
         Static class method, to be used instead of constructor in most cases
+        :param rng: random.Random the selections are drawn from, defaults to the global random module
         :return: CaseFile with random selections for room, character and weapon
         """
+        from clueless.catalog import getCatalog
+        catalog = getCatalog()
         randCaseFile = CaseFile()
-        allChar = Character.objects.all()
-        charCnt = allChar.count()
-        allRoom = Room.objects.all()
-        roomCnt = allRoom.count()
-        allWeapon = Weapon.objects.all()
-        weaponCnt = allWeapon.count()
-        randCaseFile.character = allChar[random.randint(0, charCnt-1)]
-        randCaseFile.room = allRoom[random.randint(0, roomCnt-1)]
-        randCaseFile.weapon = allWeapon[random.randint(0, weaponCnt-1)]
+        randCaseFile.character = rng.choice(catalog.characters)
+        randCaseFile.room = rng.choice(catalog.rooms)
+        randCaseFile.weapon = rng.choice(catalog.weapons)
         return(randCaseFile)
 
 
@@ -545,11 +533,24 @@ class Game(models.Model):
     board = models.ForeignKey(Board)
     status = models.IntegerField(choices = STATUS_CHOICES, default = 0)
     startTime = models.DateTimeField(default = timezone.now(), blank = True)
-    lastUpdateTime = models.DateTimeField(default=timezone.now(), blank=True)
+    lastUpdateTime = models.DateTimeField(default=timezone.now, blank=True)
     hostPlayer = models.ForeignKey(Player)
     name = models.CharField(max_length=60)
     currentSequence = models.IntegerField(default = 0)
     currentTurn = models.ForeignKey(Turn, related_name='currentTurn', blank=True, null=True)
+    seed = models.BigIntegerField(default = newGameSeed) #drives every random choice made for this game
+    turnOrder = models.CharField(max_length=255, blank=True, default="") #comma separated player ids, in seat order
+    eliminatedMask = models.IntegerField(default = 0) #bit i is set once the player in seat i has lost
+    botStrategy = models.CharField(max_length=30, blank=True, default="", choices = BOT_STRATEGY_CHOICES) #bots that take the empty seats
+
+    def rng(self, stream):
+        """
+        Every random decision in a game comes from its own stream, so the case file, the deal and any bot decisions
+        are reproducible from the seed and do not disturb each other
+        :param stream: name of the stream, e.g. "casefile" or "deal"
+        :return: random.Random isolated from the global random module
+        """
+        return random.Random("{}:{}".format(self.seed, stream))
 
     def initializeGame(self, playerHost):
         """
@@ -557,83 +558,173 @@ class Game(models.Model):
         :param playerHost: A player object representing the player that started the game
         :return:
         """
-        self.hostPlayer = playerHost
-        self.board = Board.objects.all()[0]
-        self.status = NOT_STARTED
-        randCaseFile = CaseFile.createRandom()
-        randCaseFile.save()
-        self.caseFile = randCaseFile
-        self.save()
-        self.registerGameUpdate()
+        with transaction.atomic():
+            self.hostPlayer = playerHost
+            self.board = Board.objects.all()[0]
+            self.status = NOT_STARTED
+            randCaseFile = CaseFile.createRandom(self.rng("casefile"))
+            randCaseFile.save()
+            self.caseFile = randCaseFile
+            self.save()
+            self.registerGameUpdate()
+            OpenGameSummary.createFor(self)
+        self.lobbyChanged()
+
+    def lobbyChanged(self):
+        """
+        Drops the cached lobby pages after a game is created, joined, started or finished
+        """
+        from clueless.lobby import invalidateLobby
+        invalidateLobby()
 
     def unusedCharacters(self):
         """
         Gets a query set of character objects that have not been taken by a player yet
         :return:
         """
-        usedCharacterIds = list()
-        listOPlayers = Player.objects.filter(currentGame__id = self.id)
-        for p in listOPlayers:
-            usedCharacterIds.append(p.character.card_id)
-        return Character.objects.exclude(card_id__in = usedCharacterIds)
-
+        from clueless.catalog import getCatalog
+        try:
+            freeCharacters = OpenGameSummary.objects.values_list('freeCharacters', flat = True).get(game_id = self.id)
+        except OpenGameSummary.DoesNotExist:
+            #finished games and games created before the summary table existed
+            usedCharacterIds = Player.objects.filter(currentGame__id = self.id).values_list('character_id', flat = True)
+            return Character.objects.exclude(card_id__in = list(usedCharacterIds))
+        return Character.objects.filter(card_id__in = [
+            c.card_id for c in getCatalog().characters if freeCharacters & characterBit(c)])
+
+    @instrumented
     def startGame(self, user):
         """
         Starts a game
         :param user: user that will be the host
         """
 
-        if self.status != 0:
-            raise RuntimeError('Game already started')
-        elif Player.objects.filter(currentGame__id=self.id).count() < 2:
-            raise RuntimeError('Game must have at least 2 players')
-        elif self.hostPlayer.user != user:
-            raise RuntimeError('Game can only be started by host')
-        else:
-            self.status = STARTED
+        from clueless.catalog import getCatalog
 
-        turn = Turn(game = self, player = self.hostPlayer)
-        turn.save()
-        self.currentTurn = turn
-        self.save()
-
-        #get all of the games detective sheets
-        detectiveSheetsQS = DetectiveSheet.objects.filter(game = self)
-        #flatten/ not sure why I have to do this, but otherwise the indexing later doesn't work
-        detectiveSheets = list()
-        for ds in detectiveSheetsQS:
-            detectiveSheets.append(ds)
-
-        #get all cards that ARE NOT in the casefile
-        cards = Card.objects.exclude(
-            card_id = self.caseFile.character.card_id).exclude(
-            card_id = self.caseFile.room.card_id).exclude(
-            card_id = self.caseFile.weapon.card_id)
-
-        #add these cards to a list, then shuffle
-        cardList = list()
-        for c in cards:
-            cardList.append(c)
-
-        random.shuffle(cardList)
-
-        #deal the cards into each detective sheet
-        for i in range(0, len(cardList)):
-            dsIndex = i % len(detectiveSheets)
-            detectiveSheets[dsIndex].makeNote(cardList[i], True, True)
-
-        #create all the nonUser players for remaining characters
-        #must happen after detectiveSheet logic because these players don't get detectiveSheets
-        for c in self.unusedCharacters():
-            nonUserPlayer = Player(character=c, currentSpace=c.defaultSpace, currentGame = self, nonUserPlayer = True)
-            nonUserPlayer.save()
-
-        #adds current turn to game
-        player = Player.objects.get(user=user, currentGame=self)
-        self.currentTurn = Turn.objects.get(player=player, game=self)
-
-        self.save()
-        self.registerGameUpdate("The game has started")
+        with transaction.atomic():
+            if self.status != 0:
+                raise RuntimeError('Game already started')
+            elif Player.objects.filter(currentGame__id=self.id).count() < 2 and not self.botStrategy:
+                raise RuntimeError('Game must have at least 2 players')
+            elif self.hostPlayer.user != user:
+                raise RuntimeError('Game can only be started by host')
+            elif self.botStrategy and self.botStrategy not in BOT_STRATEGIES:
+                raise RuntimeError('Unknown bot strategy {}'.format(self.botStrategy))
+            else:
+                self.status = STARTED
+
+            #bots take every empty seat, and are dealt cards like user players
+            if self.botStrategy:
+                self.addBotPlayers()
+
+            turn = Turn(game = self, player = self.hostPlayer)
+            turn.save()
+            self.currentTurn = turn
+            self.freezeTurnOrder()
+            self.save()
+
+            #get all of the games detective sheets
+            detectiveSheetsQS = DetectiveSheet.objects.filter(game = self).order_by("id")
+            #flatten/ not sure why I have to do this, but otherwise the indexing later doesn't work
+            detectiveSheets = list()
+            for ds in detectiveSheetsQS:
+                detectiveSheets.append(ds)
+
+            #get all cards that ARE NOT in the casefile, then shuffle
+            catalog = getCatalog()
+            caseFileCardIds = (self.caseFile.character_id, catalog.roomByPk(self.caseFile.room_id).card_id,
+                               self.caseFile.weapon_id)
+            cardIdList = catalog.cardIds(excludeIds = caseFileCardIds)
+
+            self.rng("deal").shuffle(cardIdList)
+
+            #deal the cards into each detective sheet, one update per sheet
+            for dsIndex, ds in enumerate(detectiveSheets):
+                ds.dealCards(cardIdList[dsIndex::len(detectiveSheets)])
+
+            #create all the nonUser players for remaining characters
+            #must happen after detectiveSheet logic because these players don't get detectiveSheets
+            usedCharacterIds = set(Player.objects.filter(currentGame = self).values_list('character_id', flat = True))
+            Player.objects.bulk_create([
+                Player(character=c, currentSpace_id=c.defaultSpace_id, currentGame = self, nonUserPlayer = True)
+                for c in catalog.characters if c.card_id not in usedCharacterIds
+            ])
+
+            #adds current turn to game
+            player = Player.objects.get(user=user, currentGame=self)
+            self.currentTurn = Turn.objects.get(player=player, game=self)
+
+            self.save()
+            self.registerGameUpdate("The game has started")
+            from clueless.event_log import startLog
+            startLog(self)
+            #every remaining seat was just filled by a nonUser player
+            OpenGameSummary.objects.filter(game_id = self.id).update(
+                status = STARTED, freeCharacters = 0, lastUpdateTime = self.lastUpdateTime)
+        self.lobbyChanged()
+
+    def addBotPlayers(self):
+        """
+        Seats a bot, with a detective sheet, for every character nobody has picked
+        """
+        from clueless.catalog import getCatalog
+        usedCharacterIds = set(Player.objects.filter(currentGame = self).values_list('character_id', flat = True))
+        for c in getCatalog().characters:
+            if c.card_id not in usedCharacterIds:
+                bot = Player(character_id = c.card_id, currentSpace_id = c.defaultSpace_id, currentGame = self,
+                             botStrategy = self.botStrategy)
+                bot.save()
+                ds = DetectiveSheet(game = self, player = bot)
+                ds.save()
+                ds.addDefaultSheets()
+
+    def freezeTurnOrder(self):
+        """
+        Records the seat order of the user and bot players, and which of them have already lost, so turn order
+        questions can be answered without querying the players again
+        """
+        seats = list(Player.objects.filter(currentGame = self, nonUserPlayer = False).order_by("id").values_list(
+            "id", "gameResult"))
+        self.turnOrder = ",".join(str(playerId) for playerId, gameResult in seats)
+        self.eliminatedMask = 0
+        for i, (playerId, gameResult) in enumerate(seats):
+            if gameResult == LOST:
+                self.eliminatedMask |= 1 << i
+
+    def seatOrder(self):
+        """
+        :return: list of user player ids in turn order
+        """
+        if not self.turnOrder and self.status != NOT_STARTED:
+            #game started before the turn order was stored on it
+            self.freezeTurnOrder()
+            Game.objects.filter(id = self.id).update(turnOrder = self.turnOrder, eliminatedMask = self.eliminatedMask)
+        return [int(playerId) for playerId in self.turnOrder.split(",") if playerId]
+
+    def isSeatEliminated(self, seat):
+        return (self.eliminatedMask >> seat) & 1 == 1
+
+    def nextPlayerId(self, playerId, removeLosingPlayers = True):
+        """
+        :param playerId: id of the player whose successor is wanted
+        :param removeLosingPlayers: skip seats of players that have lost
+        :return: id of the next player in turn order, or None if the player has no seat or nobody is left
+        """
+        seats = self.seatOrder()
+        if playerId not in seats:
+            return None
+        seat = seats.index(playerId)
+        for step in range(1, len(seats) + 1):
+            nextSeat = (seat + step) % len(seats)
+            if not removeLosingPlayers or not self.isSeatEliminated(nextSeat):
+                return seats[nextSeat]
+        return None
+
+    def activePlayerIds(self):
+        """
+        :return: ids of the user players that have not lost, in turn order
+        """
+        return [playerId for seat, playerId in enumerate(self.seatOrder()) if not self.isSeatEliminated(seat)]
 
     def isUserInGame(self, user):
         """
@@ -664,14 +755,21 @@ class Game(models.Model):
             raise RuntimeError("User is already a player in this game")
         elif self.isCharacterInGame(player.character):
             raise RuntimeError("Character is already in use")
-        player.currentGame = self
-        player.save()
-        #give player a detective sheet
-        ds = DetectiveSheet(game = self, player = player)
-        ds.save()
-        ds.addDefaultSheets()
-        self.registerGameUpdate()
-
+        with transaction.atomic():
+            player.currentGame = self
+            player.save()
+            #give player a detective sheet
+            ds = DetectiveSheet(game = self, player = player)
+            ds.save()
+            ds.addDefaultSheets()
+            self.registerGameUpdate()
+            OpenGameSummary.objects.filter(game_id = self.id).update(
+                playerCount = F('playerCount') + 1,
+                freeCharacters = F('freeCharacters').bitand(allCharactersMask() ^ characterBit(player.character)),
+                lastUpdateTime = self.lastUpdateTime)
+        self.lobbyChanged()
+
+    @instrumented
     def registerGameUpdate(self, description = None, specificPlayer = None):
         """
         Updates the last update time to now, and increments the current game sequence
@@ -686,6 +784,26 @@ class Game(models.Model):
         self.currentSequence = self.currentSequence + 1
         self.save()
 
+    def registerGameUpdates(self, descriptions, specificPlayerIds = None):
+        """
+        Adds several stream entries in one insert, as a single game update
+        :param descriptions: list of stream entry descriptions, in order
+        :param specificPlayerIds: optional list with, for each description, the id of the only player that sees it,
+        or None for a public entry
+        """
+        if specificPlayerIds is None:
+            specificPlayerIds = [None] * len(descriptions)
+        self.refresh_from_db()
+        GameStreamEntry.objects.bulk_create([
+            GameStreamEntry(description=description, game=self, addedAtGameSequence=self.currentSequence,
+                            playerSpecific_id=playerId)
+            for description, playerId in zip(descriptions, specificPlayerIds)
+        ])
+        self.lastUpdateTime = timezone.now()
+        self.currentSequence = self.currentSequence + 1
+        self.save()
+
+    @instrumented
     def gameStateJSON(self, player, cachedGameSequence = -1):
         """
 
@@ -722,7 +840,7 @@ class Game(models.Model):
             else:
                 pData = {
                     'player_id':p.id,
-                    'username':p.user.username,
+                    'username':p.displayName(),
                     'character':{'character_id':c.card_id, 'character_name':c.name, 'character_color':c.characterColor},
                     'currentSpace':{'space_id':s.id, 'posX':s.posX, 'posY':s.posY}
                 }
@@ -751,17 +869,20 @@ class Game(models.Model):
         Ends the game
         :param winningPlayer: Player who won
         """
-        winningPlayer.gameResult = WON
-        winningPlayer.save()
+        with transaction.atomic():
+            winningPlayer.gameResult = WON
+            winningPlayer.save()
 
-        for p in Player.objects.filter(currentGame = self).exclude(id = winningPlayer.id):
-            p.gameResult = LOST
-            p.save()
+            for p in Player.objects.filter(currentGame = self).exclude(id = winningPlayer.id):
+                p.gameResult = LOST
+                p.save()
 
-        self.status = 2
-        self.save()
+            self.status = 2
+            self.save()
 
-        self.registerGameUpdate("<b>{}</b> won!".format(winningPlayer.user.username))
+            self.registerGameUpdate("<b>{}</b> won!".format(winningPlayer.displayName()))
+            OpenGameSummary.objects.filter(game_id = self.id).delete()
+        self.lobbyChanged()
 
     def loseGame(self, losingPlayer):
         """
@@ -770,7 +891,11 @@ class Game(models.Model):
         """
         losingPlayer.gameResult = LOST
         losingPlayer.save()
-        self.registerGameUpdate("<b>{}</b> lost!".format(losingPlayer.user.username))
+        seats = self.seatOrder()
+        if losingPlayer.id in seats:
+            self.eliminatedMask |= 1 << seats.index(losingPlayer.id)
+            self.save()
+        self.registerGameUpdate("<b>{}</b> lost!".format(losingPlayer.displayName()))
 
     def __str__(self):
         return ("id: {}, name: {}".format(
@@ -778,6 +903,81 @@ class Game(models.Model):
         ))
 
 
+def characterBit(character):
+    """
+    :param character: Character, or its card id
+    :return: the bit standing for the character in a free characters mask, taken from its card ordinal
+    """
+    from clueless.catalog import getCatalog
+    return 1 << getCatalog().entry(getattr(character, 'card_id', character)).ordinal
+
+
+def allCharactersMask():
+    """
+    :return: free characters mask with every character free
+    """
+    from clueless.catalog import getCatalog
+    mask = 0
+    for c in getCatalog().characters:
+        mask |= characterBit(c)
+    return mask
+
+
+class OpenGameSummary(models.Model):
+    """
+    Narrow copy of the lobby facts of each unfinished game, written by the game methods that change them, so
+    listing and joining games never has to join the player table.  The row is removed when the game ends
+    """
+    game = models.OneToOneField(Game, primary_key = True)
+    name = models.CharField(max_length=60)
+    hostUsername = models.CharField(max_length=150)
+    status = models.IntegerField(choices = STATUS_CHOICES, default = 0)
+    playerCount = models.IntegerField(default = 0) #user players that have joined
+    freeCharacters = models.IntegerField(default = 0) #bit per character ordinal, set while nobody has picked it
+    lastUpdateTime = models.DateTimeField(default = timezone.now)
+
+    class Meta:
+        index_together = [('lastUpdateTime', 'game')]
+
+    @classmethod
+    def createFor(cls, game):
+        """
+        Writes the summary of a newly initialized game, replacing any earlier one
+        :param game: Game that has just been initialized
+        :return: OpenGameSummary
+        """
+        summary = cls(game = game, name = game.name, hostUsername = game.hostPlayer.user.username,
+                      status = game.status, playerCount = 0, freeCharacters = allCharactersMask(),
+                      lastUpdateTime = game.lastUpdateTime)
+        summary.save()
+        return summary
+
+    def openSeats(self):
+        return bin(self.freeCharacters).count("1")
+
+    def __str__(self):
+        return ("game: {}, name: {}".format(
+            self.game_id, self.name
+        ))
+
+
+class GameArchive(models.Model):
+    """
+    Compressed copy of the turns, actions, reveals, detective sheets and stream entries of a completed game, whose
+    rows have been removed from the hot tables.  See clueless.archive
+    """
+    game = models.OneToOneField(Game, primary_key = True)
+    data = models.BinaryField()
+    snapshot = models.BinaryField(blank = True, null = True) #final state of the game, see clueless.snapshots
+    rowCount = models.IntegerField(default = 0)
+    archivedTime = models.DateTimeField(default = timezone.now)
+
+    def __str__(self):
+        return ("game: {}, rows: {}, bytes: {}".format(
+            self.game_id, self.rowCount, len(self.data)
+        ))
+
+
 class DetectiveSheet(models.Model):
     """
     Detective Sheet a player fills out.  As card are discovered, a player checks off different cards as no longer
@@ -795,9 +995,11 @@ class DetectiveSheet(models.Model):
         return checkedIds
 
     def addDefaultSheets(self):
-        for c in Card.objects.all():
-            si = SheetItem(detectiveSheet=self, card=c, checked=False, initiallyDealt=False)
-            si.save()
+        from clueless.catalog import getCatalog
+        SheetItem.objects.bulk_create([
+            SheetItem(detectiveSheet=self, card_id=cardId, checked=False, initiallyDealt=False)
+            for cardId in getCatalog().cardIds()
+        ])
 
     def getCharactersLeft(self):
         """
@@ -809,8 +1011,7 @@ class DetectiveSheet(models.Model):
         """
         :return: QuerySet of all sheet items relating to a character
         """
-        charIds = Character.objects.all().values_list('card_id', flat=True)
-        return SheetItem.objects.filter(detectiveSheet = self,  card__card_id__in=charIds).order_by("card__name")
+        return SheetItem.objects.filter(detectiveSheet = self, card__card_type = CHARACTER_CARD).order_by("card__name")
 
     def getRoomsLeft(self):
         """
@@ -822,8 +1023,7 @@ class DetectiveSheet(models.Model):
         """
         :return: QuerySet of all sheet items relating to a room
         """
-        roomIds = Room.objects.all().values_list('card_id', flat=True)
-        return SheetItem.objects.filter(detectiveSheet = self,  card__card_id__in=roomIds).order_by("card__name")
+        return SheetItem.objects.filter(detectiveSheet = self, card__card_type = ROOM_CARD).order_by("card__name")
 
     def getWeaponsLeft(self):
         """
@@ -835,8 +1035,15 @@ class DetectiveSheet(models.Model):
         """
         :return: QuerySet of all sheet items relating to a weapon
         """
-        weaponIds = Weapon.objects.all().values_list('card_id', flat=True)
-        return SheetItem.objects.filter(detectiveSheet = self,  card__card_id__in=weaponIds ).order_by("card__name")
+        return SheetItem.objects.filter(detectiveSheet = self, card__card_type = WEAPON_CARD).order_by("card__name")
+
+    def dealCards(self, cardIds):
+        """
+        Marks the cards as dealt to the sheet's player
+        :param cardIds: list of card ids the player was dealt
+        """
+        SheetItem.objects.filter(detectiveSheet = self, card_id__in = cardIds).update(
+            checked = True, initiallyDealt = True, manuallyChecked = False)
 
     def makeNote(self, card, checked, initiallyDealt = False, manuallyChecked = False):
         """
@@ -883,28 +1090,67 @@ class CardReveal(models.Model):
         :param suggestion:
         :return:
         """
-        nextPlayer = suggestion.turn.player.getNextPlayer(False)
-        cr = CardReveal(suggestion = suggestion, revealingPlayer = nextPlayer, status = 1)
+        turn = suggestion.turn
+        nextPlayerId = turn.game.nextPlayerId(turn.player_id, False)
+        cr = CardReveal(suggestion = suggestion, revealingPlayer_id = nextPlayerId, status = 1)
         cr.save()
         return cr
 
+    @classmethod
+    def startNextReveal(cls, suggestion, afterPlayerId):
+        """
+        Goes round the table from afterPlayerId towards the suggesting player, and starts a card reveal for the first
+        player that holds one of the suggested cards.  Every player passed over gets a "did not reveal" stream entry,
+        written in bulk
+        :param suggestion: Suggestion being disproved
+        :param afterPlayerId: id of the player the search starts after
+        :return: The new CardReveal, or None if nobody else can reveal a card
+        """
+        from clueless.catalog import getCatalog
+        turn = suggestion.turn
+        game = turn.game
+        suggWWW = suggestion.whoWhatWhere
+        suggCardIds = (suggWWW.character_id, getCatalog().roomByPk(suggWWW.room_id).card_id, suggWWW.weapon_id)
+        holderIds = set(SheetItem.objects.filter(
+            detectiveSheet__game_id=game.id, initiallyDealt=True, card_id__in=suggCardIds).values_list(
+            'detectiveSheet__player_id', flat=True))
+
+        cr = None
+        skippedIds = list()
+        playerId = game.nextPlayerId(afterPlayerId, False)
+        while playerId is not None and playerId != turn.player_id:
+            if playerId in holderIds:
+                cr = CardReveal(suggestion = suggestion, revealingPlayer_id = playerId, status = 1)
+                cr.save()
+                break
+            skippedIds.append(playerId)
+            playerId = game.nextPlayerId(playerId, False)
+
+        if len(skippedIds) > 0:
+            usernames = dict((p.id, p.displayName()) for p in Player.objects.filter(
+                id__in = skippedIds).select_related('user', 'character'))
+            game.registerGameUpdates(
+                ["<b>{}</b> did not reveal a card".format(usernames[playerId]) for playerId in skippedIds])
+        return cr
+
     def hasNext(self):
         """
         :return: True if other players need to reveal, false otherwise
         """
-        nextPlayer = self.revealingPlayer.getNextPlayer(False)
-        return nextPlayer != self.suggestion.turn.player
+        turn = self.suggestion.turn
+        return turn.game.nextPlayerId(self.revealingPlayer_id, False) != turn.player_id
 
     def createNext(self):
         """
         Please check that there is a next player before calling!
         :return: A new CardReveal object with the next player
         """
-        nextPlayer = self.revealingPlayer.getNextPlayer(False)
-        if nextPlayer == self.suggestion.turn.player:
+        turn = self.suggestion.turn
+        nextPlayerId = turn.game.nextPlayerId(self.revealingPlayer_id, False)
+        if nextPlayerId == turn.player_id:
             raise RuntimeError("card reveal has gone full circle")
 
-        cr = CardReveal(suggestion = self.suggestion, revealingPlayer = nextPlayer, status = 1)
+        cr = CardReveal(suggestion = self.suggestion, revealingPlayer_id = nextPlayerId, status = 1)
         cr.save()
         return cr
 
@@ -914,12 +1160,15 @@ class CardReveal(models.Model):
         :param card: Card to reveal
         :return:
         """
-        self.revealedCard = card
-        self.save()
-        #make note on suggestion player's detective sheet
-        ds = self.suggestion.turn.player.getDetectiveSheet()
-        ds.makeNote(card, True)
-        self.endReveal()
+        with transaction.atomic(savepoint = False):
+            self.revealedCard = card
+            self.save()
+            from clueless.event_log import logReveal
+            logReveal(self)
+            #make note on suggestion player's detective sheet
+            ds = self.suggestion.turn.player.getDetectiveSheet()
+            ds.makeNote(card, True)
+            self.endReveal()
 
     def endReveal(self):
         """
@@ -927,18 +1176,22 @@ class CardReveal(models.Model):
         :return:
         """
         if self.revealedCard is None:
-            self.suggestion.turn.game.registerGameUpdate("<b>{}</b> did not reveal a card".format(self.revealingPlayer.user.username))
+            self.suggestion.turn.game.registerGameUpdate("<b>{}</b> did not reveal a card".format(self.revealingPlayer.displayName()))
         self.status = 2
         self.save()
 
+    @instrumented
     def potentialCards(self):
-        ds = self.revealingPlayer.getDetectiveSheet()
+        """
+        :return: QuerySet of the suggested cards that were dealt to the revealing player
+        """
+        from clueless.catalog import getCatalog
         suggWWW = self.suggestion.whoWhatWhere
-        suggCards = Card.objects.filter(
-            card_id__in=(suggWWW.character.card_id, suggWWW.room.card_id, suggWWW.weapon.card_id))
-        initDealtCards = SheetItem.objects.filter(detectiveSheet=ds, initiallyDealt=True).values_list('card_id',
-                                                                                                     flat=True)
-        return suggCards.filter(card_id__in=initDealtCards)
+        #character and weapon primary keys are their card ids, the room primary key is its space collection id
+        return Card.objects.filter(
+            card_id__in=(suggWWW.character_id, getCatalog().roomByPk(suggWWW.room_id).card_id, suggWWW.weapon_id),
+            sheetitem__detectiveSheet__player_id=self.revealingPlayer_id,
+            sheetitem__initiallyDealt=True)
 
 
 class GameStreamEntry(models.Model):
@@ -949,3 +1202,141 @@ class GameStreamEntry(models.Model):
 
     def userReplacedDescription(self, player):
         return self.description.replace("<b>{}</b>".format(player.user.username), "<b style='color:blue'>you</b>")
+
+
+class GameEvent(models.Model):
+    """
+    One entry of the append-only event log of a game, see clueless.event_log.  Rows are only ever inserted
+    """
+    game = models.ForeignKey(Game)
+    number = models.IntegerField() #0 for the start of the game, then 1, 2, ... in the order the rules were applied
+    kind = models.CharField(max_length = 1)
+    args = models.CharField(max_length = 64, blank = True) #comma separated integers
+
+    class Meta:
+        unique_together = [('game', 'number')]
+
+    def __str__(self):
+        return ("game: {}, {}: {} {}".format(self.game_id, self.number, self.kind, self.args))
+
+
+class GameSnapshot(models.Model):
+    """
+    The whole state of a game as it was after one of its events, so it can be rebuilt without replaying the log from
+    the start
+    """
+    game = models.ForeignKey(Game)
+    eventNumber = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = [('game', 'eventNumber')]
+
+    def __str__(self):
+        return ("game: {}, event: {}, bytes: {}".format(self.game_id, self.eventNumber, len(self.data)))
+
+
+class ActionTiming(models.Model):
+    """
+    Where the time went for one action of a game: how long the server took over it, how long the game had waited for
+    it since the state last changed, and how long each seat then took to fetch the new game sequence
+    """
+    game = models.ForeignKey(Game)
+    sequence = models.IntegerField() #game sequence once the action was done
+    kind = models.CharField(max_length = 16)
+    player = models.ForeignKey(Player, blank = True, null = True) #None for a pass of the bots
+    doneAt = models.DateTimeField()
+    processingMs = models.PositiveIntegerField()
+    sincePreviousMs = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [('game', 'sequence')]
+
+    @classmethod
+    def record(cls, gameId, kind, player, startTime, previousUpdateTime):
+        """
+        Records an action that has just been done
+        :param kind: move, suggestion, reveal, accusation, endTurn or bots
+        :param startTime: time.time() when the server started on the action
+        :param previousUpdateTime: the game's lastUpdateTime before the action
+        """
+        sequence, doneAt = Game.objects.values_list('currentSequence', 'lastUpdateTime').get(id = gameId)
+        timing = cls(game_id = gameId, sequence = sequence, kind = kind, player = player, doneAt = doneAt,
+                     processingMs = int(max(time.time() - startTime, 0) * 1000),
+                     sincePreviousMs = int(max((doneAt - previousUpdateTime).total_seconds(), 0) * 1000))
+        timing.save()
+        return timing
+
+    @classmethod
+    def recordFetch(cls, game, playerId, cachedSequence):
+        """
+        Notes that a seat fetched the game state, for every action done since the sequence it had.  The fetch is kept
+        in the process and written with the others by flushFetches, once the oldest has waited FETCH_FLUSH_INTERVAL
+        seconds or FETCH_FLUSH_SIZE are waiting, so a poll takes no lock and usually runs no statement for it
+        :param cachedSequence: sequence the seat had before, -1 when the page was just loaded, which is not counted
+        """
+        if cachedSequence < 0:
+            return
+        with _pendingFetchesLock:
+            _pendingFetches.append((game.id, playerId, cachedSequence, game.currentSequence, timezone.now()))
+            oldest = _pendingFetches[0][4]
+            due = len(_pendingFetches) >= FETCH_FLUSH_SIZE or \
+                (timezone.now() - oldest).total_seconds() >= FETCH_FLUSH_INTERVAL
+        if due:
+            #noting a fetch must never break the poll
+            try:
+                cls.flushFetches()
+            except Exception:
+                logger.exception("Could not write the game state fetches")
+
+    @classmethod
+    def flushFetches(cls):
+        """
+        Writes the fetches waiting in the process, as one ActionFetch insert, after one read of the timings they
+        fetched
+        """
+        with _pendingFetchesLock:
+            pending = list(_pendingFetches)
+            del _pendingFetches[:]
+        if not pending:
+            return
+
+        ranges = dict() #game id -> (lowest cached sequence, highest fetched sequence)
+        for gameId, playerId, cachedSequence, sequence, fetchedAt in pending:
+            low, high = ranges.get(gameId, (cachedSequence, sequence))
+            ranges[gameId] = (min(low, cachedSequence), max(high, sequence))
+        condition = Q()
+        for gameId, (low, high) in ranges.items():
+            condition |= Q(game_id = gameId, sequence__gt = low, sequence__lte = high)
+        timings = dict()
+        for timingId, gameId, sequence, doneAt in cls.objects.filter(condition).values_list(
+                'id', 'game_id', 'sequence', 'doneAt'):
+            timings.setdefault(gameId, list()).append((timingId, sequence, doneAt))
+
+        delays = dict() #(timing id, player id) -> milliseconds, the first fetch of a seat counts
+        for gameId, playerId, cachedSequence, sequence, fetchedAt in pending:
+            for timingId, timingSequence, doneAt in timings.get(gameId, ()):
+                if cachedSequence < timingSequence <= sequence:
+                    ms = int(max((fetchedAt - doneAt).total_seconds(), 0) * 1000)
+                    delays[(timingId, playerId)] = min(ms, delays.get((timingId, playerId), ms))
+        ActionFetch.objects.bulk_create([ActionFetch(timing_id = timingId, player_id = playerId, delayMs = ms)
+                                         for (timingId, playerId), ms in sorted(delays.items())])
+
+    def fetchDelayMap(self):
+        """
+        :return: dictionary of player id -> milliseconds from the action to that seat fetching it
+        """
+        delays = dict()
+        for fetch in self.actionfetch_set.all():
+            #a seat that came back with an old sequence fetched the action again, the first fetch counts
+            delays[fetch.player_id] = min(fetch.delayMs, delays.get(fetch.player_id, fetch.delayMs))
+        return delays
+
+
+class ActionFetch(models.Model):
+    """
+    A seat fetching the game state for the first time after an action, only ever inserted so polls don't contend
+    """
+    timing = models.ForeignKey(ActionTiming)
+    player = models.ForeignKey(Player)
+    delayMs = models.PositiveIntegerField() #from the action being done to the fetch
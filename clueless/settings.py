@@ -43,6 +43,10 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'clueless.middleware.MetricsMiddleware',
+    'clueless.middleware.SlowQueryMiddleware',
+    'clueless.middleware.RequestTraceMiddleware',
+    'clueless.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'clueless.urls'
@@ -156,4 +160,28 @@ STATIC_URL = '/static/'
 
 LOGIN_URL = '/login/'
 
+#per view request metrics are spooled to this directory by every worker process when it is set, and served in the
+#Prometheus text format at /internal/metrics/ to the listed addresses, see clueless/metrics.py
+CLUELESS_METRICS_DIR = os.environ.get('CLUELESS_METRICS_DIR')
+CLUELESS_METRICS_ALLOWED_IPS = os.environ.get('CLUELESS_METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
+#statements slower than CLUELESS_SLOW_QUERY_MS, and statements run over and over in one request, are logged to this
+#file when it is set, see clueless/slow_queries.py
+CLUELESS_SLOW_QUERY_LOG = os.environ.get('CLUELESS_SLOW_QUERY_LOG')
+CLUELESS_SLOW_QUERY_MS = float(os.environ.get('CLUELESS_SLOW_QUERY_MS', 100))
+
+#calls of the instrumented model methods are timed, and each process's most recent calls written to this directory,
+#when it is set, see clueless/instrumentation.py
+CLUELESS_INSTRUMENT_DIR = os.environ.get('CLUELESS_INSTRUMENT_DIR')
+CLUELESS_INSTRUMENT_RING_SIZE = int(os.environ.get('CLUELESS_INSTRUMENT_RING_SIZE', 5000))
+
+#anonymised request traces are appended to this file when it is set, see clueless/traces.py
+CLUELESS_TRACE_FILE = os.environ.get('CLUELESS_TRACE_FILE')
+
+#cProfile dumps of sampled requests, and of requests with a signed X-Clueless-Profile header, are written to this
+#directory when it is set, see clueless/middleware.py
+CLUELESS_PROFILE_DIR = os.environ.get('CLUELESS_PROFILE_DIR')
+CLUELESS_PROFILE_SAMPLE_RATE = float(os.environ.get('CLUELESS_PROFILE_SAMPLE_RATE', 0.0))
+CLUELESS_PROFILE_MAX_DUMPS = int(os.environ.get('CLUELESS_PROFILE_MAX_DUMPS', 200))
+
 from .settings_secret import *
@@ -0,0 +1,122 @@
+"""
+Monte Carlo self-play.  Plays complete bot games on the in-memory rules engine, with no database access, spread over
+a pool of worker processes.  Every game gets its own seed from the run seed and its number, so a run gives the same
+results whatever the number of processes.
+
+Workers add their games up before sending anything back, so a chunk of games costs one small message however large
+it is.
+"""
+import collections
+import multiprocessing
+import random
+
+from clueless.bots import createBot, playBotStep
+from clueless.engine import Board, Deck, GameState
+
+DEFAULT_CHUNK_SIZE = 200
+MAX_GAME_STEPS = 5000 #bot steps before a game is given up as a stalemate
+
+_deck = Deck.standard()
+_board = Board.standard(_deck)
+
+
+def playGame(strategies, seed, maxSteps = MAX_GAME_STEPS):
+    """
+    Plays one game on the standard board
+    :param strategies: list of bot strategy names, one per seat in turn order
+    :param seed: game seed, the deal and every bot choice follow from it
+    :return: (winning seat or None if the game stalled, number of turns)
+    """
+    players = [(seatIndex, character) for seatIndex, character in enumerate(_deck.characters[0:len(strategies)])]
+    state = GameState.newGame(_board, _deck, players, seed)
+    bots = dict((seatIndex, createBot(name, random.Random("{}:bot:{}".format(seed, seatIndex))))
+                for seatIndex, name in enumerate(strategies))
+    steps = 0
+    while steps < maxSteps and playBotStep(state, bots):
+        steps += 1
+    turns = 1 + sum(1 for event in state.events if event[0] == "Turn")
+    return (state.winnerSeat, turns)
+
+
+def gameSeed(runSeed, gameNumber):
+    return "{}:{}".format(runSeed, gameNumber)
+
+
+def simulateChunk(task):
+    """
+    Plays a run of consecutive games.  Runs in a worker process
+    :param task: (strategies, run seed, first game number, number of games, max steps)
+    :return: (seat wins list, stalled games, turn count -> games Counter)
+    """
+    strategies, runSeed, first, count, maxSteps = task
+    seatWins = [0] * len(strategies)
+    stalled = 0
+    turnCounts = collections.Counter()
+    for gameNumber in range(first, first + count):
+        winnerSeat, turns = playGame(strategies, gameSeed(runSeed, gameNumber), maxSteps)
+        if winnerSeat is None:
+            stalled += 1
+        else:
+            seatWins[winnerSeat] += 1
+        turnCounts[turns] += 1
+    return (seatWins, stalled, turnCounts)
+
+
+def runSimulation(strategies, games, runSeed = 0, processes = None, chunkSize = DEFAULT_CHUNK_SIZE,
+                  maxSteps = MAX_GAME_STEPS):
+    """
+    :param strategies: list of bot strategy names, one per seat in turn order
+    :param games: number of games to play
+    :param runSeed: seed the game seeds are made from
+    :param processes: worker processes, None for one per core, 1 to play in this process
+    :return: result dictionary, see summarize
+    """
+    tasks = [(list(strategies), runSeed, first, min(chunkSize, games - first), maxSteps)
+             for first in range(0, games, chunkSize)]
+    seatWins = [0] * len(strategies)
+    stalled = 0
+    turnCounts = collections.Counter()
+
+    if processes == 1:
+        chunks = map(simulateChunk, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        chunks = pool.imap_unordered(simulateChunk, tasks)
+    try:
+        for chunkSeatWins, chunkStalled, chunkTurnCounts in chunks:
+            seatWins = [total + wins for total, wins in zip(seatWins, chunkSeatWins)]
+            stalled += chunkStalled
+            turnCounts.update(chunkTurnCounts)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return summarize(strategies, runSeed, seatWins, stalled, turnCounts)
+
+
+def summarize(strategies, runSeed, seatWins, stalled, turnCounts):
+    """
+    :return: dictionary with the games played, wins and win rate per seat and per strategy, stalled games, the
+    average number of turns and a turn count -> games histogram
+    """
+    games = sum(turnCounts.values())
+    strategyWins = collections.OrderedDict()
+    strategySeats = collections.Counter(strategies)
+    for name, wins in zip(strategies, seatWins):
+        strategyWins[name] = strategyWins.get(name, 0) + wins
+    return {
+        'strategies': list(strategies),
+        'seed': runSeed,
+        'games': games,
+        'stalled': stalled,
+        'seatWins': seatWins,
+        'seatWinRates': [round(float(wins) / games, 4) if games else 0.0 for wins in seatWins],
+        'strategyWins': strategyWins,
+        #per seat, so strategies playing more seats are comparable
+        'strategyWinRates': collections.OrderedDict(
+            (name, round(float(wins) / (games * strategySeats[name]), 4) if games else 0.0)
+            for name, wins in strategyWins.items()),
+        'averageTurns': round(float(sum(t * n for t, n in turnCounts.items())) / games, 2) if games else 0.0,
+        'turnHistogram': collections.OrderedDict((str(t), turnCounts[t]) for t in sorted(turnCounts)),
+    }
@@ -0,0 +1,150 @@
+"""
+Slow and repeated SQL statements, each put down to the code that ran it.
+
+Every statement slower than the threshold is logged as it finishes, and at the end of a request every statement that
+ran DUPLICATE_THRESHOLD times or more in it, with different parameters or not, is logged once with its count: the
+mark of a query made in a loop.  Each entry names the view and the innermost frame of the stack inside clueless/,
+e.g. models.py:Move.checkHallwayEmpty, and is appended to a JSON lines log:
+    {"kind": "slow" or "duplicate", "view", "frame", "line", "sql", "ms", "count", "t"}
+
+Statements are seen through the cursor hook of clueless.metrics.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+from clueless import metrics
+from clueless.traces import appendRecord
+
+DEFAULT_THRESHOLD_MS = 100.0
+DUPLICATE_THRESHOLD = 3 #runs of the same statement in one request
+MAX_SQL_LENGTH = 500 #characters of a statement kept in the log
+
+_cluelessDirectory = os.path.dirname(os.path.abspath(__file__))
+#the modules between a statement and the code that asked for it
+_plumbing = set(os.path.join(_cluelessDirectory, name) for name in (
+    'metrics.py', 'slow_queries.py', 'middleware.py', 'instrumentation.py'))
+
+_local = threading.local()
+_logPath = None
+_thresholdSeconds = DEFAULT_THRESHOLD_MS / 1000
+
+
+def enable(logPath, thresholdMs = DEFAULT_THRESHOLD_MS):
+    global _logPath, _thresholdSeconds
+    _thresholdSeconds = thresholdMs / 1000.0
+    _logPath = logPath
+    metrics.installQueryTiming()
+    if _onQuery not in metrics.queryListeners:
+        metrics.queryListeners.append(_onQuery)
+
+
+def disable():
+    global _logPath
+    _logPath = None
+
+
+def attribute():
+    """
+    :return: (file:Class.method or file:function of the innermost frame inside clueless/, its line), or (None, None)
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_cluelessDirectory) and filename not in _plumbing:
+            name = frame.f_code.co_name
+            owner = frame.f_locals.get('self', None)
+            ownerClass = owner if isinstance(owner, type) else type(owner) if owner is not None else None
+            if ownerClass is not None:
+                for klass in ownerClass.__mro__:
+                    if name in klass.__dict__:
+                        name = "{}.{}".format(klass.__name__, name)
+                        break
+            return ("{}:{}".format(os.path.relpath(filename, _cluelessDirectory), name), frame.f_lineno)
+        frame = frame.f_back
+    return (None, None)
+
+
+def startRequest():
+    _local.statements = dict() #sql -> [runs, seconds, frame, line]
+    _local.view = None
+
+
+def setView(view):
+    _local.view = view
+
+
+def finishRequest():
+    """
+    Logs the statements the request ran DUPLICATE_THRESHOLD times or more
+    """
+    statements = getattr(_local, 'statements', None)
+    _local.statements = None
+    if statements is None or _logPath is None:
+        return
+    for sql, (runs, seconds, frame, line) in statements.items():
+        if runs >= DUPLICATE_THRESHOLD:
+            _log('duplicate', sql, seconds, frame, line, runs)
+
+
+def _log(kind, sql, seconds, frame, line, count = 1):
+    appendRecord(_logPath, {
+        'kind': kind, 'view': getattr(_local, 'view', None), 'frame': frame, 'line': line,
+        'sql': sql[0:MAX_SQL_LENGTH], 'ms': round(seconds * 1000, 2), 'count': count, 't': round(time.time(), 3),
+    })
+
+
+def _onQuery(sql, seconds):
+    if _logPath is None:
+        return
+    frame = line = None
+    if seconds >= _thresholdSeconds:
+        frame, line = attribute()
+        _log('slow', sql, seconds, frame, line)
+
+    statements = getattr(_local, 'statements', None)
+    if statements is None:
+        return
+    seen = statements.get(sql)
+    if seen is None:
+        statements[sql] = [1, seconds, frame, line]
+        return
+    seen[0] += 1
+    seen[1] += seconds
+    #the stack is only walked once a statement repeats
+    if seen[2] is None:
+        seen[2], seen[3] = (frame, line) if frame is not None else attribute()
+
+
+def readLog(logPath):
+    """
+    :return: list of the entries of a slow query log
+    """
+    with open(logPath) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rankOffenders(entries):
+    """
+    :return: list of {'kind', 'frame', 'entries', 'count', 'ms', 'maxMs', 'views', 'sql'} per kind and frame, the
+    most time first
+    """
+    offenders = dict()
+    for entry in entries:
+        key = (entry['kind'], entry['frame'])
+        offender = offenders.get(key)
+        if offender is None:
+            offender = offenders[key] = {'kind': entry['kind'], 'frame': entry['frame'], 'entries': 0, 'count': 0,
+                                         'ms': 0.0, 'maxMs': 0.0, 'views': set(), 'sql': entry['sql']}
+        offender['entries'] += 1
+        offender['count'] += entry['count']
+        offender['ms'] += entry['ms']
+        offender['maxMs'] = max(offender['maxMs'], entry['ms'])
+        if entry['view']:
+            offender['views'].add(entry['view'])
+    ranked = sorted(offenders.values(), key = lambda o: (-o['ms'], o['kind'], o['frame'] or ""))
+    for offender in ranked:
+        offender['views'] = sorted(offender['views'])
+    return ranked
@@ -0,0 +1,105 @@
+"""
+Compact binary snapshots of the whole state of a game, as kept by the event log and the game archive.
+
+A snapshot of a six seat game is under two hundred bytes, packed little-endian with struct:
+    header   version, seat count, piece count, turn seat, phase, revealing seat, winner seat, case file (3 cards),
+             suggestion (3 cards)                                               "<BBBBBbb3B3b"
+    seats    player id, character, hand bitmask, known bitmask, eliminated     "<IBQQ?" each, in turn order
+    pieces   character, space id                                                "<BI" each
+Cards are engine card indexes, bit c of a bitmask is card c, and -1 stands for no seat or no suggestion.  Snapshots
+only hold numbers, so they are read back with the engine tables of the same card catalog.
+
+Snapshots of version 1, written as JSON before this format, can still be read.
+"""
+import json
+import struct
+
+from clueless.engine import GameState, Seat
+
+SNAPSHOT_FORMAT_VERSION = 2
+MAX_CARDS = 64 #bits in a bitmask
+
+_header = struct.Struct("<BBBBBbb3B3b")
+_seat = struct.Struct("<IBQQ?")
+_piece = struct.Struct("<BI")
+
+
+def _mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= 1 << card
+    return mask
+
+
+def _cards(mask):
+    cards = list()
+    while mask:
+        lowest = mask & -mask
+        cards.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return cards
+
+
+def _seatOrNone(seat):
+    return seat if seat >= 0 else None
+
+
+def packState(state):
+    """
+    :param state: GameState
+    :return: bytes holding everything in the state but the board, deck and events
+    """
+    if len(state.deck) > MAX_CARDS:
+        raise RuntimeError("Snapshots hold at most {} cards".format(MAX_CARDS))
+    suggestion = state.suggestion if state.suggestion is not None else (-1, -1, -1)
+    parts = [_header.pack(
+        SNAPSHOT_FORMAT_VERSION, len(state.seats), len(state.pieces), state.turnSeat, state.phase,
+        state.revealingSeat if state.revealingSeat is not None else -1,
+        state.winnerSeat if state.winnerSeat is not None else -1,
+        *(tuple(state.caseFile) + tuple(suggestion)))]
+    for seat in state.seats:
+        parts.append(_seat.pack(seat.playerId, seat.character, _mask(seat.hand), _mask(seat.known), seat.eliminated))
+    for character, spaceId in sorted(state.pieces.items()):
+        parts.append(_piece.pack(character, spaceId))
+    return b"".join(parts)
+
+
+def unpackState(data, tables):
+    """
+    :param data: bytes made by packState
+    :param tables: EngineTables of the card catalog the state was packed with
+    :return: GameState
+    """
+    data = bytes(data)
+    if data[0:1] == b"{":
+        return _unpackVersion1(data, tables)
+    if data[0] != SNAPSHOT_FORMAT_VERSION:
+        raise RuntimeError("Unsupported game snapshot version {}".format(data[0]))
+    header = _header.unpack_from(data, 0)
+    version, seatCount, pieceCount, turnSeat, phase, revealingSeat, winnerSeat = header[0:7]
+    caseFile = header[7:10]
+    suggestion = header[10:13] if header[10] >= 0 else None
+
+    offset = _header.size
+    seats = list()
+    for i in range(0, seatCount):
+        playerId, character, hand, known, eliminated = _seat.unpack_from(data, offset)
+        seats.append(Seat(playerId, character, _cards(hand), _cards(known), eliminated))
+        offset += _seat.size
+    pieces = dict()
+    for i in range(0, pieceCount):
+        character, spaceId = _piece.unpack_from(data, offset)
+        pieces[character] = spaceId
+        offset += _piece.size
+    return GameState(tables.board, tables.deck, seats, pieces, caseFile, turnSeat, phase, suggestion,
+                     _seatOrNone(revealingSeat), _seatOrNone(winnerSeat))
+
+
+def _unpackVersion1(data, tables):
+    packed = json.loads(data.decode('utf-8'))
+    seats = [Seat(playerId, character, hand, known, eliminated)
+             for playerId, character, hand, known, eliminated in packed['seats']]
+    return GameState(tables.board, tables.deck, seats, dict((c, space) for c, space in packed['pieces']),
+                     packed['caseFile'], packed['turnSeat'], packed['phase'],
+                     tuple(packed['suggestion']) if packed['suggestion'] is not None else None,
+                     packed['revealingSeat'], packed['winnerSeat'])
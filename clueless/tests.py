@@ -1,10 +1,32 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import Client, TestCase
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+import datetime
 import json
-
-from clueless.models import Accusation, Card, CardReveal, CaseFile, Character, DetectiveSheet, Game, Move, Player, Room, SheetItem, Space, Suggestion, Weapon, WhoWhatWhere
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from clueless import event_log, game_export, hints, instrumentation, loadtest, lobby, metrics, models, slow_queries, snapshots, tournament, traces
+from clueless.archive import archiveGame, archiveRecords, archivedState, rehydrateGame
+from clueless.bot_runner import BotRunner
+from clueless.bots import DetectiveBot, RandomBot, RecklessBot, createBot, playBotStep
+from clueless.catalog import getCatalog
+from clueless.engine import Board, Deck, GameState
+from clueless.engine_adapter import GameStateAdapter, getEngineTables
+from clueless.lobby import invalidateLobby, lobbyGames
+from clueless.middleware import profileHeaderValue
+from clueless.models import Accusation, ActionFetch, ActionTiming, Card, CardReveal, CaseFile, Character, DetectiveSheet, Game, GameArchive, GameEvent, GameSnapshot, GameStreamEntry, Move, OpenGameSummary, Player, Room, SheetItem, Space, Suggestion, Turn, Weapon, WhoWhatWhere
+from clueless.models import CHARACTER_CARD, COMPLETE, ROOM_CARD, WEAPON_CARD, TURN_MOVED, TURN_PHASE_TRANSITIONS, TURN_START, availableTurnActions, characterBit
+from clueless.simulation import runSimulation
 
 
 class AAA_DBSetup(TestCase):
@@ -23,6 +45,176 @@ class AAA_DBSetup(TestCase):
         pass
 
 
+class BotTests(TestCase):
+
+    def setUp(self):
+        self.deck = Deck.standard()
+        self.board = Board.standard(self.deck)
+        players = [(i, character) for i, character in enumerate(self.deck.characters[0:4])]
+        self.state = GameState.newGame(self.board, self.deck, players, 7)
+
+    def playOut(self, bots, maxSteps = 5000):
+        steps = 0
+        while playBotStep(self.state, bots):
+            steps += 1
+            self.assertLess(steps, maxSteps)
+        return steps
+
+    def test_detective_bots_play_a_game_to_the_end(self):
+        bots = dict((i, DetectiveBot(random.Random(i))) for i in range(0, 4))
+        self.playOut(bots)
+        self.assertTrue(self.state.finished)
+        #detectives only accuse once they are sure
+        self.assertEqual([e for e in self.state.events if e[0] == "Accusation"][-1][2:], (self.state.caseFile, True))
+
+    def test_random_and_reckless_bots_play_a_game_to_the_end(self):
+        bots = {0: RandomBot(random.Random(0)), 1: RecklessBot(random.Random(1)), 2: RandomBot(random.Random(2)),
+                3: RecklessBot(random.Random(3))}
+        self.playOut(bots)
+        self.assertTrue(self.state.finished)
+
+    def test_bots_wait_for_user_seats(self):
+        bots = {1: DetectiveBot(random.Random(1))}
+        self.assertFalse(playBotStep(self.state, bots))
+        self.assertEqual(self.state.events, [])
+
+    def test_detective_heads_for_an_unseen_room(self):
+        bot = DetectiveBot(random.Random(0))
+        seat = self.state.seats[0]
+        #Miss Scarlet starts between the Hall and the Lounge
+        hall, lounge = self.deck.rooms[1], self.deck.rooms[2]
+        seat.known.add(hall)
+        if lounge not in seat.hand:
+            self.assertEqual(bot.chooseMove(self.state, 0, self.state.validMoves()), self.board.roomSpaces[lounge])
+
+    def test_invalid_decisions_pass_on_the_action(self):
+        class StubbornBot(RandomBot):
+            def chooseMove(self, state, seatIndex, moves):
+                return (0, 0)
+
+        playBotStep(self.state, {0: StubbornBot(random.Random(0))})
+        #could not move out of the hallway, so had to accuse
+        self.assertEqual(self.state.events[0][0], "Accusation")
+        self.assertTrue(self.state.seats[0].eliminated or self.state.finished)
+
+    def test_unknown_strategy_raises(self):
+        self.assertRaises(RuntimeError, createBot, "clairvoyant")
+
+    def test_slow_decision_falls_back_to_random(self):
+        class SlowBot(RandomBot):
+            def chooseReveal(self, state, seatIndex, cards):
+                time.sleep(0.5)
+                return cards[0]
+
+        runner = BotRunner(1, 0.01)
+        try:
+            cards = sorted(self.state.seats[0].hand)
+            choice = runner.timedDecision(SlowBot(), RandomBot(random.Random(0)), "chooseReveal", self.state, 0, cards)
+        finally:
+            runner.shutdown()
+        self.assertIn(choice, cards)
+
+
+class BotRunnerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('bottestuser1', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+
+        cls.game1 = Game(name = "bots", botStrategy = "detective")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.startGame(cls.user1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.player1.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.game1.refresh_from_db()
+        self.runner = BotRunner(1, 1.0)
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def test_bots_take_the_empty_seats(self):
+        bots = Player.objects.filter(currentGame = self.game1).exclude(botStrategy = "")
+        self.assertEqual(bots.count(), Character.objects.count() - 1)
+        self.assertEqual(len(self.game1.seatOrder()), Character.objects.count())
+        self.assertFalse(Player.objects.filter(currentGame = self.game1, nonUserPlayer = True).exists())
+        for bot in bots:
+            self.assertTrue(SheetItem.objects.filter(detectiveSheet__player = bot, initiallyDealt = True).exists())
+            self.assertTrue(bot.displayName().endswith("(bot)"))
+
+    def test_nothing_to_do_on_a_user_turn(self):
+        self.assertNotIn(self.game1.id, self.runner.pendingGameIds())
+        sequence = self.game1.currentSequence
+        self.assertEqual(self.runner.advanceGame(self.game1.id), 0)
+        self.assertEqual(Game.objects.get(id = self.game1.id).currentSequence, sequence)
+
+    def test_bots_play_after_the_user_ends_their_turn(self):
+        adapter = GameStateAdapter(self.game1)
+        state = adapter.load()
+        state.move(state.validMoves()[0])
+        state.endTurn()
+        adapter.save()
+        self.assertIn(self.game1.id, self.runner.pendingGameIds())
+
+        self.assertGreater(self.runner.advanceGame(self.game1.id), 0)
+        game = Game.objects.get(id = self.game1.id)
+        state = GameStateAdapter(game).load()
+        #the bots stop as soon as the user has something to do
+        waitingOnUser = state.finished or state.turnSeat == 0 or state.revealingSeat == 0
+        self.assertTrue(waitingOnUser)
+        self.assertTrue(GameStreamEntry.objects.filter(game = game, description__contains = "(bot)</b>").exists())
+
+    def test_pass_is_dropped_when_the_game_changes_meanwhile(self):
+        adapter = GameStateAdapter(self.game1)
+        state = adapter.load()
+        state.move(state.validMoves()[0])
+        state.endTurn()
+        adapter.save()
+        sequence = Game.objects.get(id = self.game1.id).currentSequence
+
+        class ChangingRunner(BotRunner):
+            def timedDecision(runner, *args):
+                #a user request lands while the bots are deciding
+                Game.objects.filter(id = self.game1.id).update(currentSequence = sequence + 1)
+                return BotRunner.timedDecision(runner, *args)
+
+        runner = ChangingRunner(1, 1.0)
+        self.addCleanup(runner.shutdown)
+        self.assertEqual(runner.advanceGame(self.game1.id), 0)
+        self.assertEqual(Game.objects.get(id = self.game1.id).currentSequence, sequence + 1)
+        self.assertFalse(GameStreamEntry.objects.filter(game = self.game1, description__contains = "(bot)</b>").exists())
+
+    def test_bot_loses(self):
+        bot = Player.objects.filter(currentGame = self.game1).exclude(botStrategy = "").first()
+        self.game1.loseGame(bot)
+        self.assertEqual(Player.objects.get(id = bot.id).gameResult, -1)
+        self.assertTrue(GameStreamEntry.objects.filter(
+            game = self.game1, description = "<b>{}</b> lost!".format(bot.displayName())).exists())
+
+    def test_bot_wins_when_last_one_left(self):
+        bots = list(Player.objects.filter(currentGame = self.game1).exclude(botStrategy = "").order_by('id'))
+        for bot in bots[1:]:
+            self.game1.loseGame(bot)
+        #the user's wrong accusation leaves only the first bot
+        caseFile = self.game1.caseFile
+        wrongWeapon = Weapon.objects.exclude(card_id = caseFile.weapon.card_id)[0]
+        accusation = Accusation.createAccusation(self.game1.currentTurn, caseFile.character, caseFile.room, wrongWeapon)
+        self.assertIsNone(self.game1.currentTurn.takeAction(accusation))
+
+        self.assertEqual(Game.objects.get(id = self.game1.id).status, COMPLETE)
+        self.assertEqual(Player.objects.get(id = bots[0].id).gameResult, 1)
+        self.assertTrue(GameStreamEntry.objects.filter(
+            game = self.game1, description = "<b>{}</b> won!".format(bots[0].displayName())).exists())
+
+
 class CardModelTests(TestCase):
 
     #begin tests
@@ -79,6 +271,54 @@ class CardModelTests(TestCase):
         self.assertEqual(weapon2.compare(weapon3), False)
         self.assertEqual(weapon2.compare(character1), False)
 
+    def test_card_type_matches_subclass(self):
+        for c in Character.objects.all():
+            self.assertEqual(Card.objects.get(card_id = c.card_id).card_type, CHARACTER_CARD)
+        for r in Room.objects.all():
+            self.assertEqual(Card.objects.get(card_id = r.card_id).card_type, ROOM_CARD)
+        for w in Weapon.objects.all():
+            self.assertEqual(Card.objects.get(card_id = w.card_id).card_type, WEAPON_CARD)
+
+    def test_ordinals_are_unique_and_dense(self):
+        ordinals = sorted(Card.objects.values_list('ordinal', flat=True))
+        self.assertEqual(ordinals, list(range(0, Card.objects.count())))
+
+
+class CardCatalogTests(TestCase):
+
+    def test_lookups_match_database(self):
+        catalog = getCatalog()
+        for c in Character.objects.all():
+            self.assertEqual(catalog.character(c.card_id), c)
+            self.assertEqual(catalog.entry(c.card_id).defaultSpace_id, c.defaultSpace_id)
+        for r in Room.objects.all():
+            self.assertEqual(catalog.room(r.card_id), r)
+            self.assertEqual(catalog.roomByPk(r.id).card_id, r.card_id)
+            self.assertEqual(catalog.roomForSpace(r.space.id).card_id, r.card_id)
+        for w in Weapon.objects.all():
+            self.assertEqual(catalog.weapon(w.card_id), w)
+
+    def test_lookups_cost_no_queries(self):
+        catalog = getCatalog()
+        character = Character.objects.all()[0]
+        with self.assertNumQueries(0):
+            getCatalog().character(character.card_id)
+            getCatalog().card(character.card_id)
+            catalog.cardIds()
+
+    def test_wrong_type_raises_does_not_exist(self):
+        weapon = Weapon.objects.all()[0]
+        with self.assertRaises(Character.DoesNotExist):
+            getCatalog().character(weapon.card_id)
+        with self.assertRaises(Card.DoesNotExist):
+            getCatalog().card(-1)
+
+    def test_card_change_reloads_catalog(self):
+        before = getCatalog()
+        weapon = Weapon.objects.all()[0]
+        weapon.save()
+        self.assertIsNot(getCatalog(), before)
+
 
 class CardRevealModelTests(TestCase):
     @classmethod
@@ -197,6 +437,12 @@ class CaseFileModelTests(TestCase):
 
         self.assertEqual(cf1.compare(cf2) and cf1.compare(cf3) and cf2.compare(cf3), False)
 
+    def test_createRandom_same_rng_seed_is_same(self):
+        cf1 = CaseFile.createRandom(random.Random(42))
+        cf2 = CaseFile.createRandom(random.Random(42))
+
+        self.assertEqual(cf1.compare(cf2), True)
+
 
 class DetectiveSheetTests(TestCase):
     @classmethod
@@ -394,6 +640,233 @@ class DetectiveSheetTests(TestCase):
         self.assertEqual(ds.getWeaponSheetItems().count(), Weapon.objects.all().count())
 
 
+class EngineTests(TestCase):
+
+    def setUp(self):
+        self.deck = Deck.standard()
+        self.board = Board.standard(self.deck)
+        self.scarlet, self.mustard, self.white = self.deck.characters[0:3]
+        self.state = GameState.newGame(self.board, self.deck, [(1, self.scarlet), (2, self.mustard), (3, self.white)], 42)
+
+    def test_deal_splits_every_card_outside_the_case_file(self):
+        dealt = [card for seat in self.state.seats for card in seat.hand]
+        self.assertEqual(len(dealt), len(set(dealt)))
+        self.assertEqual(sorted(dealt + list(self.state.caseFile)), list(range(0, len(self.deck))))
+
+    def test_turn_cannot_start_and_end_in_hallway(self):
+        self.assertEqual(self.state.availableActions(), ["Move", "Accusation"])
+        self.assertRaises(RuntimeError, self.state.endTurn)
+        self.state.move((3, 1))
+        self.assertIn("EndTurn", self.state.availableActions())
+        self.assertRaises(RuntimeError, self.state.move, (2, 1))
+
+    def test_occupied_hallway_is_not_a_valid_move(self):
+        self.state.pieces[self.mustard] = (3, 2)
+        self.state.pieces[self.scarlet] = (3, 1)
+        self.assertEqual(self.state.validMoves(), [(2, 1), (4, 1)])
+        self.assertRaises(RuntimeError, self.state.move, (3, 2))
+
+    def test_secret_passage_connects_corner_rooms(self):
+        self.assertTrue(self.board.areNeighbours((1, 1), (5, 5)))
+        self.assertTrue(self.board.areNeighbours((1, 5), (5, 1)))
+
+    def test_suggestion_moves_suspect_and_asks_first_holder(self):
+        self.state.move((5, 1))
+        lounge = self.board.roomAt((5, 1))
+        weapon = self.deck.weapons[0]
+        suggested = (self.white, lounge, weapon)
+        holders = [i for i in (1, 2) if self.state.seats[i].hand.intersection(suggested)]
+
+        skipped = self.state.suggest(self.white, weapon)
+        self.assertEqual(self.state.pieces[self.white], (5, 1))
+        if holders:
+            self.assertEqual(self.state.suggestion, suggested)
+            self.assertEqual(self.state.revealingSeat, holders[0])
+            self.assertEqual(skipped, list(range(1, holders[0])))
+            card = self.state.revealableCards()[0]
+            self.state.reveal(card)
+            self.assertIn(card, self.state.seats[0].known)
+        else:
+            self.assertEqual(self.state.suggestion, None)
+            self.assertEqual(self.state.revealingSeat, None)
+            self.assertEqual(skipped, [1, 2])
+
+    def test_wrong_accusation_eliminates_and_last_player_wins(self):
+        state = GameState.newGame(self.board, self.deck, [(1, self.scarlet), (2, self.mustard)], 7)
+        wrong = (state.caseFile[0], state.caseFile[1], [w for w in self.deck.weapons if w != state.caseFile[2]][0])
+        self.assertFalse(state.accuse(*wrong))
+        self.assertTrue(state.seats[0].eliminated)
+        self.assertTrue(state.finished)
+        self.assertEqual(state.winnerSeat, 1)
+        self.assertRaises(RuntimeError, state.move, (3, 1))
+
+    def test_wrong_accusation_passes_turn_to_next_active_player(self):
+        caseFile = self.state.caseFile
+        wrongWeapon = [w for w in self.deck.weapons if w != caseFile[2]][0]
+        self.state.accuse(caseFile[0], caseFile[1], wrongWeapon)
+        self.assertTrue(self.state.seats[0].eliminated)
+        self.assertEqual(self.state.turnSeat, 1)
+        self.assertEqual(self.state.phase, TURN_START)
+        self.assertEqual(self.state.nextSeat(2), 1)
+
+    def test_random_games_always_finish(self):
+        rng = random.Random(3)
+        for seed in range(0, 20):
+            state = GameState.newGame(self.board, self.deck, [(1, self.scarlet), (2, self.mustard), (3, self.white)], seed)
+            for step in range(0, 2000):
+                if state.finished:
+                    break
+                if state.revealingSeat is not None:
+                    state.reveal(rng.choice(state.revealableCards()))
+                    continue
+                actions = state.availableActions()
+                if "Move" in actions and state.validMoves() and rng.random() < 0.8:
+                    state.move(rng.choice(state.validMoves()))
+                elif "Suggestion" in actions:
+                    state.suggest(rng.choice(self.deck.characters), rng.choice(self.deck.weapons))
+                elif "EndTurn" in actions and rng.random() < 0.95:
+                    state.endTurn()
+                else:
+                    state.accuse(rng.choice(self.deck.characters), rng.choice(self.deck.rooms), rng.choice(self.deck.weapons))
+            self.assertTrue(state.finished)
+
+
+class EngineAdapterTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('enginetestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('enginetestuser2', 'a@a.com', 'password')
+
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "engine")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.game1.refresh_from_db()
+        self.adapter = GameStateAdapter(self.game1)
+        self.state = self.adapter.load()
+        self.tables = getEngineTables()
+
+    def test_load_matches_the_stored_deal(self):
+        for seat in self.state.seats:
+            dealt = SheetItem.objects.filter(detectiveSheet__player_id = seat.playerId, initiallyDealt = True)
+            self.assertEqual(set(self.tables.cardIds[c] for c in seat.hand), set(dealt.values_list('card_id', flat = True)))
+        self.assertEqual([seat.playerId for seat in self.state.seats], [self.player1.id, self.player2.id])
+        self.assertEqual(self.state.turnSeat, 0)
+
+    def test_new_engine_game_deals_like_startGame(self):
+        players = [(seat.playerId, seat.character) for seat in self.state.seats]
+        fresh = GameState.newGame(self.tables.board, self.tables.deck, players, self.game1.seed)
+        self.assertEqual(fresh.caseFile, self.state.caseFile)
+        self.assertEqual([seat.hand for seat in fresh.seats], [seat.hand for seat in self.state.seats])
+
+    def test_move_and_end_turn_are_saved(self):
+        lounge = Space.objects.get(posX=5, posY=1)
+        self.state.move(lounge.id)
+        self.state.endTurn()
+        self.adapter.save()
+
+        self.assertEqual(Player.objects.get(id = self.player1.id).currentSpace_id, lounge.id)
+        self.assertTrue(Move.objects.filter(turn__game = self.game1, toSpace = lounge).exists())
+        game = Game.objects.get(id = self.game1.id)
+        self.assertEqual(game.currentTurn.player_id, self.player2.id)
+        self.assertEqual(game.currentTurn.phase, TURN_START)
+        self.assertTrue(GameStreamEntry.objects.filter(
+            game = self.game1, description = "<b>enginetestuser1</b> moved to <b>Lounge</b>").exists())
+        self.assertTrue(GameStreamEntry.objects.filter(
+            game = self.game1, description = "<b>enginetestuser1</b> ended turn").exists())
+
+    def test_wrong_accusation_is_saved_as_a_finished_game(self):
+        caseFile = self.state.caseFile
+        wrongWeapon = [w for w in self.tables.deck.weapons if w != caseFile[2]][0]
+        self.state.accuse(caseFile[0], caseFile[1], wrongWeapon)
+        self.adapter.save()
+
+        game = Game.objects.get(id = self.game1.id)
+        self.assertEqual(game.status, 2)
+        self.assertEqual(Player.objects.get(id = self.player1.id).gameResult, -1)
+        self.assertEqual(Player.objects.get(id = self.player2.id).gameResult, 1)
+        self.assertTrue(Accusation.objects.filter(turn__game = self.game1).exists())
+        self.assertFalse(OpenGameSummary.objects.filter(game = self.game1).exists())
+
+    def test_suggestion_and_reveal_are_saved(self):
+        lounge = Space.objects.get(posX=5, posY=1)
+        self.state.move(lounge.id)
+        #suggest cards player 2 holds where possible, so there is something to reveal
+        hand = self.state.seats[1].hand
+        weapon = sorted(hand.intersection(self.tables.deck.weapons)) or list(self.tables.deck.weapons)
+        character = sorted(hand.intersection(self.tables.deck.characters)) or list(self.tables.deck.characters)
+        self.state.suggest(character[0], weapon[0])
+        self.adapter.save()
+
+        if self.state.revealingSeat is None:
+            self.assertFalse(CardReveal.objects.filter(suggestion__turn__game = self.game1).exists())
+            return
+        cr = CardReveal.objects.get(suggestion__turn__game = self.game1, status = 1)
+        self.assertEqual(cr.revealingPlayer_id, self.player2.id)
+
+        #the reveal comes in a later request, with a freshly loaded state
+        adapter = GameStateAdapter(Game.objects.get(id = self.game1.id))
+        state = adapter.load()
+        self.assertEqual(state.revealingSeat, 1)
+        card = state.revealableCards()[0]
+        state.reveal(card)
+        adapter.save()
+
+        cr.refresh_from_db()
+        self.assertEqual(cr.status, 2)
+        self.assertEqual(cr.revealedCard_id, self.tables.cardIds[card])
+        self.assertTrue(SheetItem.objects.get(detectiveSheet__player = self.player1,
+                                              card_id = self.tables.cardIds[card]).checked)
+        self.assertEqual(GameStreamEntry.objects.filter(game = self.game1, playerSpecific = self.player2).count(), 1)
+
+    def test_undisproved_suggestions_are_loaded_as_history(self):
+        #suggest cards player 2 does not hold, in a room player 1 is put in, so nobody can disprove them.  The tables
+        #are changed behind the log's back, so they are read rather than the log
+        hand = self.state.seats[1].hand
+        room = [r for r in self.tables.deck.rooms if r not in hand][0]
+        Player.objects.filter(id = self.player1.id).update(currentSpace_id = self.tables.board.roomSpaces[room])
+        adapter = GameStateAdapter(Game.objects.get(id = self.game1.id))
+        state = adapter.load(fromTables = True)
+        character = [c for c in self.tables.deck.characters if c not in hand][0]
+        weapon = [w for w in self.tables.deck.weapons if w not in hand][0]
+        state.suggest(character, weapon)
+        self.assertIsNone(state.revealingSeat)
+        adapter.save()
+
+        self.assertEqual(GameStateAdapter(Game.objects.get(id = self.game1.id)).load(fromTables = True).events, [])
+        adapter = GameStateAdapter(Game.objects.get(id = self.game1.id))
+        state = adapter.load(history = True, fromTables = True)
+        self.assertEqual(state.events, [("Suggestion", 0, (character, room, weapon), (), None)])
+        #the history is not saved again
+        state.endTurn()
+        adapter.save()
+        self.assertEqual(Suggestion.objects.filter(turn__game = self.game1).count(), 1)
+
+    def test_validMoves_uses_the_engine_board(self):
+        #both neighbours of the starting hallway are rooms, which come from the catalog
+        with self.assertNumQueries(1):
+            moves = self.player1.validMoves()
+        self.assertEqual(sorted(m.name for m in moves), ["Hall", "Lounge"])
+
+
 class GameModelTests(TestCase):
 
     @classmethod
@@ -566,6 +1039,63 @@ class GameModelTests(TestCase):
 
         self.assertIsNotNone(self.g.currentTurn)
 
+    def test_startGame_same_seed_deals_same_cards(self):
+        self.g.seed = 12345
+        self.g.initializeGame(self.player1)
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+
+        user3 = User.objects.create_user('testuser3', 'a@a.com', 'testuser3Password')
+        user4 = User.objects.create_user('testuser4', 'a@a.com', 'testuser4Password')
+        player3 = Player(user=user3, character=self.player1.character, currentSpace=self.player1.currentSpace)
+        player3.save()
+        player4 = Player(user=user4, character=self.player2.character, currentSpace=self.player2.currentSpace)
+        player4.save()
+        g2 = Game(name = "test", seed = 12345)
+        g2.initializeGame(player3)
+        g2.addPlayer(player3)
+        g2.addPlayer(player4)
+        g2.startGame(user3)
+
+        self.assertEqual(self.g.caseFile.compare(g2.caseFile), True)
+        for p1, p2 in ((self.player1, player3), (self.player2, player4)):
+            hand1 = set(SheetItem.objects.filter(detectiveSheet__player = p1, initiallyDealt = True).values_list('card_id', flat = True))
+            hand2 = set(SheetItem.objects.filter(detectiveSheet__player = p2, initiallyDealt = True).values_list('card_id', flat = True))
+            self.assertEqual(hand1, hand2)
+
+    def test_startGame_freezes_turn_order(self):
+        self.g.initializeGame(self.player1)
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+
+        self.assertEqual(self.g.seatOrder(), [self.player1.id, self.player2.id])
+        self.assertEqual(self.g.eliminatedMask, 0)
+
+    def test_nextPlayerId_wraps_and_costs_no_queries(self):
+        self.g.initializeGame(self.player1)
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.g.nextPlayerId(self.player1.id), self.player2.id)
+            self.assertEqual(self.g.nextPlayerId(self.player2.id), self.player1.id)
+
+    def test_nextPlayerId_skips_eliminated_players(self):
+        self.g.initializeGame(self.player1)
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+        #player2 is shared by every test in this class, so undo the loss afterwards
+        self.addCleanup(setattr, self.player2, 'gameResult', 0)
+        self.g.loseGame(self.player2)
+
+        self.assertEqual(self.g.nextPlayerId(self.player1.id), self.player1.id)
+        self.assertEqual(self.g.nextPlayerId(self.player1.id, False), self.player2.id)
+        self.assertEqual(self.g.activePlayerIds(), [self.player1.id])
+
     def test_unusedCharacters_returns_all_when_no_players(self):
         self.g.initializeGame(self.player1)
         self.g.save()
@@ -913,6 +1443,217 @@ class MoveModelTests(TestCase):
         self.assertEquals(self.player1.currentSpace.posY, 5)
 
 
+class OpenGameSummaryModelTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('summarytestuser1', 'a@a.com', 'password')
+        cls.user1.save()
+        cls.user2 = User.objects.create_user('summarytestuser2', 'a@a.com', 'password')
+        cls.user2.save()
+
+        cls.character1 = Character.objects.all()[0]
+        cls.character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=cls.character1, currentSpace=cls.character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=cls.character2, currentSpace=cls.character2.defaultSpace)
+        cls.player2.save()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.user1.delete()
+        cls.user2.delete()
+
+    def setUp(self):
+        self.g = Game(name = "summary test")
+        self.g.initializeGame(self.player1)
+
+    def tearDown(self):
+        Player.objects.filter(currentGame = self.g, nonUserPlayer = True).delete()
+        self.g.delete()
+
+    def test_initializeGame_creates_summary_with_every_character_free(self):
+        summary = OpenGameSummary.objects.get(game = self.g)
+        self.assertEqual(summary.name, "summary test")
+        self.assertEqual(summary.hostUsername, "summarytestuser1")
+        self.assertEqual(summary.playerCount, 0)
+        self.assertEqual(summary.openSeats(), 6)
+
+    def test_addPlayer_takes_the_characters_seat(self):
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        summary = OpenGameSummary.objects.get(game = self.g)
+        self.assertEqual(summary.playerCount, 2)
+        self.assertEqual(summary.openSeats(), 4)
+        self.assertFalse(summary.freeCharacters & characterBit(self.character1))
+        self.assertFalse(summary.freeCharacters & characterBit(self.character2))
+
+    def test_unusedCharacters_reads_only_the_summary(self):
+        self.g.addPlayer(self.player1)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.g.unusedCharacters().count(), 5)
+
+    def test_startGame_closes_every_seat(self):
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+        summary = OpenGameSummary.objects.get(game = self.g)
+        self.assertEqual(summary.status, 1)
+        self.assertEqual(summary.openSeats(), 0)
+
+    def test_endGame_removes_summary(self):
+        self.g.addPlayer(self.player1)
+        self.g.addPlayer(self.player2)
+        self.g.startGame(self.user1)
+        self.g.endGame(self.player1)
+        self.addCleanup(Player.objects.filter(id__in = [self.player1.id, self.player2.id]).update, gameResult = 0)
+        self.assertFalse(OpenGameSummary.objects.filter(game = self.g).exists())
+        self.assertEqual(self.g.unusedCharacters().count(), 0)
+
+    def test_rebuild_command_matches_maintained_summary(self):
+        self.g.addPlayer(self.player1)
+        expected = OpenGameSummary.objects.get(game = self.g)
+        OpenGameSummary.objects.filter(game = self.g).delete()
+        call_command('rebuild_open_game_summaries')
+        rebuilt = OpenGameSummary.objects.get(game = self.g)
+        self.assertEqual(rebuilt.playerCount, expected.playerCount)
+        self.assertEqual(rebuilt.freeCharacters, expected.freeCharacters)
+
+
+@unittest.skipIf(hints.numpy is None, "NumPy is not installed")
+class SuggestionHintTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.users = [User.objects.create_user('hinttestuser{}'.format(i), 'a@a.com', 'password') for i in range(0, 3)]
+        cls.players = list()
+        for user, character in zip(cls.users, Character.objects.all()[0:3]):
+            player = Player(user=user, character=character, currentSpace=character.defaultSpace)
+            player.save()
+            cls.players.append(player)
+
+        cls.game1 = Game(name = "hints")
+        cls.game1.initializeGame(cls.players[0])
+        for player in cls.players:
+            cls.game1.addPlayer(player)
+        cls.game1.startGame(cls.users[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        for user in cls.users:
+            user.delete()
+        for player in cls.players:
+            player.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.game1.refresh_from_db()
+        self.tables = getEngineTables()
+        self.adapter = GameStateAdapter(self.game1)
+        self.state = self.adapter.load()
+
+    def suggestInLounge(self):
+        self.state.move(Space.objects.get(posX=5, posY=1).id)
+        self.state.suggest(self.tables.deck.characters[2], self.tables.deck.weapons[3])
+        while self.state.revealingSeat is not None:
+            self.state.reveal(self.state.revealableCards()[0])
+        self.adapter.save()
+        self.game1.refresh_from_db()
+
+    def test_knowledge_matrix_follows_the_reveals(self):
+        self.suggestInLounge()
+        possible, seatIndex = hints.knowledgeMatrix(self.game1, self.players[0].id)
+        self.assertEqual(seatIndex, 0)
+        self.assertEqual(possible.shape, (4, len(self.tables.deck)))
+        for card in self.state.seats[0].hand:
+            self.assertEqual(list(possible[:, card]), [True, False, False, False])
+        for event in self.state.events:
+            if event[0] == "Reveal":
+                self.assertEqual(possible[:, event[2]].sum(), 1)
+                self.assertTrue(possible[event[1], event[2]])
+            if event[0] in ("Suggestion", "Reveal"):
+                suggested = [self.tables.deck.characters[2], self.tables.deck.rooms[2], self.tables.deck.weapons[3]]
+                for skippedSeat in event[3]:
+                    self.assertFalse(possible[skippedSeat, suggested].any())
+
+    def test_cards_in_hand_are_worth_nothing(self):
+        possible, seatIndex = hints.knowledgeMatrix(self.game1, self.players[0].id)
+        scores = hints.scoreSuggestions(possible, seatIndex, self.tables.deck)
+        deck = self.tables.deck
+        self.assertEqual(scores.shape, (len(deck.characters), len(deck.rooms), len(deck.weapons)))
+        hand = self.state.seats[0].hand
+        mine = [sorted(hand.intersection(cards)) for cards in (deck.characters, deck.rooms, deck.weapons)]
+        if all(mine):
+            i, j, k = deck.characters.index(mine[0][0]), deck.rooms.index(mine[1][0]), deck.weapons.index(mine[2][0])
+            self.assertAlmostEqual(scores[i, j, k], 0.0)
+        self.assertGreater(scores.max(), 0.0)
+
+    def test_ranking_is_cached_per_game_update(self):
+        lounge = getCatalog().roomForSpace(Space.objects.get(posX=5, posY=1).id)
+        ranking = hints.suggestionRanking(self.game1, self.players[0], lounge)
+        deck = self.tables.deck
+        self.assertEqual(len(ranking), len(deck.characters) * len(deck.weapons))
+        self.assertEqual(ranking, sorted(ranking, key = lambda s: -s['score']))
+        with self.assertNumQueries(0):
+            self.assertEqual(hints.suggestionRanking(self.game1, self.players[0], lounge), ranking)
+
+    def test_suggestion_form_shows_the_ranking(self):
+        Player.objects.filter(id = self.players[0].id).update(currentSpace = Space.objects.get(posX=5, posY=1))
+        c = Client()
+        c.force_login(self.users[0])
+        response = c.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {'player_move': 'makeSuggestion'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['suggestionRanking']), 5)
+        self.assertContains(response, "most likely to narrow it down")
+
+
+class SuggestionHintFallbackTests(TestCase):
+    """
+    The suggestion form without NumPy, as when an install leaves it out
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('hintfallbacktestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('hintfallbacktestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "no hints")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        #in the lounge, so a suggestion can be made
+        cls.player1.currentSpace = Space.objects.get(posX=5, posY=1)
+        cls.player1.save()
+        cls.numpy = hints.numpy
+        hints.numpy = None
+
+    @classmethod
+    def tearDownClass(cls):
+        hints.numpy = cls.numpy
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def test_suggestion_form_without_ranking(self):
+        lounge = getCatalog().roomForSpace(self.player1.currentSpace_id)
+        self.assertIsNone(hints.suggestionRanking(self.game1, self.player1, lounge))
+        c = Client()
+        c.force_login(self.user1)
+        response = c.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {'player_move': 'makeSuggestion'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['suggestionRanking'])
+        self.assertNotContains(response, "most likely to narrow it down")
+
+
 class SuggestionModelTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -995,6 +1736,28 @@ class SuggestionModelTests(TestCase):
         movedPlayer = Player.objects.get(currentGame=self.game1, character=character)
         self.assertEqual(movedPlayer.currentSpace, self.player1.currentSpace)
 
+    def test_startNextReveal_starts_reveal_for_holder(self):
+        turn = self.game1.currentTurn
+        heldCard = self.player2.getDetectiveSheet().getCharacterSheetItems().filter(initiallyDealt = True)[0].card
+        character = Character.objects.get(card_id = heldCard.card_id)
+        caseFile = self.game1.caseFile
+
+        newSuggestion = Suggestion.createSuggestion(turn, character, caseFile.room, caseFile.weapon)
+        cr = CardReveal.startNextReveal(newSuggestion, self.player1.id)
+        self.assertEqual(cr.revealingPlayer, self.player2)
+        self.assertEqual(CardReveal.objects.filter(suggestion = newSuggestion).count(), 1)
+
+    def test_startNextReveal_skips_players_without_cards(self):
+        turn = self.game1.currentTurn
+        caseFile = self.game1.caseFile
+        sequence = Game.objects.get(id = self.game1.id).currentSequence
+
+        newSuggestion = Suggestion.createSuggestion(turn, caseFile.character, caseFile.room, caseFile.weapon)
+        self.assertIsNone(CardReveal.startNextReveal(newSuggestion, self.player1.id))
+        self.assertEqual(CardReveal.objects.filter(suggestion = newSuggestion).count(), 0)
+        self.assertEqual(GameStreamEntry.objects.filter(game = self.game1, addedAtGameSequence = sequence,
+                                                        description__contains = "did not reveal").count(), 1)
+
 
 class AccusationModelTests(TestCase):
     @classmethod
@@ -1135,6 +1898,7 @@ class TurnModelTests(TestCase):
         www.save()
         prevAccusation = Accusation(turn=turn, whoWhatWhere=www)
         prevAccusation.save()
+        turn.recordAction(prevAccusation.actionName)
         newAccusation = Accusation(turn=turn, whoWhatWhere=www)
         newAccusation.save()
         self.assertIsNotNone(turn.takeAction(newAccusation))
@@ -1161,6 +1925,7 @@ class TurnModelTests(TestCase):
         www.save()
         prevAccusation = Accusation(turn=turn, whoWhatWhere=www)
         prevAccusation.save()
+        turn.recordAction(prevAccusation.actionName)
         newSuggestion = Suggestion.createSuggestion(turn, www.character, www.room, www.weapon)
         self.assertIsNotNone(turn.takeAction(newSuggestion))
 
@@ -1173,6 +1938,7 @@ class TurnModelTests(TestCase):
         )
         www.save()
         prevSuggestion = Suggestion.createSuggestion(turn, www.character, www.room, www.weapon)
+        turn.recordAction(prevSuggestion.actionName)
         newSuggestion = Suggestion.createSuggestion(turn, www.character, www.room, www.weapon)
         self.assertIsNotNone(turn.takeAction(newSuggestion))
 
@@ -1195,6 +1961,7 @@ class TurnModelTests(TestCase):
         www.save()
         prevAccusation = Accusation(turn=turn, whoWhatWhere=www)
         prevAccusation.save()
+        turn.recordAction(prevAccusation.actionName)
         newMove = Move(turn=turn, fromSpace=self.player1.currentSpace, toSpace=Space.objects.get(posX=5, posY=2))
         newMove.save()
         self.assertIsNotNone(turn.takeAction(newMove))
@@ -1208,6 +1975,7 @@ class TurnModelTests(TestCase):
         )
         www.save()
         newSuggestion = Suggestion.createSuggestion(turn, www.character, www.room, www.weapon)
+        turn.recordAction(newSuggestion.actionName)
         newMove = Move(turn=turn, fromSpace=self.player1.currentSpace, toSpace=Space.objects.get(posX=5, posY=2))
         newMove.save()
         self.assertIsNotNone(turn.takeAction(newMove))
@@ -1227,6 +1995,14 @@ class TurnModelTests(TestCase):
         newMove.save()
         self.assertIsNone(turn.takeAction(newMove))
 
+    def test_saving_action_leaves_phase(self):
+        turn = self.game1.currentTurn
+        newMove = Move(turn=turn, fromSpace=self.player1.currentSpace, toSpace=Space.objects.get(posX=4, posY=1))
+        newMove.save()
+        self.assertEqual(Turn.objects.get(id=turn.id).phase, TURN_START)
+        self.assertIsNone(turn.takeAction(newMove))
+        self.assertEqual(Turn.objects.get(id=turn.id).phase, TURN_MOVED)
+
     def test_takeAction_performs_valid_action(self):
         turn = self.game1.currentTurn
         character = Character.objects.all()[0]
@@ -1239,6 +2015,60 @@ class TurnModelTests(TestCase):
         self.assertEqual(movedPlayer.currentSpace, self.player1.currentSpace)
 
 
+class TurnPhaseTests(TestCase):
+    """
+    Checks the turn phase transition table against the rules as they were written before turns had a phase, when
+    every check counted the Move, Suggestion and Accusation rows of the turn
+    """
+    @staticmethod
+    def countedValidate(actions, actionName):
+        #counts include the action being validated, which is saved before it is taken
+        counts = dict((name, actions.count(name)) for name in ("Move", "Suggestion", "Accusation"))
+        counts[actionName] += 1
+        if actionName == "Accusation":
+            return counts["Accusation"] <= 1
+        elif actionName == "Suggestion":
+            return counts["Suggestion"] <= 1 and counts["Accusation"] == 0
+        return len(actions) + 1 <= 1
+
+    @staticmethod
+    def countedAvailableActions(actions, inRoom):
+        validActions = list()
+        if len(actions) == 0:
+            validActions.append("Move")
+        if "Suggestion" not in actions and "Accusation" not in actions and inRoom:
+            validActions.append("Suggestion")
+        if "Accusation" not in actions:
+            validActions.append("Accusation")
+        if "Move" in actions or inRoom:
+            validActions.append("EndTurn")
+        return validActions
+
+    def test_transitions_match_counted_rules(self):
+        names = ("Move", "Suggestion", "Accusation")
+        #every sequence of up to four actions, each one recorded whether it was allowed or not
+        sequences = [[]]
+        for length in range(0, 4):
+            sequences += [seq + [name] for seq in sequences if len(seq) == length for name in names]
+
+        for seq in sequences:
+            phase = TURN_START
+            recorded = list()
+            for actionName in seq:
+                allowed = (phase, actionName) in TURN_PHASE_TRANSITIONS
+                self.assertEqual(allowed, self.countedValidate(recorded, actionName), seq)
+                if allowed:
+                    phase = TURN_PHASE_TRANSITIONS[(phase, actionName)]
+                    recorded.append(actionName)
+                    for inRoom in (True, False):
+                        self.assertEqual(availableTurnActions(phase, inRoom),
+                                         self.countedAvailableActions(recorded, inRoom), seq)
+
+    def test_start_of_turn_actions(self):
+        self.assertEqual(availableTurnActions(TURN_START, True), ["Move", "Suggestion", "Accusation", "EndTurn"])
+        self.assertEqual(availableTurnActions(TURN_START, False), ["Move", "Accusation"])
+
+
 class WhoWhatWhereModelTests(TestCase):
 
     def test_compare_true_when_equal(self):
@@ -1533,6 +2363,146 @@ class GameStateViewTest(TestCase):
         self.assertIn('gamestate', responseJSON.keys())
 
 
+class LobbyViewTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #get client
+        cls.c = Client()
+        #build users
+        cls.user1 = User.objects.create_user('lobbytestuser1', 'a@a.com', 'password')
+        cls.user1.save()
+        cls.user2 = User.objects.create_user('lobbytestuser2', 'a@a.com', 'password')
+        cls.user2.save()
+        cls.user3 = User.objects.create_user('lobbytestuser3', 'a@a.com', 'password')
+        cls.user3.save()
+
+        #build some players
+        cls.characters = Character.objects.all()
+        cls.player1 = Player(user=cls.user1, character=cls.characters[0], currentSpace=cls.characters[0].defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=cls.characters[1], currentSpace=cls.characters[1].defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name="lobby game")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+
+        cls.lobbyUrl = reverse('lobby')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.c = None
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.user3.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def createHostedGames(self, count):
+        """
+        Creates games hosted by user3, deleted again after the test
+        :return: list of game ids, oldest first
+        """
+        gameIds = list()
+        for i in range(0, count):
+            host = Player(user=self.user3, character=self.characters[0], currentSpace=self.characters[0].defaultSpace)
+            host.save()
+            game = Game(name="lobby page game {}".format(i))
+            game.initializeGame(host)
+            game.addPlayer(host)
+            self.addCleanup(host.delete)
+            gameIds.append(game.id)
+        return gameIds
+
+    def test_user_must_be_logged_in(self):
+        self.c.logout()
+        response = self.c.get(self.lobbyUrl)
+        self.assertEqual(response.status_code, 302)
+
+    def test_lobby_lists_users_games_and_open_games(self):
+        self.c.force_login(self.user1)
+        response = self.c.get(self.lobbyUrl)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.game1.id, [g['id'] for g in response.context['currentGames']])
+        self.assertNotIn(self.game1.id, [g['id'] for g in response.context['openGames']])
+        self.assertContains(response, "lobbytestuser1")
+
+        self.c.force_login(self.user3)
+        response = self.c.get(self.lobbyUrl)
+        self.assertIn(self.game1.id, [g['id'] for g in response.context['openGames']])
+
+    def test_summary_counts_players_and_open_seats(self):
+        currentGames, openGames, nextCursor = lobbyGames(self.user1)
+        summary = [g for g in currentGames if g['id'] == self.game1.id][0]
+        self.assertEqual(summary['hostUsername'], "lobbytestuser1")
+        self.assertEqual(summary['playerCount'], 2)
+        self.assertEqual(summary['openSeats'], len(getCatalog().characters) - 2)
+        self.assertEqual(summary['statusDisplay'], "Not Started")
+
+    def test_current_games_show_their_last_update(self):
+        game = Game.objects.get(id=self.game1.id)
+        game.registerGameUpdate("played on")
+        self.addCleanup(GameStreamEntry.objects.filter(game=game).delete)
+        invalidateLobby()
+        currentGames = lobbyGames(self.user1)[0]
+        summary = [g for g in currentGames if g['id'] == self.game1.id][0]
+        self.assertEqual(summary['lastUpdateTime'], game.lastUpdateTime)
+        self.assertNotEqual(summary['lastUpdateTime'], OpenGameSummary.objects.get(game=game).lastUpdateTime)
+
+    def test_lobby_query_count_does_not_grow_with_games(self):
+        self.createHostedGames(3)
+        getCatalog()
+        invalidateLobby()
+        with self.assertNumQueries(2):
+            lobbyGames(self.user1)
+
+    def test_cached_page_is_dropped_when_a_player_joins(self):
+        gameId = self.createHostedGames(1)[0]
+        openGames = lobbyGames(self.user1)[1]
+        self.assertEqual([g['playerCount'] for g in openGames if g['id'] == gameId], [1])
+
+        player = Player(user=self.user2, character=self.characters[1], currentSpace=self.characters[1].defaultSpace)
+        player.save()
+        self.addCleanup(player.delete)
+        Game.objects.get(id=gameId).addPlayer(player)
+
+        openGames = lobbyGames(self.user1)[1]
+        self.assertEqual([g['playerCount'] for g in openGames if g['id'] == gameId], [2])
+
+    def test_pages_walk_every_game_once_newest_first(self):
+        gameIds = self.createHostedGames(5)
+        #give several games the same update time so the id tie break is exercised
+        OpenGameSummary.objects.filter(game_id__in=gameIds[1:4]).update(
+            lastUpdateTime=OpenGameSummary.objects.get(game_id=gameIds[1]).lastUpdateTime)
+
+        pageSize = lobby.LOBBY_PAGE_SIZE
+        lobby.LOBBY_PAGE_SIZE = 2
+        self.addCleanup(setattr, lobby, 'LOBBY_PAGE_SIZE', pageSize)
+        invalidateLobby()
+
+        seen = list()
+        cursor = None
+        while True:
+            currentGames, openGames, cursor = lobbyGames(self.user1, cursor)
+            self.assertLessEqual(len(openGames), 2)
+            seen.extend(g['id'] for g in openGames)
+            if cursor is None:
+                break
+        ours = [gameId for gameId in seen if gameId in gameIds]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(ours), sorted(gameIds))
+        self.assertEqual(ours, [gameIds[4], gameIds[3], gameIds[2], gameIds[1], gameIds[0]])
+
+    def test_malformed_cursor_shows_first_page(self):
+        self.c.force_login(self.user3)
+        response = self.c.get(self.lobbyUrl, {'after': 'not a cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.game1.id, [g['id'] for g in response.context['openGames']])
+
+
 class ManualSheetItemCheckViewTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -2104,4 +3074,1203 @@ class MakeAccusationControllerTest(TestCase):
                                      'weapon_id': self.goodWeapon.card_id})
         self.game1.refresh_from_db()
         self.assertNotEqual(currentTurn, self.game1.currentTurn)
-        self.assertEqual(self.game1.currentTurn.player, self.player2)
\ No newline at end of file
+        self.assertEqual(self.game1.currentTurn.player, self.player2)
+
+class QueryBudgetTests(TestCase):
+    """
+    Drives every game endpoint at fixed fixture sizes and fails when one issues more SQL statements than its budget
+    in query_budgets.json.  Run with CLUELESS_RECORD_QUERY_BUDGETS=1 to write the measured counts and wall times as
+    the new baseline
+    """
+    BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_budgets.json")
+    PLAYERS = 3
+    LOBBY_GAMES = 30
+    SEED = 20170501
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recording = bool(os.environ.get("CLUELESS_RECORD_QUERY_BUDGETS"))
+        with open(cls.BASELINE_PATH) as f:
+            cls.baseline = json.load(f)
+        cls.measured = dict()
+
+        cls.users = [User.objects.create_user('budgettestuser{}'.format(i), 'a@a.com', 'password')
+                     for i in range(0, cls.PLAYERS + 1)]
+        cls.players = list()
+        for user, character in zip(cls.users, Character.objects.order_by('card_id')[0:cls.PLAYERS]):
+            player = Player(user=user, character=character, currentSpace=character.defaultSpace)
+            player.save()
+            cls.players.append(player)
+        cls.game1 = Game(name = "budget", seed = cls.SEED)
+        cls.game1.initializeGame(cls.players[0])
+        for player in cls.players:
+            cls.game1.addPlayer(player)
+        cls.game1.startGame(cls.users[0])
+
+        #open games for the lobby, hosted by a user outside game1
+        cls.lobbyPlayers = list()
+        cls.lobbyGames = list()
+        character = Character.objects.order_by('card_id')[0]
+        for i in range(0, cls.LOBBY_GAMES):
+            host = Player(user=cls.users[-1], character=character, currentSpace=character.defaultSpace)
+            host.save()
+            game = Game(name = "budget lobby {}".format(i))
+            game.initializeGame(host)
+            game.addPlayer(host)
+            cls.lobbyPlayers.append(host)
+            cls.lobbyGames.append(game)
+
+    @classmethod
+    def tearDownClass(cls):
+        for user in cls.users:
+            user.delete()
+        for player in cls.players + cls.lobbyPlayers:
+            player.delete()
+        for game in [cls.game1] + cls.lobbyGames:
+            game.delete()
+        if cls.recording:
+            for name, (queries, seconds) in cls.measured.items():
+                cls.baseline[name] = {'queries': queries, 'budget': queries, 'ms': round(seconds * 1000, 1)}
+            with open(cls.BASELINE_PATH, 'w') as f:
+                json.dump(cls.baseline, f, indent = 2, sort_keys = True)
+                f.write("\n")
+
+    def setUp(self):
+        self.game1.refresh_from_db()
+        #fetches left waiting by earlier tests would be written by a measured poll
+        ActionTiming.flushFetches()
+        #warm the process wide caches, so only the view's own queries are counted
+        getCatalog()
+        getEngineTables()
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.users[0])
+        self.lounge = Space.objects.get(posX=5, posY=1)
+
+    def measure(self, name, url, data = None, client = None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            response = client.post(url, data) if data is not None else client.get(url)
+            elapsed = time.time() - start
+        self.assertLess(response.status_code, 400, response.content[:200])
+        self.measured[name] = (len(queries), elapsed)
+        if not self.recording:
+            self.assertIn(name, self.baseline, "No query budget for {}, record a baseline".format(name))
+            self.assertLessEqual(len(queries), self.baseline[name]['budget'],
+                                 "{} went over its query budget:\n{}".format(
+                                     name, "\n".join(q['sql'] for q in queries.captured_queries)))
+        return response
+
+    def moveHostToLounge(self):
+        Player.objects.filter(id = self.players[0].id).update(currentSpace = self.lounge)
+
+    def test_gamestate(self):
+        GameStreamEntry.objects.bulk_create([GameStreamEntry(description = "entry {}".format(i), game = self.game1,
+                                                             addedAtGameSequence = 0) for i in range(0, 20)])
+        self.measure('gamestate', reverse('gamestate'), {
+            'game_id': self.game1.id, 'player_id': self.players[0].id, 'cached_game_seq': 0})
+
+    def test_playerturn(self):
+        self.measure('playerturn', reverse('playerturn', kwargs = {'game_id': self.game1.id}))
+
+    def test_playerturn_make_accusation(self):
+        self.measure('playerturn.makeAccusation', reverse('playerturn', kwargs = {'game_id': self.game1.id}),
+                     {'player_move': 'makeAccusation'})
+
+    def test_playerturn_make_suggestion(self):
+        self.moveHostToLounge()
+        self.measure('playerturn.makeSuggestion', reverse('playerturn', kwargs = {'game_id': self.game1.id}),
+                     {'player_move': 'makeSuggestion'})
+
+    def test_playerturn_move_space(self):
+        self.measure('playerturn.moveSpace', reverse('playerturn', kwargs = {'game_id': self.game1.id}),
+                     {'player_move': 'moveSpace', 'new_position': self.lounge.spaceCollector_id})
+
+    def test_playerturn_end_turn(self):
+        self.client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}),
+                         {'player_move': 'moveSpace', 'new_position': self.lounge.spaceCollector_id})
+        self.measure('playerturn.endTurn', reverse('playerturn', kwargs = {'game_id': self.game1.id}),
+                     {'player_move': 'endTurn'})
+
+    def test_playerlist(self):
+        self.measure('playerlist', reverse('playerlist', kwargs = {
+            'game_id': self.game1.id, 'player_id': self.players[0].id}))
+
+    def test_detectivesheet(self):
+        self.measure('detectivesheet', reverse('detectivesheet', kwargs = {
+            'game_id': self.game1.id, 'player_id': self.players[0].id}))
+
+    def suggestion(self):
+        catalog = getCatalog()
+        return {'suspect_id': catalog.characters[1].card_id, 'room_id': catalog.roomForSpace(self.lounge.id).card_id,
+                'weapon_id': catalog.weapons[1].card_id}
+
+    def test_make_suggestion_controller(self):
+        self.moveHostToLounge()
+        self.measure('make_suggestion_controller', reverse('make_suggestion_controller', kwargs = {
+            'game_id': self.game1.id, 'player_id': self.players[0].id}), self.suggestion())
+
+    def test_card_reveal_controller(self):
+        self.moveHostToLounge()
+        self.client.post(reverse('make_suggestion_controller', kwargs = {
+            'game_id': self.game1.id, 'player_id': self.players[0].id}), self.suggestion())
+        cardReveal = CardReveal.objects.get(suggestion__turn__game = self.game1, status = 1)
+        revealer = Client()
+        revealer.force_login(cardReveal.revealingPlayer.user)
+        self.measure('card_reveal_controller', reverse('card_reveal_controller', kwargs = {
+            'game_id': self.game1.id, 'player_id': cardReveal.revealingPlayer_id}),
+            {'card_id': cardReveal.potentialCards()[0].card_id}, revealer)
+
+    def test_make_accusation_controller(self):
+        caseFile = self.game1.caseFile
+        catalog = getCatalog()
+        wrongWeapon = [w for w in catalog.weapons if w.card_id != caseFile.weapon_id][0]
+        self.measure('make_accusation_controller', reverse('make_accusation_controller', kwargs = {
+            'game_id': self.game1.id, 'player_id': self.players[0].id}), {
+            'suspect_id': caseFile.character_id, 'room_id': catalog.roomByPk(caseFile.room_id).card_id,
+            'weapon_id': wrongWeapon.card_id})
+
+    def test_lobby(self):
+        self.measure('lobby', reverse('lobby'))
+
+
+class ReplayGameCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('replaytestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('replaytestuser2', 'a@a.com', 'password')
+
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "replayed")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+        #player 1 moves out of the hallway and ends the turn
+        turn = cls.game1.currentTurn
+        move = Move(turn = turn, fromSpace = cls.player1.currentSpace, toSpace = Space.objects.get(posX=5, posY=1))
+        move.save()
+        turn.takeAction(move)
+        turn.endTurn()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def test_replay_runs_and_cleans_up(self):
+        gameCount = Game.objects.count()
+        call_command('replay_game', self.game1.id, repeat = 2)
+        self.assertEqual(Game.objects.count(), gameCount)
+
+    def test_replay_keep_reproduces_moves(self):
+        call_command('replay_game', self.game1.id, keep = True)
+        replay = Game.objects.exclude(id = self.game1.id).get(seed = self.game1.seed, name = "replay of {}".format(self.game1.id))
+        self.assertEqual(replay.caseFile.compare(self.game1.caseFile), True)
+        self.assertEqual(Player.objects.get(currentGame = replay, user = self.user1).currentSpace, Space.objects.get(posX=5, posY=1))
+        self.assertEqual(replay.currentTurn.player.user, self.user2)
+
+
+class ArchiveGamesCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('archivetestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('archivetestuser2', 'a@a.com', 'password')
+
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "archived")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+        #player 1 moves, suggests and ends the turn, then player 2 wins
+        turn = cls.game1.currentTurn
+        move = Move(turn = turn, fromSpace = cls.player1.currentSpace, toSpace = Space.objects.get(posX=5, posY=1))
+        move.save()
+        turn.takeAction(move)
+        www = WhoWhatWhere(character = character2, room = Room.objects.all()[0], weapon = Weapon.objects.all()[0])
+        www.save()
+        suggestion = Suggestion(turn = turn, whoWhatWhere = www)
+        suggestion.save()
+        CardReveal(suggestion = suggestion, revealingPlayer = cls.player2, status = 2).save()
+        turn.endTurn()
+        cls.game1.refresh_from_db()
+        cls.game1.endGame(cls.player2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.game1.refresh_from_db()
+
+    def test_archive_and_rehydrate_round_trip(self):
+        before = list(archiveRecords(self.game1))
+        currentTurnId = self.game1.currentTurn_id
+        finalState = GameStateAdapter(self.game1).load()
+
+        archive = archiveGame(self.game1, batchSize = 7)
+        self.assertEqual(archive.rowCount, len(before))
+        #the final state can be read without rehydrating
+        self.assertEqual(event_log.stateDifferences(archivedState(self.game1), finalState), [])
+        self.assertEqual(Turn.objects.filter(game = self.game1).count(), 0)
+        self.assertEqual(SheetItem.objects.filter(detectiveSheet__game = self.game1).count(), 0)
+        self.assertEqual(GameStreamEntry.objects.filter(game = self.game1).count(), 0)
+        self.assertEqual(CardReveal.objects.filter(suggestion__turn__game = self.game1).count(), 0)
+        #the case file is not part of the archive
+        self.assertTrue(CaseFile.objects.filter(id = self.game1.caseFile_id).exists())
+
+        self.assertTrue(rehydrateGame(self.game1))
+        self.assertEqual(list(archiveRecords(self.game1)), before)
+        self.game1.refresh_from_db()
+        self.assertEqual(self.game1.currentTurn_id, currentTurnId)
+        self.assertFalse(rehydrateGame(self.game1))
+
+    def test_unfinished_game_cannot_be_archived(self):
+        self.game1.status = 1
+        self.assertRaises(RuntimeError, archiveGame, self.game1)
+
+    def test_command_only_archives_old_games(self):
+        call_command('archive_games', days = 1)
+        self.assertFalse(GameArchive.objects.filter(game = self.game1).exists())
+
+        Game.objects.filter(id = self.game1.id).update(lastUpdateTime = timezone.now() - datetime.timedelta(days = 2))
+        call_command('archive_games', days = 1)
+        self.assertTrue(GameArchive.objects.filter(game = self.game1).exists())
+
+        call_command('archive_games', rehydrate = self.game1.id)
+        self.assertFalse(GameArchive.objects.filter(game = self.game1).exists())
+        self.assertTrue(Turn.objects.filter(game = self.game1).exists())
+
+    def test_opening_archived_game_rehydrates_it(self):
+        archiveGame(self.game1)
+        c = Client()
+        c.force_login(self.user1)
+        response = c.get(reverse('playgame', kwargs = {'game_id': self.game1.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Turn.objects.filter(game = self.game1).exists())
+
+    def test_polling_archived_game_rehydrates_it(self):
+        archiveGame(self.game1)
+        c = Client()
+        c.force_login(self.user1)
+        response = c.post(reverse('gamestate'), {'game_id': self.game1.id, 'player_id': self.player1.id,
+                                                 'cached_game_seq': -1})
+        self.assertEqual(response.status_code, 200)
+        gamestate = json.loads(response.content.decode('utf-8'))['gamestate']
+        self.assertEqual(gamestate['status'], COMPLETE)
+        self.assertFalse(GameArchive.objects.filter(game = self.game1).exists())
+
+    def test_game_pages_of_archived_game(self):
+        for name, kwargs in (('playerturn', {'game_id': self.game1.id}),
+                             ('playerlist', {'game_id': self.game1.id, 'player_id': self.player1.id}),
+                             ('detectivesheet', {'game_id': self.game1.id, 'player_id': self.player1.id})):
+            self.game1.refresh_from_db()
+            archiveGame(self.game1)
+            c = Client()
+            c.force_login(self.user1)
+            response = c.get(reverse(name, kwargs = kwargs))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertFalse(GameArchive.objects.filter(game = self.game1).exists(), name)
+
+
+class SimulateGamesCommandTest(TestCase):
+
+    def test_results_do_not_depend_on_the_number_of_processes(self):
+        strategies = ["detective", "random", "reckless"]
+        inProcess = runSimulation(strategies, 30, runSeed = 5, processes = 1, chunkSize = 7)
+        pooled = runSimulation(strategies, 30, runSeed = 5, processes = 2, chunkSize = 7)
+        self.assertEqual(inProcess, pooled)
+        self.assertEqual(inProcess['games'], 30)
+        self.assertEqual(sum(inProcess['seatWins']) + inProcess['stalled'], 30)
+        self.assertEqual(sum(inProcess['turnHistogram'].values()), 30)
+
+    def test_command_writes_result_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command('simulate_games', 'detective', 'detective', games = 10, processes = 1, output = path)
+            with open(path) as f:
+                result = json.load(f)
+        self.assertEqual(result['games'], 10)
+        self.assertEqual(result['strategies'], ["detective", "detective"])
+        self.assertIn('averageTurns', result)
+
+
+class RunTournamentCommandTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.results = os.path.join(self.directory.name, "tournament.jsonl")
+        self.checkpoint = self.results + ".checkpoint"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_robin_covers_every_mixed_table(self):
+        tables = tournament.scheduleTables(["random", "detective", "reckless"], [2, 3])
+        self.assertEqual(len(tables), 3 + 7)
+        self.assertTrue(all(len(set(seating)) > 1 for seating in tables))
+
+    def test_interrupted_tournament_resumes_without_duplicates(self):
+        def interrupt(done, total):
+            if done == 2:
+                raise KeyboardInterrupt()
+
+        args = (["random", "detective"], [2, 3], 6, self.results, self.checkpoint)
+        options = {'runSeed': 3, 'processes': 1, 'shardSize': 2, 'batchSize': 1}
+        self.assertRaises(KeyboardInterrupt, tournament.runTournament, *args, progress = interrupt, **options)
+        self.assertEqual(len(tournament.readResults(self.results)), 4)
+
+        ranking = tournament.runTournament(*args, **options)
+        games = [(r['table'], r['game']) for r in tournament.readResults(self.results)]
+        #one table of 2 and two tables of 3
+        self.assertEqual(sorted(games), sorted(set(games)))
+        self.assertEqual(len(games), 3 * 6)
+
+        os.remove(self.checkpoint)
+        fresh = os.path.join(self.directory.name, "fresh.jsonl")
+        self.assertEqual(tournament.runTournament(["random", "detective"], [2, 3], 6, fresh, fresh + ".checkpoint",
+                                                  **options), ranking)
+
+    def test_checkpoint_of_another_tournament_is_refused(self):
+        tournament.runTournament(["random", "detective"], [2], 2, self.results, self.checkpoint, processes = 1)
+        self.assertRaises(RuntimeError, tournament.runTournament, ["random", "reckless"], [2], 2, self.results,
+                          self.checkpoint, processes = 1)
+
+    def test_command_writes_ranking(self):
+        ranking = os.path.join(self.directory.name, "ranking.json")
+        call_command('run_tournament', 'random', 'detective', seats = [2], games = 20, processes = 2,
+                     results = self.results, ranking = ranking)
+        with open(ranking) as f:
+            standings = json.load(f)
+        self.assertEqual([s['strategy'] for s in standings], ["detective", "random"])
+        self.assertEqual(sum(s['games'] for s in standings), 40)
+
+
+class LoadTestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.loadTest = loadtest.LoadTest(1, 3, thinkTime = 0, seed = 7)
+        cls.loadTest.setUp()
+        cls.game1 = cls.loadTest.games[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loadTest.tearDown()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 0.5), 50)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99)
+        self.assertEqual(loadtest.percentile([3], 0.95), 3)
+
+    def test_recorder_summary(self):
+        recorder = loadtest.LatencyRecorder()
+        for ms in range(1, 11):
+            recorder.record('gamestate', ms / 1000.0, 200)
+        recorder.record('gamestate', 0.5, 422)
+        summary = recorder.summary(2.0)['gamestate']
+        self.assertEqual(summary['requests'], 11)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['perSecond'], 5.5)
+        self.assertEqual(summary['p50'], 6.0)
+        self.assertEqual(summary['max'], 500.0)
+
+    def playGame(self, loadTest, game):
+        clients = dict()
+        for player in Player.objects.filter(currentGame = game, user__isnull = False).select_related('user'):
+            clients[player.id] = Client()
+            clients[player.id].force_login(player.user)
+        bots = dict()
+        decided = set()
+        for i in range(0, loadtest.MAX_GAME_REQUESTS):
+            if not loadTest.playStep(Game.objects.get(id = game.id), clients, bots, decided):
+                return i
+        return loadtest.MAX_GAME_REQUESTS
+
+    def test_games_are_played_through_the_views(self):
+        self.playGame(self.loadTest, self.game1)
+        self.assertEqual(Game.objects.get(id = self.game1.id).status, 2)
+        summary = self.loadTest.recorder.summary(1.0)
+        self.assertIn('playerturn.endTurn', summary)
+        self.assertEqual(sum(s['errors'] for s in summary.values()), 0)
+
+    def test_detectives_finish_their_games(self):
+        #seeds where the detectives used to forget the suggestions nobody disproved, and never accused
+        for seed in (0, 1, 5, 8):
+            loadTest = loadtest.LoadTest(1, 3, thinkTime = 0, seed = seed)
+            loadTest.setUp()
+            try:
+                game = loadTest.games[0]
+                self.assertLess(self.playGame(loadTest, game), loadtest.MAX_GAME_REQUESTS, seed)
+                self.assertEqual(Game.objects.get(id = game.id).status, 2, seed)
+            finally:
+                loadTest.tearDown()
+
+    def test_unknown_strategy_is_refused(self):
+        self.assertRaises(CommandError, call_command, 'loadtest', strategy = 'nobody')
+
+
+class RequestTraceTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('tracetestuser1', 'tracer@example.com', 'password')
+        cls.user2 = User.objects.create_user('tracetestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "traced")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.trace = os.path.join(self.directory.name, "trace.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def recordTurn(self):
+        with override_settings(CLUELESS_TRACE_FILE = self.trace):
+            client = Client()
+            client.force_login(self.user1)
+            client.post(reverse('gamestate'), {'game_id': self.game1.id, 'player_id': self.player1.id,
+                                               'cached_game_seq': -1})
+            client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {
+                'player_move': 'moveSpace', 'new_position': Space.objects.get(posX=5, posY=1).spaceCollector_id})
+            client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {'player_move': 'endTurn'})
+            client.get(reverse('lobby'))
+
+    def test_no_trace_without_the_setting(self):
+        client = Client()
+        client.force_login(self.user1)
+        client.get(reverse('lobby'))
+        self.assertFalse(os.path.exists(self.trace))
+
+    def test_trace_is_anonymised(self):
+        self.recordTurn()
+        games, requests = traces.readTrace(self.trace)
+        self.assertEqual(list(games), [self.game1.id])
+        self.assertEqual([p['player'] for p in games[self.game1.id]['players']], self.game1.seatOrder())
+        self.assertEqual([traces.endpointName(r['urlName'], r['method'], r['params']) for r in requests],
+                         ['gamestate', 'playerturn.moveSpace', 'playerturn.endTurn', 'lobby'])
+        with open(self.trace) as f:
+            content = f.read()
+        self.assertNotIn('tracetestuser1', content)
+        self.assertNotIn('tracer@example.com', content)
+        self.assertEqual(requests[0]['user'], traces.userAlias(self.user1.id))
+
+    def test_replay_rebuilds_the_game_and_cleans_up(self):
+        self.recordTurn()
+        gameCount = Game.objects.count()
+        userCount = User.objects.count()
+        replay = traces.TraceReplay(self.trace)
+        replay.setUp()
+        try:
+            elapsed, summary, traced = replay.run(0)
+        finally:
+            replay.tearDown()
+        self.assertEqual(replay.skipped, 0)
+        self.assertEqual(sorted(summary), sorted(traced))
+        self.assertEqual(sum(s['errors'] for s in summary.values()), 0)
+        self.assertEqual(Game.objects.count(), gameCount)
+        self.assertEqual(User.objects.count(), userCount)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('profiletestuser1', 'a@a.com', 'password')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = Client()
+        self.client.force_login(self.user1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def dumps(self):
+        return sorted(f for f in os.listdir(self.directory.name) if f.endswith(".pstats"))
+
+    def test_only_signed_requests_are_profiled_without_sampling(self):
+        with override_settings(CLUELESS_PROFILE_DIR = self.directory.name, CLUELESS_PROFILE_SAMPLE_RATE = 0.0):
+            self.client.get(reverse('lobby'))
+            self.client.get(reverse('lobby'), HTTP_X_CLUELESS_PROFILE = "forged")
+            self.assertEqual(self.dumps(), [])
+            self.client.get(reverse('lobby'), HTTP_X_CLUELESS_PROFILE = profileHeaderValue())
+        dumps = self.dumps()
+        self.assertEqual(len(dumps), 1)
+        self.assertIn("-lobby-nogame-", dumps[0])
+
+    def test_posted_values_are_kept_out_of_the_file_name(self):
+        user2 = User.objects.create_user('profiletestuser2', 'a@a.com', 'password')
+        players = list()
+        for user, character in zip((self.user1, user2), Character.objects.all()[0:2]):
+            players.append(Player(user=user, character=character, currentSpace=character.defaultSpace))
+            players[-1].save()
+        game = Game(name = "profiled")
+        game.initializeGame(players[0])
+        for player in players:
+            game.addPlayer(player)
+        game.startGame(self.user1)
+
+        with override_settings(CLUELESS_PROFILE_DIR = self.directory.name, CLUELESS_PROFILE_SAMPLE_RATE = 1.0):
+            self.client.post(reverse('lobby'), {'game_id': "../1-2"})
+            self.client.post(reverse('lobby'), {'game_id': "1" * 300})
+            self.client.post(reverse('playerturn', kwargs = {'game_id': game.id}), {'player_move': "x-/y"})
+        dumps = self.dumps()
+        self.assertEqual(len(dumps), 3)
+        self.assertEqual(sum(1 for name in dumps if "-lobby-nogame-" in name), 2)
+        self.assertEqual(sum(1 for name in dumps if "-playerturn-game{}-".format(game.id) in name), 1)
+        for name in dumps:
+            self.assertEqual(len(name[:-len(".pstats")].split("-")), 4)
+
+    def test_dump_directory_is_bounded(self):
+        with override_settings(CLUELESS_PROFILE_DIR = self.directory.name, CLUELESS_PROFILE_SAMPLE_RATE = 1.0,
+                               CLUELESS_PROFILE_MAX_DUMPS = 2):
+            for i in range(0, 4):
+                self.client.get(reverse('lobby'))
+        self.assertEqual(len(self.dumps()), 2)
+
+    def test_report_adds_up_the_dumps(self):
+        with override_settings(CLUELESS_PROFILE_DIR = self.directory.name, CLUELESS_PROFILE_SAMPLE_RATE = 1.0):
+            self.client.get(reverse('lobby'))
+            self.client.get(reverse('lobby'))
+        call_command('profile_report', dir = self.directory.name, view = 'lobby', top = 5)
+        self.assertRaises(CommandError, call_command, 'profile_report', dir = self.directory.name, view = 'playerturn')
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('metricstestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('metricstestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "measured")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = Client()
+        self.client.force_login(self.user1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def metricLines(self, text, prefix):
+        return dict(line.rsplit(" ", 1) for line in text.splitlines() if line.startswith(prefix))
+
+    def test_histogram_buckets_are_cumulative(self):
+        for seconds in (0.001, 0.02, 0.02, 30.0):
+            metrics.observe('clueless_request_duration_seconds', (('view', 'histogramtest'),), seconds,
+                            metrics.LATENCY_BUCKETS)
+        lines = self.metricLines(metrics.renderPrometheus(self.directory.name),
+                                 'clueless_request_duration_seconds_')
+        self.assertEqual(lines['clueless_request_duration_seconds_bucket{view="histogramtest",le="0.005"}'], "1")
+        self.assertEqual(lines['clueless_request_duration_seconds_bucket{view="histogramtest",le="0.025"}'], "3")
+        self.assertEqual(lines['clueless_request_duration_seconds_bucket{view="histogramtest",le="+Inf"}'], "4")
+        self.assertEqual(lines['clueless_request_duration_seconds_count{view="histogramtest"}'], "4")
+
+    def test_requests_queries_and_pollers_are_counted(self):
+        with override_settings(CLUELESS_METRICS_DIR = self.directory.name):
+            self.client.post(reverse('gamestate'), {'game_id': self.game1.id, 'player_id': self.player1.id,
+                                                    'cached_game_seq': -1})
+            self.client.post(reverse('gamestate'), {'game_id': self.game1.id, 'player_id': self.player1.id,
+                                                    'cached_game_seq': self.game1.currentSequence})
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('clueless_requests_total{view="gamestate",status="200"}', text)
+        queries = self.metricLines(text, 'clueless_request_queries_sum{view="gamestate"}')
+        self.assertGreater(float(list(queries.values())[0]), 0)
+        self.assertIn('clueless_gamestate_polls_total{changed="false"}', text)
+        self.assertGreaterEqual(int(self.metricLines(text, 'clueless_active_pollers')['clueless_active_pollers']), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "metrics-{}.json".format(os.getpid()))))
+
+    def test_endpoint_is_internal(self):
+        with override_settings(CLUELESS_METRICS_DIR = self.directory.name):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR = '10.1.2.3').status_code, 403)
+        with override_settings(CLUELESS_METRICS_DIR = None):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('instrumenttestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('instrumenttestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        instrumentation.disable()
+        self.directory.cleanup()
+
+    def test_calls_are_timed_with_their_queries(self):
+        instrumentation.enable(self.directory.name)
+        game = Game(name = "instrumented")
+        game.initializeGame(self.player1)
+        game.addPlayer(self.player1)
+        game.addPlayer(self.player2)
+        game.startGame(self.user1)
+        game.gameStateJSON(Player.objects.get(id = self.player1.id))
+        instrumentation.flush()
+
+        summary = instrumentation.summarize(self.directory.name)
+        self.assertEqual(summary['Game.startGame']['calls'], 1)
+        self.assertGreater(summary['Game.startGame']['queries'], 0)
+        self.assertGreaterEqual(summary['Game.registerGameUpdate']['calls'], 1)
+        self.assertEqual(list(instrumentation.summarize(self.directory.name, 'Game.gameStateJSON')),
+                         ['Game.gameStateJSON'])
+        call_command('instrument_report', dir = self.directory.name, clear = True)
+        self.assertEqual(instrumentation.summarize(self.directory.name), {})
+        game.delete()
+
+    def test_failed_flush_does_not_fail_the_call(self):
+        #a file where the directory should be
+        path = os.path.join(self.directory.name, "notadirectory")
+        open(path, 'w').close()
+        instrumentation.enable(path)
+        instrumentation._lastFlush = 0.0
+        game = Game(name = "instrumented")
+        game.initializeGame(self.player1)
+        sequence = game.currentSequence
+        game.registerGameUpdate()
+        self.assertEqual(Game.objects.get(id = game.id).currentSequence, sequence + 1)
+        game.delete()
+
+    def test_nothing_is_recorded_when_disabled(self):
+        self.player1.validMoves()
+        instrumentation.flush()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_ring_buffer_is_bounded(self):
+        instrumentation.enable(self.directory.name, ringSize = 3)
+        for i in range(0, 5):
+            self.player1.validMoves()
+        instrumentation.flush()
+        self.assertEqual(instrumentation.summarize(self.directory.name)['Player.validMoves']['calls'], 3)
+
+
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('slowquerytestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('slowquerytestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "slow")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.directory.name, "slow.jsonl")
+        self.client = Client()
+        self.client.force_login(self.user1)
+
+    def tearDown(self):
+        slow_queries.disable()
+        self.directory.cleanup()
+
+    def test_attribution_names_the_method(self):
+        frame, line = slow_queries.attribute()
+        self.assertEqual(frame, "tests.py:SlowQueryLogTests.test_attribution_names_the_method")
+
+    def test_repeated_statements_are_logged_once_per_request(self):
+        with override_settings(CLUELESS_SLOW_QUERY_LOG = self.log, CLUELESS_SLOW_QUERY_MS = 60000):
+            self.client.get(reverse('detectivesheet', kwargs = {'game_id': self.game1.id,
+                                                                'player_id': self.player1.id}))
+        entries = slow_queries.readLog(self.log)
+        self.assertTrue(entries)
+        for entry in entries:
+            self.assertEqual(entry['kind'], 'duplicate')
+            self.assertEqual(entry['view'], 'detectivesheet')
+            self.assertGreaterEqual(entry['count'], slow_queries.DUPLICATE_THRESHOLD)
+            self.assertFalse(entry['frame'].startswith('middleware.py'))
+        self.assertEqual(len(set(e['sql'] for e in entries)), len(entries))
+
+    def test_slow_statements_are_logged_with_their_frame(self):
+        with override_settings(CLUELESS_SLOW_QUERY_LOG = self.log, CLUELESS_SLOW_QUERY_MS = 0):
+            self.client.get(reverse('lobby'))
+        slow = [e for e in slow_queries.readLog(self.log) if e['kind'] == 'slow']
+        self.assertTrue(slow)
+        self.assertTrue(all(e['view'] == 'lobby' and e['frame'] for e in slow))
+        call_command('slow_query_report', log = self.log, top = 5)
+
+
+class ActionTimingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('timingtestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('timingtestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "timed")
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def poll(self, user, player, cachedSequence):
+        client = Client()
+        client.force_login(user)
+        response = client.post(reverse('gamestate'), {'game_id': self.game1.id, 'player_id': player.id,
+                                                      'cached_game_seq': cachedSequence})
+        return response.json()['gamestate']['game_sequence'] if response.json()['changed'] else cachedSequence
+
+    def test_actions_are_timed_and_fetches_noted_per_seat(self):
+        sequence1 = self.poll(self.user1, self.player1, -1)
+        sequence2 = self.poll(self.user2, self.player2, -1)
+        client = Client()
+        client.force_login(self.user1)
+        client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {
+            'player_move': 'moveSpace', 'new_position': Space.objects.get(posX=5, posY=1).spaceCollector_id})
+        client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {'player_move': 'endTurn'})
+
+        timings = list(ActionTiming.objects.filter(game = self.game1).order_by('sequence'))
+        self.assertEqual([t.kind for t in timings], ['move', 'endTurn'])
+        self.assertTrue(all(t.player_id == self.player1.id for t in timings))
+        self.assertLess(timings[0].sequence, timings[1].sequence)
+        self.assertEqual(timings[1].sequence, Game.objects.get(id = self.game1.id).currentSequence)
+
+        #the first seat catches up with one poll, the second only with the end of the turn
+        self.poll(self.user1, self.player1, sequence1)
+        self.poll(self.user2, self.player2, timings[0].sequence)
+        ActionTiming.flushFetches()
+        timings = list(ActionTiming.objects.filter(game = self.game1).order_by('sequence'))
+        self.assertEqual(sorted(timings[0].fetchDelayMap()), [self.player1.id])
+        self.assertEqual(sorted(timings[1].fetchDelayMap()), [self.player1.id, self.player2.id])
+
+        #a page load is not a fetch of any action, and a later fetch keeps the first delay
+        self.poll(self.user2, self.player2, -1)
+        ActionTiming.flushFetches()
+        self.assertEqual(sorted(ActionTiming.objects.get(id = timings[0].id).fetchDelayMap()), [self.player1.id])
+        time.sleep(0.01)
+        delays = timings[1].fetchDelayMap()
+        self.poll(self.user2, self.player2, sequence2)
+        ActionTiming.flushFetches()
+        self.assertEqual(sorted(ActionTiming.objects.get(id = timings[0].id).fetchDelayMap()),
+                         [self.player1.id, self.player2.id])
+        self.assertEqual(ActionTiming.objects.get(id = timings[1].id).fetchDelayMap(), delays)
+
+        call_command('game_timeline', self.game1.id)
+        call_command('game_timeline', self.game1.id, kind = 'move')
+
+    def test_fetches_are_written_together_without_locking_the_timings(self):
+        ActionTiming.flushFetches()
+        sequence = self.poll(self.user2, self.player2, -1)
+        client = Client()
+        client.force_login(self.user1)
+        client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {
+            'player_move': 'moveSpace', 'new_position': Space.objects.get(posX=5, posY=1).spaceCollector_id})
+        timing = ActionTiming.objects.get(game = self.game1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.poll(self.user2, self.player2, sequence)
+        self.assertFalse([q for q in queries.captured_queries if 'actiontiming' in q['sql'] or 'actionfetch' in q['sql']])
+        self.assertFalse(ActionFetch.objects.filter(timing = timing).exists())
+
+        #once the oldest fetch has waited long enough, the next poll writes them all
+        interval = models.FETCH_FLUSH_INTERVAL
+        models.FETCH_FLUSH_INTERVAL = 0
+        self.addCleanup(setattr, models, 'FETCH_FLUSH_INTERVAL', interval)
+        self.poll(self.user1, self.player1, sequence)
+        self.assertEqual(sorted(timing.fetchDelayMap()), [self.player1.id, self.player2.id])
+
+
+class EventLogTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('eventlogtestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('eventlogtestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "logged", seed = 20170502)
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def assertRebuilt(self):
+        game = Game.objects.get(id = self.game1.id)
+        self.assertEqual(event_log.stateDifferences(event_log.rebuildState(game),
+                                                    GameStateAdapter(game).load(fromTables = True)), [])
+
+    def test_game_is_logged_from_the_start(self):
+        self.assertEqual(event_log.loggedEvents(self.game1)[0], (0, event_log.START, ()))
+        self.assertTrue(GameSnapshot.objects.filter(game = self.game1, eventNumber = 0).exists())
+        self.assertRebuilt()
+
+    def test_views_and_engine_are_logged_and_replayed_exactly(self):
+        client = Client()
+        client.force_login(self.user1)
+        client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {
+            'player_move': 'moveSpace', 'new_position': Space.objects.get(posX=5, posY=1).spaceCollector_id})
+        client.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {'player_move': 'endTurn'})
+        self.assertEqual([kind for number, kind, args in event_log.loggedEvents(self.game1)],
+                         [event_log.START, event_log.MOVE, event_log.END_TURN])
+        self.assertRebuilt()
+
+        #the rest of the game is played by bots through the engine, a step per save
+        adapter = GameStateAdapter(Game.objects.get(id = self.game1.id))
+        state = adapter.load()
+        bots = dict((i, createBot("detective", random.Random(i))) for i in range(0, len(state.seats)))
+        while playBotStep(state, bots):
+            adapter.save()
+        adapter.save()
+        self.assertTrue(state.finished)
+        self.assertRebuilt()
+
+        events = event_log.loggedEvents(self.game1)
+        self.assertEqual([number for number, kind, args in events], list(range(0, len(events))))
+        snapshots = list(GameSnapshot.objects.filter(game = self.game1).values_list('eventNumber', flat = True))
+        self.assertEqual(len(snapshots), 1 + (len(events) - 1) // event_log.SNAPSHOT_INTERVAL)
+        #the whole log replays to the same game as the latest snapshot does
+        GameSnapshot.objects.filter(game = self.game1, eventNumber__gt = 0).delete()
+        self.assertRebuilt()
+
+    def test_suggestion_reveal_and_accusation_views_are_logged(self):
+        tables = getEngineTables()
+        client1 = Client()
+        client1.force_login(self.user1)
+        client2 = Client()
+        client2.force_login(self.user2)
+        lounge = Space.objects.get(posX=5, posY=1)
+        client1.post(reverse('playerturn', kwargs = {'game_id': self.game1.id}), {
+            'player_move': 'moveSpace', 'new_position': lounge.spaceCollector_id})
+
+        #suggest a card player 2 holds, so there is a card to reveal
+        state = GameStateAdapter(Game.objects.get(id = self.game1.id)).load()
+        hand = state.seats[1].hand
+        character = ([c for c in tables.deck.characters if c in hand] or list(tables.deck.characters))[0]
+        weapon = ([w for w in tables.deck.weapons if w in hand] or list(tables.deck.weapons))[0]
+        room = state.board.roomAt(lounge.id)
+        suggested = (character, room, weapon)
+        player1Args = {'game_id': self.game1.id, 'player_id': self.player1.id}
+        client1.post(reverse('make_suggestion_controller', kwargs = player1Args), {
+            'suspect_id': tables.cardIds[character], 'room_id': tables.cardIds[room],
+            'weapon_id': tables.cardIds[weapon]})
+        card = sorted(hand.intersection(suggested))[0]
+        player2Args = {'game_id': self.game1.id, 'player_id': self.player2.id}
+        client2.post(reverse('card_reveal_controller', kwargs = player2Args), {'card_id': tables.cardIds[card]})
+        self.assertRebuilt()
+
+        #a wrong accusation leaves player 2 to win
+        wrongWeapon = [w for w in tables.deck.weapons if w != state.caseFile[2]][0]
+        client1.post(reverse('make_accusation_controller', kwargs = player1Args), {
+            'suspect_id': tables.cardIds[state.caseFile[0]], 'room_id': tables.cardIds[state.caseFile[1]],
+            'weapon_id': tables.cardIds[wrongWeapon]})
+        self.assertEqual(Game.objects.get(id = self.game1.id).status, COMPLETE)
+
+        self.assertEqual([(kind, args) for number, kind, args in event_log.loggedEvents(self.game1)], [
+            (event_log.START, ()), (event_log.MOVE, (0, lounge.id)), (event_log.SUGGESTION, (0,) + suggested),
+            (event_log.REVEAL, (1, card)),
+            (event_log.ACCUSATION, (0, state.caseFile[0], state.caseFile[1], wrongWeapon))])
+        self.assertRebuilt()
+        self.assertEqual(event_log.rebuildState(self.game1).winnerSeat, 1)
+
+    def test_engine_plays_from_the_log(self):
+        #a position changed behind the log's back is not what the engine sees, until the projections are rewritten
+        Player.objects.filter(id = self.player2.id).update(currentSpace = Space.objects.get(posX=3, posY=3))
+        game = Game.objects.get(id = self.game1.id)
+        fromLog = GameStateAdapter(game).load()
+        self.assertEqual(event_log.stateDifferences(fromLog, event_log.rebuildState(game)), [])
+        self.assertEqual(fromLog.pieces[getEngineTables().card(self.player2.character_id)],
+                         self.player2.currentSpace_id)
+        with self.assertNumQueries(3):
+            GameStateAdapter(game).load()
+
+    def test_append_is_numbered_without_a_lock_and_again_after_a_clash(self):
+        game = Game.objects.get(id = self.game1.id)
+        #the last number, then the insert in its savepoint
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(event_log.appendEvents(game, [(event_log.END_TURN, ())], self.player1.id), 1)
+        self.assertEqual(len(queries.captured_queries), 4)
+        self.assertFalse([q for q in queries.captured_queries if 'clueless_game"' in q['sql']])
+
+        bulkCreate = GameEvent.objects.bulk_create
+        clashes = list()
+
+        def clashingBulkCreate(objs, *args, **kwargs):
+            #another request took the numbers between the read and the insert
+            if len(clashes) < 2:
+                clashes.append(objs[0].number)
+                raise IntegrityError("UNIQUE constraint failed")
+            return bulkCreate(objs, *args, **kwargs)
+
+        GameEvent.objects.bulk_create = clashingBulkCreate
+        self.addCleanup(GameEvent.objects.__dict__.pop, 'bulk_create', None)
+        self.assertEqual(event_log.appendEvents(game, [(event_log.END_TURN, ())], self.player2.id), 2)
+        self.assertEqual(clashes, [2, 2])
+        self.assertEqual(event_log.loggedEvents(game)[1:], [(1, event_log.END_TURN, (0,)), (2, event_log.END_TURN, (1,))])
+
+        del clashes[:]
+        event_log.APPEND_ATTEMPTS, attempts = 2, event_log.APPEND_ATTEMPTS
+        self.addCleanup(setattr, event_log, 'APPEND_ATTEMPTS', attempts)
+        self.assertRaises(IntegrityError, event_log.appendEvents, game, [(event_log.END_TURN, ())], self.player1.id)
+
+    def test_log_that_does_not_replay_is_not_read_from_the_tables(self):
+        #the first move is logged for the seat whose turn it is not
+        game = Game.objects.get(id = self.game1.id)
+        event_log.appendEvents(game, [(event_log.MOVE, (Space.objects.get(posX=5, posY=1).id,))], self.player2.id)
+        self.assertRaises(RuntimeError, GameStateAdapter(game).load)
+        self.assertEqual(GameStateAdapter(game).load(fromTables = True).turnSeat, 0)
+
+    def test_snapshots_are_compact_and_round_trip(self):
+        state = GameStateAdapter(self.game1).load()
+        state.move(state.validMoves()[0])
+        state.seats[0].known.add(sorted(state.seats[1].hand)[0])
+        state.seats[1].eliminated = True
+        state.suggestion = state.caseFile
+        state.revealingSeat = 1
+        data = snapshots.packState(state)
+        self.assertLess(len(data), 200)
+
+        restored = snapshots.unpackState(data, getEngineTables())
+        self.assertEqual(event_log.stateDifferences(restored, state), [])
+        self.assertEqual(restored.suggestion, state.suggestion)
+        self.assertEqual(tuple(restored.caseFile), tuple(state.caseFile))
+        self.assertEqual([s.hand for s in restored.seats], [s.hand for s in state.seats])
+        self.assertIsNone(restored.winnerSeat)
+
+        self.assertRaises(RuntimeError, snapshots.unpackState, b"\x7f" + data[1:], getEngineTables())
+        #snapshots written as JSON by the first version of the event log still load
+        legacy = json.dumps({'version': 1, 'seats': [[s.playerId, s.character, sorted(s.hand), sorted(s.known),
+                                                      s.eliminated] for s in state.seats],
+                             'pieces': sorted(list(p) for p in state.pieces.items()), 'caseFile': list(state.caseFile),
+                             'turnSeat': state.turnSeat, 'phase': state.phase, 'suggestion': None,
+                             'revealingSeat': None, 'winnerSeat': None}).encode('utf-8')
+        self.assertEqual(snapshots.unpackState(legacy, getEngineTables()).pieces, state.pieces)
+
+    def test_projections_are_rewritten_from_the_log(self):
+        Player.objects.filter(id = self.player2.id).update(currentSpace = Space.objects.get(posX=3, posY=3))
+        game = Game.objects.get(id = self.game1.id)
+        self.assertEqual(len(event_log.stateDifferences(event_log.rebuildState(game),
+                                                        GameStateAdapter(game).load(fromTables = True))), 1)
+        call_command('rebuild_game_state', self.game1.id, write = True)
+        self.assertEqual(Player.objects.get(id = self.player2.id).currentSpace_id, self.player2.currentSpace_id)
+        self.assertRebuilt()
+
+
+class GameExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.user1 = User.objects.create_user('exporttestuser1', 'a@a.com', 'password')
+        cls.user2 = User.objects.create_user('exporttestuser2', 'a@a.com', 'password')
+        character1 = Character.objects.all()[0]
+        character2 = Character.objects.all()[1]
+        cls.player1 = Player(user=cls.user1, character=character1, currentSpace=character1.defaultSpace)
+        cls.player1.save()
+        cls.player2 = Player(user=cls.user2, character=character2, currentSpace=character2.defaultSpace)
+        cls.player2.save()
+
+        cls.game1 = Game(name = "exported", seed = 20170503)
+        cls.game1.initializeGame(cls.player1)
+        cls.game1.addPlayer(cls.player1)
+        cls.game1.addPlayer(cls.player2)
+        cls.game1.startGame(cls.user1)
+        adapter = GameStateAdapter(Game.objects.get(id = cls.game1.id))
+        state = adapter.load()
+        bots = dict((i, createBot("detective", random.Random(i))) for i in range(0, len(state.seats)))
+        while playBotStep(state, bots):
+            adapter.save()
+        adapter.save()
+        cls.game1.refresh_from_db()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.user1.delete()
+        cls.user2.delete()
+        cls.player1.delete()
+        cls.player2.delete()
+        cls.game1.delete()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "games.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def shape(self, game):
+        #the records of a game with every id left out
+        return [(r['type'], r.get('model'), r.get('user'), r.get('fields', {}).get('description'),
+                 r.get('fields', {}).get('kind'), r.get('fields', {}).get('args'))
+                for r in game_export.exportRecords(game)]
+
+    def importedGames(self):
+        with open(self.path) as f:
+            return list(game_export.importGames(f, chunkSize = 7))
+
+    def deleteGame(self, game):
+        caseFile = game.caseFile
+        Game.objects.filter(id = game.id).update(currentTurn = None)
+        Player.objects.filter(currentGame = game).delete()
+        caseFile.delete()
+
+    def test_export_and_import_round_trip(self):
+        call_command('export_games', self.path, game = [self.game1.id])
+        with open(self.path) as f:
+            types = [json.loads(line)['type'] for line in f]
+        self.assertEqual(types[0:3], ['game', 'player', 'player'])
+
+        imported = self.importedGames()
+        self.assertEqual([exportedId for exportedId, game in imported], [self.game1.id])
+        game = imported[0][1]
+        try:
+            self.assertNotEqual(game.id, self.game1.id)
+            self.assertEqual(self.shape(game), self.shape(self.game1))
+            self.assertEqual(game.status, COMPLETE)
+            self.assertTrue(game.caseFile.compare(self.game1.caseFile))
+            self.assertEqual(Turn.objects.filter(game = game).count(), Turn.objects.filter(game = self.game1).count())
+            self.assertEqual(Move.objects.filter(turn__game = game).count(),
+                             Move.objects.filter(turn__game = self.game1).count())
+
+            stored = GameStateAdapter(game).load()
+            original = GameStateAdapter(self.game1).load()
+            self.assertEqual(stored.pieces, original.pieces)
+            self.assertEqual([s.hand for s in stored.seats], [s.hand for s in original.seats])
+            self.assertEqual(stored.winnerSeat, original.winnerSeat)
+            self.assertEqual(event_log.stateDifferences(event_log.rebuildState(game), stored), [])
+        finally:
+            self.deleteGame(game)
+
+    def test_archived_games_are_exported_from_their_archive(self):
+        before = self.shape(self.game1)
+        archiveGame(self.game1)
+        try:
+            with open(self.path, 'w') as f:
+                f.writelines(game_export.exportLines(Game.objects.filter(id = self.game1.id)))
+        finally:
+            rehydrateGame(self.game1)
+        game = self.importedGames()[0][1]
+        try:
+            self.assertEqual(self.shape(game), before)
+        finally:
+            self.deleteGame(game)
+
+    def test_bad_exports_are_refused(self):
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'type': 'player', 'id': 1}) + "\n")
+        self.assertRaises(CommandError, call_command, 'import_games', self.path)
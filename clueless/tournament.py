@@ -0,0 +1,163 @@
+"""
+Round-robin tournaments between bot strategies, played on the in-memory rules engine like the simulator.
+
+Every table of the round robin plays a number of games, rotating the seats from game to game so no strategy keeps
+the first turn.  Games are cut into shards of consecutive game numbers, each game seeded from the run seed, its table
+and its number, and the shards are played across a pool of processes a batch at a time.  Finished games are appended
+to a JSON lines results file as their shard comes back, and after every batch a checkpoint records which shards are
+done and how long the results file was, so an interrupted tournament picks up from its last batch.
+"""
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+
+from clueless.simulation import MAX_GAME_STEPS, playGame
+
+DEFAULT_SHARD_SIZE = 50
+DEFAULT_BATCH_SIZE = 16 #shards per checkpoint
+INITIAL_RATING = 1500.0
+ELO_K = 16.0
+
+
+def scheduleTables(strategies, seatCounts):
+    """
+    :param strategies: list of bot strategy names
+    :param seatCounts: list of table sizes to play
+    :return: list of seatings, one per table: every combination of strategies for each table size, repeats allowed,
+    with at least two different strategies at the table
+    """
+    tables = list()
+    for seats in seatCounts:
+        for seating in itertools.combinations_with_replacement(sorted(set(strategies)), seats):
+            if len(set(seating)) > 1:
+                tables.append(list(seating))
+    return tables
+
+
+def shardTasks(tables, gamesPerTable, runSeed, shardSize = DEFAULT_SHARD_SIZE, maxSteps = MAX_GAME_STEPS):
+    """
+    :return: list of (shard id, table index, seating, first game number, number of games, run seed, max steps)
+    """
+    tasks = list()
+    for tableIndex, seating in enumerate(tables):
+        for first in range(0, gamesPerTable, shardSize):
+            tasks.append((len(tasks), tableIndex, seating, first, min(shardSize, gamesPerTable - first), runSeed,
+                          maxSteps))
+    return tasks
+
+
+def playShard(task):
+    """
+    Plays the games of one shard.  Runs in a worker process
+    :return: (shard id, list of game result dictionaries)
+    """
+    shardId, tableIndex, seating, first, count, runSeed, maxSteps = task
+    results = list()
+    for gameNumber in range(first, first + count):
+        #rotate the seats, so every strategy gets every position at the table
+        rotation = gameNumber % len(seating)
+        seats = seating[rotation:] + seating[:rotation]
+        winnerSeat, turns = playGame(seats, "{}:{}:{}".format(runSeed, tableIndex, gameNumber), maxSteps)
+        results.append({'table': tableIndex, 'game': gameNumber, 'seats': seats, 'winner': winnerSeat,
+                        'turns': turns})
+    return (shardId, results)
+
+
+def eloRatings(results):
+    """
+    Elo ratings from game results, replayed in table and game order so the ratings don't depend on the order the
+    games finished in.  A win counts as a win over every other seat, each pairing weighted down by the table size.
+    Stalled games are left out
+    :param results: iterable of game result dictionaries
+    :return: list of (strategy, rating, games, wins), best first
+    """
+    ratings = collections.defaultdict(lambda: INITIAL_RATING)
+    games = collections.Counter()
+    wins = collections.Counter()
+    for result in sorted(results, key = lambda r: (r['table'], r['game'])):
+        seats = result['seats']
+        for name in seats:
+            games[name] += 1
+        if result['winner'] is None:
+            continue
+        winner = seats[result['winner']]
+        wins[winner] += 1
+        k = ELO_K / (len(seats) - 1)
+        for loserSeat, loser in enumerate(seats):
+            if loserSeat == result['winner'] or loser == winner:
+                continue
+            expected = 1.0 / (1.0 + 10 ** ((ratings[loser] - ratings[winner]) / 400.0))
+            ratings[winner] += k * (1.0 - expected)
+            ratings[loser] -= k * (1.0 - expected)
+    ranking = [(name, round(ratings[name], 1), games[name], wins[name]) for name in games]
+    ranking.sort(key = lambda r: (-r[1], r[0]))
+    return ranking
+
+
+def readResults(resultsPath):
+    """
+    :return: list of the game result dictionaries in a results file
+    """
+    if not os.path.exists(resultsPath):
+        return []
+    with open(resultsPath) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _writeCheckpoint(checkpointPath, checkpoint):
+    #written aside and renamed, so an interruption never leaves half a checkpoint
+    partPath = checkpointPath + ".part"
+    with open(partPath, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(partPath, checkpointPath)
+
+
+def runTournament(strategies, seatCounts, gamesPerTable, resultsPath, checkpointPath, runSeed = 0, processes = None,
+                  shardSize = DEFAULT_SHARD_SIZE, batchSize = DEFAULT_BATCH_SIZE, maxSteps = MAX_GAME_STEPS,
+                  progress = None):
+    """
+    Plays a tournament, or the rest of one if the checkpoint file exists
+    :param processes: worker processes, None for one per core, 1 to play in this process
+    :param progress: optional callable(shards done, shards in total) called after every batch
+    :return: Elo ranking, see eloRatings
+    """
+    config = {'strategies': sorted(set(strategies)), 'seatCounts': list(seatCounts), 'gamesPerTable': gamesPerTable,
+              'seed': runSeed, 'shardSize': shardSize, 'maxSteps': maxSteps}
+    tasks = shardTasks(scheduleTables(strategies, seatCounts), gamesPerTable, runSeed, shardSize, maxSteps)
+
+    checkpoint = {'config': config, 'doneShards': [], 'resultsBytes': 0}
+    if os.path.exists(checkpointPath):
+        with open(checkpointPath) as f:
+            checkpoint = json.load(f)
+        if checkpoint['config'] != config:
+            raise RuntimeError("Checkpoint {} belongs to a different tournament".format(checkpointPath))
+    done = set(checkpoint['doneShards'])
+    pending = [task for task in tasks if task[0] not in done]
+
+    #drop whatever the interrupted batch wrote after the last checkpoint
+    with open(resultsPath, 'a') as f:
+        f.truncate(checkpoint['resultsBytes'])
+
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    try:
+        with open(resultsPath, 'a') as f:
+            for start in range(0, len(pending), batchSize):
+                batch = pending[start:start + batchSize]
+                shards = pool.imap_unordered(playShard, batch) if pool is not None else map(playShard, batch)
+                for shardId, results in shards:
+                    f.write("".join(json.dumps(r, separators = (',', ':')) + "\n" for r in results))
+                    f.flush()
+                    done.add(shardId)
+                os.fsync(f.fileno())
+                checkpoint['doneShards'] = sorted(done)
+                checkpoint['resultsBytes'] = f.tell()
+                _writeCheckpoint(checkpointPath, checkpoint)
+                if progress is not None:
+                    progress(len(done), len(tasks))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return eloRatings(readResults(resultsPath))
@@ -0,0 +1,231 @@
+"""
+Request traces, for replaying real play against another build.
+
+A trace is an append-only JSON lines file of two kinds of record:
+    {"type": "request", "t", "urlName", "method", "kwargs", "params", "user", "status", "ms"}
+    {"type": "game", "game", "seed", "botStrategy", "sequence", "host", "players": [{"player", "user", "character_id"}]}
+
+Traces are anonymised.  Users are only known by an alias keyed on the secret key, and only the POST fields that hold
+ids and moves are kept, never names, passwords or email addresses.  A game record is written the first time a started
+game is seen, with its user seats in turn order, so the replayer can deal the same game again from the seed.
+
+TraceReplay rebuilds the traced games, then sends the traced requests again with the Django test client at the
+traced pace, a multiple of it, or as fast as possible, and times them per endpoint.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+
+from clueless.loadtest import LatencyRecorder
+from clueless.models import Game, Player
+
+#POST fields kept in a trace, none of them identify a person
+TRACED_PARAMS = ('game_id', 'player_id', 'cached_game_seq', 'player_move', 'new_position', 'suspect_id', 'room_id',
+                 'weapon_id', 'card_id', 'check', 'character_id', 'bot_strategy')
+#requests that are traced but not replayed: they log users in and out, or set up games the replay has no ids for
+NOT_REPLAYED = ('login', 'logout', 'signup', 'start_game_controller', 'join_game_controller',
+                'begin_game_controller')
+
+_writeLock = threading.Lock()
+
+
+def userAlias(userId):
+    """
+    :return: stable anonymous name for a user, or None for an anonymous request
+    """
+    if userId is None:
+        return None
+    digest = hmac.new(settings.SECRET_KEY.encode(), str(userId).encode(), hashlib.sha256).hexdigest()
+    return digest[0:12]
+
+
+def endpointName(urlName, method, params):
+    """
+    :return: name a request is timed under, the playerturn POSTs are split by move as in the query budgets
+    """
+    if urlName == 'playerturn' and method == 'POST' and params.get('player_move'):
+        return "playerturn.{}".format(params['player_move'])
+    return urlName
+
+
+def appendRecord(path, record):
+    """
+    Appends one record to a trace.  Each record is a single write to a file opened for appending, so records from
+    several threads or processes don't interleave
+    """
+    line = json.dumps(record, separators = (',', ':'), sort_keys = True) + "\n"
+    with _writeLock:
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+def gameRecord(game):
+    """
+    :param game: started Game
+    :return: trace record of the game: its seed, host and user seats in turn order
+    """
+    players = dict((p['id'], p) for p in Player.objects.filter(currentGame = game, user__isnull = False).values(
+        'id', 'user_id', 'character_id', 'botStrategy'))
+    seats = [players[playerId] for playerId in game.seatOrder() if playerId in players and
+             not players[playerId]['botStrategy']]
+    return {
+        'type': 'game', 'game': game.id, 'seed': game.seed, 'botStrategy': game.botStrategy,
+        'sequence': game.currentSequence, 'host': game.hostPlayer_id,
+        'players': [{'player': p['id'], 'user': userAlias(p['user_id']), 'character_id': p['character_id']}
+                    for p in seats],
+    }
+
+
+def readTrace(path):
+    """
+    :return: (dictionary of game id -> first game record, list of request records in time order)
+    """
+    games = dict()
+    requests = list()
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['type'] == 'game':
+                games.setdefault(record['game'], record)
+            elif record['type'] == 'request':
+                requests.append(record)
+    requests.sort(key = lambda r: r['t'])
+    return (games, requests)
+
+
+class TraceReplay(object):
+    """
+    One replay of a trace: set up, run, then tear down
+    """
+    def __init__(self, path):
+        self.games, self.requests = readTrace(path)
+        self.runId = uuid.uuid4().hex[0:8]
+        self.recorder = LatencyRecorder()
+        self.traced = LatencyRecorder()
+        self.skipped = 0
+        self.users = dict() #alias -> User
+        self.createdGames = list()
+        self.gameMap = dict() #traced game id -> replay Game
+        self.playerMap = dict() #traced player id -> replay player id
+
+    def setUp(self):
+        """
+        Creates a user per alias and deals every traced game again from its seed.  Games traced after they had
+        begun can't be rebuilt as they were, and their requests are skipped
+        """
+        for request in self.requests:
+            self.__user(request['user'])
+        for record in self.games.values():
+            if not record['players'] or record['host'] not in [p['player'] for p in record['players']]:
+                continue
+            players = dict()
+            for seat in record['players']:
+                player = Player(user = self.__user(seat['user']), character_id = seat['character_id'])
+                player.currentSpace = player.character.defaultSpace
+                player.save()
+                players[seat['player']] = player
+            game = Game(name = "trace replay {} {}".format(self.runId, record['game']), seed = record['seed'],
+                        botStrategy = record['botStrategy'])
+            game.initializeGame(players[record['host']])
+            for seat in record['players']:
+                game.addPlayer(players[seat['player']])
+            game.startGame(players[record['host']].user)
+            game.refresh_from_db()
+            self.createdGames.append(game)
+            if game.currentSequence != record['sequence']:
+                continue
+            self.gameMap[record['game']] = game
+            for tracedId, player in players.items():
+                self.playerMap[tracedId] = player.id
+
+    def tearDown(self):
+        """
+        Deletes the replayed games, their players and the users
+        """
+        for game in self.createdGames:
+            game.refresh_from_db()
+            caseFile = game.caseFile
+            Game.objects.filter(id = game.id).update(currentTurn = None)
+            Player.objects.filter(currentGame = game).delete()
+            caseFile.delete()
+        User.objects.filter(id__in = [user.id for user in self.users.values() if user is not None]).delete()
+        self.createdGames = list()
+        self.gameMap = dict()
+        self.users = dict()
+
+    def run(self, speed = 1.0):
+        """
+        Sends the traced requests again, in order
+        :param speed: multiple of the traced pace, 0 for as fast as possible
+        :return: (seconds the replay ran for, replayed summary, traced summary), summaries as from
+        LatencyRecorder.summary
+        """
+        clients = dict()
+        start = time.time()
+        tracedStart = self.requests[0]['t'] if self.requests else 0
+        for request in self.requests:
+            rebuilt = self.__rebuild(request)
+            if rebuilt is None:
+                self.skipped += 1
+                continue
+            url, params = rebuilt
+            if speed > 0:
+                wait = (request['t'] - tracedStart) / speed - (time.time() - start)
+                if wait > 0:
+                    time.sleep(wait)
+
+            client = clients.get(request['user'])
+            if client is None:
+                client = clients[request['user']] = Client()
+                if request['user'] is not None:
+                    client.force_login(self.users[request['user']])
+            endpoint = endpointName(request['urlName'], request['method'], params)
+            requestStart = time.time()
+            response = client.post(url, params) if request['method'] == 'POST' else client.get(url, params)
+            self.recorder.record(endpoint, time.time() - requestStart, response.status_code)
+            self.traced.record(endpoint, request['ms'] / 1000.0, request['status'])
+        elapsed = time.time() - start
+        tracedElapsed = self.requests[-1]['t'] - tracedStart if self.requests else 0
+        return (elapsed, self.recorder.summary(elapsed), self.traced.summary(tracedElapsed))
+
+    def __user(self, alias):
+        if alias is None:
+            return None
+        if alias not in self.users:
+            user = User(username = "replay-{}-{}".format(self.runId, alias))
+            user.set_unusable_password()
+            user.save()
+            self.users[alias] = user
+        return self.users[alias]
+
+    def __rebuild(self, request):
+        """
+        :return: (url, params) of a traced request with the replay's game and player ids, or None if it can't be
+        replayed
+        """
+        if request['urlName'] in NOT_REPLAYED or request['urlName'] is None:
+            return None
+        kwargs = dict(request['kwargs'])
+        params = dict(request['params'])
+        for ids in (kwargs, params):
+            if 'game_id' in ids:
+                game = self.gameMap.get(int(ids['game_id']))
+                if game is None:
+                    return None
+                ids['game_id'] = game.id
+            if 'player_id' in ids:
+                playerId = self.playerMap.get(int(ids['player_id']))
+                if playerId is None:
+                    return None
+                ids['player_id'] = playerId
+        return (reverse(request['urlName'], kwargs = kwargs), params)
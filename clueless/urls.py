@@ -33,6 +33,7 @@ urlpatterns = [
     url(r'^detectivesheet/(?P<game_id>\d+)/(?P<player_id>\d+)/', views.detectivesheet, name='detectivesheet'),
     url(r'^controllers/manualSheetItemCheck/(?P<game_id>\d+)/(?P<player_id>\d+)/', views.manualsheetitemcheck, name='manualsheetitemcheck'),
     url(r'^rest/gamestate/', views.gamestate, name='gamestate'),
+    url(r'^internal/metrics/', views.metrics, name='metrics'),
     url(r'^controllers/startgame/', views.start_game_controller, name='start_game_controller'),
     url(r'^controllers/joingame/', views.join_game_controller, name='join_game_controller'),
     url(r'^controllers/begingame/', views.begin_game_controller, name='begin_game_controller'),
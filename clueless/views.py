@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
@@ -6,13 +7,22 @@ from django.core.validators import ValidationError
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.template import Context, loader
-from clueless.models import Accusation, Action, Move, Board, Card, CardReveal, Character, Game, Hallway, Player, Turn, Room, SheetItem, STATUS_CHOICES, Suggestion, Weapon, WhoWhatWhere, Space
+from clueless.archive import rehydrateGame
+from clueless.bots import BOT_STRATEGIES, BOT_STRATEGY_CHOICES
+from clueless.catalog import getCatalog
+from clueless.hints import suggestionRanking
+from clueless.lobby import lobbyGames
+from clueless.metrics import observePoll, renderPrometheus
+from clueless.models import Accusation, Action, ActionTiming, Move, Board, Card, CardReveal, Character, Game, Hallway, Player, Turn, Room, SheetItem, STATUS_CHOICES, Suggestion, Weapon, WhoWhatWhere, Space
 
 import logging
+import time
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+SUGGESTION_HINTS = 5
+
 # HttpResponse functions below here
 
 def index(request):
@@ -125,23 +135,10 @@ def lobby(request):
 	:return:
 	"""
 
-	#get all player objects for user where games are not over
-	currentPlayers = Player.objects.filter(
-		user = request.user,
-		currentGame__status__lt = 2)
-
-	#concatenates all the player's game objects into a list
-	currentGames = list()
-	gameIdList = list()
-	for p in currentPlayers:
-		currentGames.append(p.currentGame)
-		gameIdList.append(p.currentGame.id)
-
-	#get all open, not started games that the current user could join
-	openGames = Game.objects.filter(status__lt = 2).exclude(id__in = gameIdList)
+	currentGames, openGames, nextCursor = lobbyGames(request.user, request.GET.get('after'))
 
 	#create context and render template
-	context = Context({'openGames':openGames, 'currentGames':currentGames})
+	context = {'openGames':openGames, 'currentGames':currentGames, 'nextCursor':nextCursor}
 	template = loader.get_template('clueless/lobby.html')
 	return HttpResponse(template.render(context, request))
 
@@ -153,8 +150,8 @@ def startgame(request):
 	:return:
 	"""
 	template = loader.get_template('clueless/startgame.html')
-	characterList = Character.objects.all().order_by('name')
-	context = {'chracterList':characterList}
+	characterList = sorted(getCatalog().characters, key=lambda c: c.name)
+	context = {'chracterList':characterList, 'botStrategies':BOT_STRATEGY_CHOICES}
 	return HttpResponse(template.render(context,request))
 
 @login_required
@@ -226,6 +223,9 @@ def playgame(request, game_id):
 
 	if game.status == 0: #redirect to begingame lobby
 		return redirect('begingame', game_id = game_id)
+	elif game.status == 2:
+		#finished games may have been archived, put their turns back before showing them
+		rehydrateGame(game)
 
 	spaces = Space.objects.all().order_by('posY', 'posX')
 	context = {"game":game, "player":player, "spaces":spaces}
@@ -257,6 +257,10 @@ def playerlist(request, game_id, player_id):
 		logger.error('player_id does not match user')
 		return HttpResponse(status = 403, content="logged in user does not match player_id")
 
+	if game.status == 2:
+		#finished games may have been archived, put their turns and sheets back before showing them
+		rehydrateGame(game)
+
 	#get all of the sheet items for the player
 	ds = player.getDetectiveSheet()
 
@@ -270,12 +274,17 @@ def playerlist(request, game_id, player_id):
 
 @login_required
 def playerturn(request, game_id):
+	actionStart = time.time()
 	context = {}
 	template = loader.get_template('clueless/playerturn.html')
 
 	#get request variables
 	user_id = request.user
 	game = Game.objects.get(id = game_id)
+	if game.status == 2:
+		#finished games may have been archived, put their turns back before showing them
+		rehydrateGame(game)
+	previousUpdateTime = game.lastUpdateTime
 	context['game'] = game
 	player = Player.objects.get(user = user_id, currentGame=game)
 	if player.compare(game.currentTurn.player):
@@ -311,15 +320,18 @@ def playerturn(request, game_id):
 				template = loader.get_template('clueless/makeAccusation.html')
 
 			elif player_move == "makeSuggestion":
-				try:
-					context['room'] = Room.objects.get(id=player.currentSpace.spaceCollector.id)
-				except Room.DoesNotExist:
+				roomEntry = getCatalog().roomForSpace(player.currentSpace_id)
+				if roomEntry is None:
 					logger.error('player must be in a room to make a suggestion')
 					return HttpResponse(status=403, content="player must be in a room to make a suggestion")
+				context['room'] = roomEntry.model
 				ds = player.getDetectiveSheet()
 				context['characterSheetItems'] = ds.getCharacterSheetItems().order_by("checked", "-manuallyChecked", "-initiallyDealt", "card__name")
 				context['weaponSheetItems'] = ds.getWeaponSheetItems().order_by("checked", "-manuallyChecked", "-initiallyDealt", "card__name")
 				context['player'] = player
+				#best few suggestions, only when NumPy is installed
+				ranking = suggestionRanking(game, player, roomEntry)
+				context['suggestionRanking'] = ranking[:SUGGESTION_HINTS] if ranking else None
 				template = loader.get_template('clueless/makeSuggestion.html')
 
 			elif player_move == "moveSpace":
@@ -339,6 +351,7 @@ def playerturn(request, game_id):
 					player.user.username,
 					new_space.spaceCollector.collectorName
 				))
+				ActionTiming.record(game.id, "move", player, actionStart, previousUpdateTime)
 				#print("player wants to move from ", player.currentSpace, " to ", new_space)
 				"""
 				# validate the move
@@ -355,15 +368,12 @@ def playerturn(request, game_id):
 			elif player_move =="endTurn":
 				# check if player is in hallway
 				turn = game.currentTurn
-				if Move.objects.filter(turn = turn).count() == 0:
-					hallwaySpaces = Hallway.objects.all()
-					for hallway in hallwaySpaces:
-						hallwaySpace = Space.objects.get(spaceCollector__id=hallway.id)
-						if player.currentSpace == hallwaySpace:
-							return HttpResponse(status=403, content="player cannot start and end turn in hallway")
+				if "EndTurn" not in turn.getAvailableActions():
+					return HttpResponse(status=403, content="player cannot start and end turn in hallway")
 				if (turn.player == player):
 					turn.endTurn()
 					game.registerGameUpdate("<b>{}</b> ended turn".format(player.user.username))
+					ActionTiming.record(game.id, "endTurn", player, actionStart, previousUpdateTime)
 
 				#not taking this approach, since it creates unnecessary turn objects
 				#although I like the creativity :)
@@ -407,6 +417,10 @@ def detectivesheet(request, game_id, player_id):
 		logger.error('player_id does not match user')
 		return HttpResponse(status = 403, content="logged in user does not match player_id")
 
+	if game.status == 2:
+		#finished games may have been archived, put their turns and sheets back before showing them
+		rehydrateGame(game)
+
 	#get all of the sheet items for the player
 	ds = player.getDetectiveSheet()
 
@@ -454,17 +468,36 @@ def gamestate(request):
 		return HttpResponse(status=403, content="player is not in requested game")
 
 	responseData = {}
+	observePoll(game.id, player.id, cached_game_seq != game.currentSequence)
+	if cached_game_seq != game.currentSequence:
+		ActionTiming.recordFetch(game, player.id, cached_game_seq)
 	#now, we can actually begin the view logic
 	if cached_game_seq == game.currentSequence:
 		#game has not been updated
 		responseData['changed'] = False
 	else:
+		if game.status == 2:
+			#finished games may have been archived, put their turns back before showing them
+			rehydrateGame(game)
 		responseData['changed'] = True
 		responseData['gamestate'] = game.gameStateJSON(player, cached_game_seq)
 
 	return JsonResponse(responseData)
 
 
+def metrics(request):
+	"""
+	Internal endpoint for the metrics scraper
+	:return: request metrics of every worker process in the Prometheus text format
+	"""
+	if not settings.CLUELESS_METRICS_DIR:
+		return HttpResponse(status = 404, content = "metrics are not enabled")
+	if request.META.get('REMOTE_ADDR') not in settings.CLUELESS_METRICS_ALLOWED_IPS:
+		logger.error('metrics requested from {}'.format(request.META.get('REMOTE_ADDR')))
+		return HttpResponse(status = 403, content = "metrics are internal")
+	return HttpResponse(renderPrometheus(settings.CLUELESS_METRICS_DIR), content_type = "text/plain; version=0.0.4")
+
+
 # Controller functions will go below here
 @login_required
 def start_game_controller(request):
@@ -485,17 +518,21 @@ def start_game_controller(request):
 		user = request.user
 		character_id = request.POST.get('character_id')
 		game_name = request.POST.get('game_name')
+		bot_strategy = request.POST.get('bot_strategy', "")
+		if bot_strategy and bot_strategy not in BOT_STRATEGIES:
+			logger.error('unknown bot strategy')
+			return HttpResponse(status=422, content="unknown bot strategy")
 
 		#get character object
 		try:
-			character = Character.objects.get(card_id = character_id)
+			character = getCatalog().character(character_id)
 		except ObjectDoesNotExist: # Possible User.DoesNotExist
 			logger.error('''character not found (Did you forget to add the
 			character in the admin panel?''')
 			return redirect('startgame')
 
 		# Constructs our game, saves the changes and starts it
-		game = Game(name = game_name)
+		game = Game(name = game_name, botStrategy = bot_strategy)
 
 		# Create a Player object for the Host
 		player = Player(user = user, character = character, currentSpace = character.defaultSpace)
@@ -535,7 +572,7 @@ def join_game_controller(request):
 		game_id = request.POST.get('game_id')
 		#get object instances
 		try:
-			character = Character.objects.get(card_id = character_id)
+			character = getCatalog().character(character_id)
 		except Character.DoesNotExist:
 			logger.error('''Character not found''')
 			return redirect('joingame')
@@ -605,6 +642,7 @@ def begin_game_controller(request):
 		logger.error('POST expected, actual ' + request.method)
 
 def card_reveal_controller(request, game_id, player_id):
+	actionStart = time.time()
 	context = {}
 
 	try:
@@ -626,7 +664,7 @@ def card_reveal_controller(request, game_id, player_id):
 		return HttpResponse(status=403, content="player is not in requested game")
 
 	try:
-		cardReveal = CardReveal.objects.get(revealingPlayer = player, status = 1)
+		cardReveal = CardReveal.objects.select_related('suggestion__turn__game').get(revealingPlayer = player, status = 1)
 	except CardReveal.DoesNotExist:
 		logger.error('no card reveal for this player at this time')
 		return HttpResponse(status=422, content='no card reveal for this player at this time')
@@ -640,29 +678,25 @@ def card_reveal_controller(request, game_id, player_id):
 
 		# get the object instances
 		try:
-			card = Card.objects.get(card_id=card_id)
+			card = getCatalog().card(card_id)
 		except Card.DoesNotExist:
 			logger.error('invalid card')
 			return HttpResponse(status=422, content='invalid card')
 
+		previousUpdateTime = game.lastUpdateTime
 		cardReveal.reveal(card)
-		if cardReveal.hasNext():
-			cr = cardReveal.createNext()
-			while cr.potentialCards().count() == 0:
-				cr.endReveal()
-				if not cr.hasNext():
-					break
-				cr = cr.createNext()
-
-		game.registerGameUpdate("<b>{}</b> revealed a card to <b>{}</b>".format(cardReveal.revealingPlayer.user.username, cardReveal.suggestion.turn.player.user.username))
+		CardReveal.startNextReveal(cardReveal.suggestion, cardReveal.revealingPlayer_id)
+
+		game.registerGameUpdate("<b>{}</b> revealed a card to <b>{}</b>".format(cardReveal.revealingPlayer.user.username, cardReveal.suggestion.turn.player.displayName()))
 		game.registerGameUpdate("<b>{}</b> revealed the card <b>{}</b> to <b>{}</b>".format(
 			cardReveal.revealingPlayer.user.username,
 			cardReveal.revealedCard.name,
-			cardReveal.suggestion.turn.player.user.username), cardReveal.revealingPlayer)
+			cardReveal.suggestion.turn.player.displayName()), cardReveal.revealingPlayer)
 		game.registerGameUpdate("<b>{}</b> revealed the card <b>{}</b> to <b>{}</b>".format(
 			cardReveal.revealingPlayer.user.username,
 			cardReveal.revealedCard.name,
-			cardReveal.suggestion.turn.player.user.username), cardReveal.suggestion.turn.player)
+			cardReveal.suggestion.turn.player.displayName()), cardReveal.suggestion.turn.player)
+		ActionTiming.record(game.id, "reveal", player, actionStart, previousUpdateTime)
 
 
 	context['game'] = game
@@ -677,6 +711,7 @@ def make_suggestion_controller(request, game_id, player_id):
 	"""
 	Creates a accusation that is composed of a character, weapon and room
 	"""
+	actionStart = time.time()
 	# parse request
 	# validate necessary fields are present
 	vpp = validatePostParams(request, ["suspect_id", "room_id", "weapon_id"])
@@ -691,9 +726,9 @@ def make_suggestion_controller(request, game_id, player_id):
 	try:
 		game = Game.objects.get(id=game_id)
 		player = Player.objects.get(id=player_id)
-		suspect = Character.objects.get(card_id = suspect_id)
-		room = Room.objects.get(card_id = room_id)
-		weapon = Weapon.objects.get(card_id = weapon_id)
+		suspect = getCatalog().character(suspect_id)
+		room = getCatalog().room(room_id)
+		weapon = getCatalog().weapon(weapon_id)
 	except Game.DoesNotExist:
 		logger.error('invalid game_id')
 		return HttpResponse(status=422, content="invalid game_id")
@@ -723,6 +758,7 @@ def make_suggestion_controller(request, game_id, player_id):
 		logger.error('it is not this players turn')
 		return HttpResponse(status=403, content="it is not this players turn")
 
+	previousUpdateTime = game.lastUpdateTime
 	sugg = Suggestion.createSuggestion(turn, suspect, room, weapon)
 	game.registerGameUpdate("<b>{}</b> suggested it was <b>{}</b> in the <b>{}</b> with the <b>{}</b>".format(
 		player.user.username,
@@ -734,6 +770,7 @@ def make_suggestion_controller(request, game_id, player_id):
 	actionStatus = turn.takeAction(sugg)
 	if actionStatus is not None:
 		return(HttpResponse(status = 500, content = "error making suggestion"))
+	ActionTiming.record(game.id, "suggestion", player, actionStart, previousUpdateTime)
 
 
 
@@ -744,6 +781,7 @@ def make_accusation_controller(request, game_id, player_id):
 	"""
 	Creates a accusation that is composed of a character, weapon and room.
 	"""
+	actionStart = time.time()
 	# parse request
 	# validate necessary fields are present
 	vpp = validatePostParams(request, ["suspect_id", "room_id", "weapon_id"])
@@ -758,9 +796,9 @@ def make_accusation_controller(request, game_id, player_id):
 	try:
 		game = Game.objects.get(id=game_id)
 		player = Player.objects.get(id=player_id)
-		suspect = Character.objects.get(card_id=suspect_id)
-		room = Room.objects.get(card_id=room_id)
-		weapon = Weapon.objects.get(card_id=weapon_id)
+		suspect = getCatalog().character(suspect_id)
+		room = getCatalog().room(room_id)
+		weapon = getCatalog().weapon(weapon_id)
 	except Game.DoesNotExist:
 		logger.error('invalid game_id')
 		return HttpResponse(status=422, content="invalid game_id")
@@ -790,6 +828,7 @@ def make_accusation_controller(request, game_id, player_id):
 		logger.error('it is not this players turn')
 		return HttpResponse(status=403, content="it is not this players turn")
 
+	previousUpdateTime = game.lastUpdateTime
 	acc = Accusation.createAccusation(turn, suspect, room, weapon)
 
 	game.registerGameUpdate(
@@ -803,6 +842,7 @@ def make_accusation_controller(request, game_id, player_id):
 	actionStatus = turn.takeAction(acc)
 	if actionStatus is not None:
 		return (HttpResponse(status=500, content="error making accusation"))
+	ActionTiming.record(game.id, "accusation", player, actionStart, previousUpdateTime)
 
 	request.method = "GET"
 	return playerturn(request, game_id)
@@ -827,7 +867,7 @@ def manualsheetitemcheck(request, game_id, player_id):
 	try:
 		game = Game.objects.get(id=game_id)
 		player = Player.objects.get(id=player_id)
-		card = Card.objects.get(card_id = card_id)
+		card = getCatalog().card(card_id)
 	except Game.DoesNotExist:
 		logger.error('invalid game_id')
 		return HttpResponse(status=422, content="invalid game_id")
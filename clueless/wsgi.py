@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clueless.settings")
 
 application = get_wsgi_application()
+
+#cards are static, load them once per worker before the first request
+from clueless.catalog import preloadCatalog
+preloadCatalog()